@@ -1,20 +1,40 @@
+import atexit
+import hashlib
+import json
+import logging
 import os
-from flask import Flask, request, render_template, redirect, url_for
-from sqlalchemy import create_engine, text
+import threading
+from collections import OrderedDict
+from flask import Flask, g, jsonify, request, render_template, redirect, url_for
+from sqlalchemy import text
 from datetime import datetime, date
-from model.predict import predict_single_task, batch_predict_missing_tasks
-import pandas as pd
-import pickle
-from train_model import retrain_model
-
-
-# 絶対パスを使ってデータベースファイルを指定する
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
+from model.worker import PredictionWorker, PREDICTION_WORKER_ENABLED
+from model.trainer import notify_completion
+from model import features, online
+import planner
+from db import get_engine, read_transaction
+from log_config import setup_logging
+import metrics
+from migrations import run_migrations
+from settings_service import load_available_hours, load_timetable, save_settings
+from tenant import USER_ID_HEADER, current_user_id, resolve_user_id
+import fragment_cache
+import temporal
+import work_sessions
+
+
+# ログはキュー経由で別スレッドから出力する（LOG_LEVEL で変更）
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-engine = create_engine(DATABASE_URI, echo=True)
+# 署名付きセッション（tenant.py で利用者を決める）の鍵。無ければセッションは使わない
+app.secret_key = os.environ.get("SECRET_KEY")
+# 予測・学習と共通の設定済みエンジン（db.py）
+engine = get_engine()
+
+# エンドポイントごとの処理時間・SQL の回数と時間を計測し、/metrics で返す（ほかの before_request より先に登録する）
+metrics.init_app(app, engine)
 
 # 英語曜日とその数値へのマッピング（index.html 用）
 weekday_mapping = {
@@ -31,208 +51,381 @@ weekday_mapping = {
 jp_days = ["月", "火", "水", "木", "金", "土", "日"]
 jp_to_int = {"月": 0, "火": 1, "水": 2, "木": 3, "金": 4, "土": 5, "日": 6}
 
-# 必要なタスク予測のバッチ処理（必要なら両箇所呼び出しを調整）
-batch_predict_missing_tasks()
+# スキーマを最新にする（適用済みのマイグレーションは飛ばす）
+run_migrations(engine)
 
-def maybe_generate_today_tasks():
-    today = date.today()
-    today_str = today.isoformat()
-    weekday = today.weekday()
 
-    with engine.begin() as conn:
-        # 既に今日のタスクが割り当てられているかチェック
-        count = conn.execute(text("""
-            SELECT COUNT(*) FROM task
-            WHERE assigned_for_today = 1 AND assigned_date = :today
-        """), {"today": today_str}).scalar()
 
-        if count > 0:
-            return  # 今日のタスクリストが既に生成されている
+def _on_tasks_scored(task_ids):
+    """予測ワーカーが予測時間を保存したら、そのタスクを持ち主の日程に入れる。"""
+    if task_ids is None:
+        # 起動時の一括予測など、どのタスクか分からないときは全員の日程を次のアクセスで作り直す
+        with engine.begin() as conn:
+            planner.expire_all_plans(conn)
+        invalidate_plan_cache()
+        return
 
-        # 前日までの割り当てをリセット
-        conn.execute(text("""
-            UPDATE task
-            SET assigned_for_today = 0, assigned_date = NULL
-            WHERE assigned_for_today = 1
-        """))
-
-        # 今日使える時間の85%（分単位）
-        available = conn.execute(text("""
-            SELECT available_hours FROM available_time WHERE weekday = :wd
-        """), {"wd": weekday}).scalar() or 0
-        limit_minutes = int(available * 60 * 0.85)
-
-        # 未完了タスク（予測時間あり）を締切昇順で取得
-        candidates = conn.execute(text("""
-            SELECT id, predicted_time FROM task
-            WHERE time_spent IS NULL AND predicted_time IS NOT NULL AND is_deleted = 0
-            ORDER BY due_date ASC, predicted_time ASC
-        """)).fetchall()
-
-        total = 0.0  # 分単位で累積
-        for task in candidates:
-            if task.predicted_time is None:
-                continue
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            SELECT id, user_id FROM task WHERE id IN (SELECT value FROM json_each(:ids))
+        """), {"ids": json.dumps([int(i) for i in task_ids])}).fetchall()
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row.user_id, []).append(row.id)
+        for user_id, ids in by_user.items():
+            # 今日の日程がまだ無ければ、作るときに一緒に入る。あれば何件でも今日の分は差分で入れる
+            if not planner.ensure_plan(conn, user_id):
+                planner.replan_for_tasks(conn, user_id, ids)
+    for user_id in by_user:
+        invalidate_plan_cache(user_id)
 
-            try:
-                predicted_minutes = float(task.predicted_time) * 60  # ← 🔧 時間 → 分に変換
-            except (ValueError, TypeError):
-                continue
 
-            if total + predicted_minutes <= limit_minutes:
-                conn.execute(text("""
-                    UPDATE task
-                    SET assigned_for_today = 1, assigned_date = :today
-                    WHERE id = :id
-                """), {"id": task.id, "today": today_str})
-                total += predicted_minutes
-            else:
-                break
+# タイマーのハートビートはメモリでまとめ、数秒おきに別スレッドで書き込む（終了時に残りを書く）
+heartbeats = work_sessions.HeartbeatBuffer(engine).start()
+atexit.register(heartbeats.flush)
 
-    print(f"[DEBUG] today={today_str}, weekday={weekday}, limit_minutes={limit_minutes}")
-    print(f"[DEBUG] task候補数={len(candidates)}")
 
-    for task in candidates:
-        print(f"[DEBUG] タスクID {task.id} → predicted_minutes = {predicted_minutes}")
+def maybe_generate_today_tasks(user_id):
+    """今日からの日程（plan テーブル）がまだ作られていなければ、数日分まとめて作る。"""
+    today = date.today()
+    with engine.begin() as conn:
+        rebuilt = planner.ensure_plan(conn, user_id, today)
+
+    if rebuilt:
+        logger.debug("user_id=%d, today=%s, %d日分のプランを作成しました",
+                     user_id, today.isoformat(), planner.PLAN_HORIZON_DAYS)
+
+
+# 日次プランのキャッシュ（ワーカープロセスごと・利用者ごと）
+# 利用者ごとに (日付, データバージョン) を覚えておく。書き込み系エンドポイントがその利用者のバージョンを進めると
+# 次のリクエストで一度だけ maybe_generate_today_tasks() が走り、それ以外は辞書参照だけで済む。
+# 日付をキーに含めているので、日付が変わった最初のリクエストでも自動的に作り直される。
+# 覚えておく利用者数は PLAN_CACHE_MAX_USERS まで（古いものから捨てる）。
+PLAN_CACHE_MAX_USERS = 10000
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+_data_versions = {}
+
+
+def invalidate_plan_cache(user_id=None):
+    """タスク・設定を書き換えたあとに呼び、その利用者（None なら全員）の日次プランのキャッシュを無効化する。"""
+    with _plan_cache_lock:
+        if user_id is None:
+            _plan_cache.clear()
+            _data_versions.clear()
+            return
+        _data_versions[user_id] = _data_versions.get(user_id, 0) + 1
+        _plan_cache.pop(user_id, None)
+
+
+def ensure_today_plan(user_id):
+    """利用者の今日のプランが (日付, データバージョン) に対して生成済みでなければ生成する。"""
+    key = (date.today().isoformat(), _data_versions.get(user_id, 0))
+    if _plan_cache.get(user_id) == key:
+        return
+
+    with _plan_cache_lock:
+        if _plan_cache.get(user_id) == key:
+            return
+        maybe_generate_today_tasks(user_id)
+        _plan_cache[user_id] = key
+        _plan_cache.move_to_end(user_id)
+        while len(_plan_cache) > PLAN_CACHE_MAX_USERS:
+            _plan_cache.popitem(last=False)
+
+
+# 未予測タスクの予測はバックグラウンドのワーカーに任せる（起動時に一度まとめて予測する）
+# ワーカーを止めていると enqueue_sweep はここで予測し、_on_tasks_scored → invalidate_plan_cache を呼ぶので、その定義より後に置く
+prediction_worker = PredictionWorker(on_scored=_on_tasks_scored)
+if PREDICTION_WORKER_ENABLED:
+    prediction_worker.start()
+prediction_worker.enqueue_sweep()
 
 
 @app.before_request
 def before_request():
+    # ヘッダ・クッキーから利用者を決める（無ければ user_id = 1）
+    g.user_id = resolve_user_id(request)
     # setup や timetable ページからのアクセスはタスク自動生成をスキップする
-    if request.endpoint not in ("setup", "edit_timetable", "static"):
-        maybe_generate_today_tasks()
+    if request.endpoint not in ("setup", "edit_timetable", "static", "metrics", "session_heartbeat"):
+        ensure_today_plan(g.user_id)
+
+# 「残りのやることリスト」の 1 ページの件数
+REMAINING_PAGE_SIZE = 50
+
+# キーセットの最初のページの位置（どの due_day よりも小さい値）
+FIRST_PAGE_AFTER_DUE = -(2 ** 31)
+
+# 締切順の並び順（締切日が読めないタスクは最後）。索引 idx_task_user_open_due と同じ式
+DUE_ORDER = temporal.DUE_ORDER_SQL.format(column="t.due_day")
+
+# トップページ用のクエリ。section 0 = 今日やること、1 = 残りのやることリスト、2 = 今日の時間割。
+# 残りのリストは (due_order, id) のキーセットでページングし、表示に使う列だけを返す。
+# キーセットの条件は、索引の範囲で読めるように due_order >= :after_due も付ける。
+# 断片キャッシュ（fragment_cache.py）にあるセクションは :with_today などを 0 にして読まない。
+MAIN_VIEW_SQL = f"""
+    SELECT 0 AS section, t.id, t.subject, t.category, t.predicted_time, t.due_date, {DUE_ORDER} AS due_order,
+           t.is_completed, NULL AS period
+    FROM plan p
+    JOIN task t ON t.id = p.task_id
+    WHERE :with_today AND p.user_id = :user_id AND p.plan_date = :today AND t.is_completed = 0 AND t.is_deleted = 0
+    UNION ALL
+    SELECT * FROM (
+        SELECT 1 AS section, t.id, t.subject, t.category, t.predicted_time, t.due_date, {DUE_ORDER} AS due_order,
+               t.is_completed, NULL AS period
+        FROM task t
+        WHERE :with_remaining AND t.user_id = :user_id AND t.is_completed = 0 AND t.is_deleted = 0
+          AND {DUE_ORDER} >= :after_due AND ({DUE_ORDER}, t.id) > (:after_due, :after_id)
+          AND NOT EXISTS (
+              SELECT 1 FROM plan p WHERE p.task_id = t.id AND p.plan_date = :today
+          )
+        ORDER BY {DUE_ORDER}, t.id
+        LIMIT :limit
+    )
+    UNION ALL
+    SELECT 2 AS section, NULL, subject, NULL, NULL, NULL, NULL, NULL, period
+    FROM timetable
+    WHERE :with_timetable AND user_id = :user_id AND weekday = :weekday
+    ORDER BY section, due_order, id, period
+"""
+
+
+def format_time(minutes_float):
+    if minutes_float is None:
+        return "-"
+    try:
+        total_minutes = int(round(float(minutes_float)))
+        if total_minutes == 0 and float(minutes_float) > 0:
+            total_minutes = 1  # 小数点切り捨てによるゼロ回避
+        h, m = divmod(total_minutes, 60)
+        return f"{h}時間{m}分" if h else f"{m}分"
+    except Exception as e:
+        logger.warning("所要時間を表示できません: %r (%s)", minutes_float, e)
+        return "-"
+
 
 @app.route("/")
 def index():
-    from model.predict import batch_predict_missing_tasks
-    batch_predict_missing_tasks()
-
-    def format_time(minutes_float):
-        if minutes_float is None:
-            return "-"
-        try:
-            total_minutes = int(round(float(minutes_float)))
-            if total_minutes == 0 and float(minutes_float) > 0:
-                total_minutes = 1  # 小数点切り捨てによるゼロ回避
-            h, m = divmod(total_minutes, 60)
-            return f"{h}時間{m}分" if h else f"{m}分"
-        except Exception as e:
-            print(e)
-            return "-"
+    today_str = date.today().isoformat()
+    today_weekday = weekday_mapping[datetime.now().strftime("%A")]
 
+    # 「残りのやることリスト」のページ位置（前ページ最後の (due_order, id)）
+    after_due = request.args.get("after_due", FIRST_PAGE_AFTER_DUE, type=int)
+    after_id = request.args.get("after_id", 0, type=int)
 
+    # 描画済みの断片は (ブロック, 利用者, 引数..., バージョン) で引く。
+    # タスクの一覧はデータバージョン、時間割は時間割バージョンが変わるまで同じものを使う
+    user_id = current_user_id()
     with engine.begin() as conn:
-        # 曜日の変換
-        today_weekday_name = datetime.now().strftime("%A")
-        today_weekday = weekday_mapping[today_weekday_name]
-
-        # tasks_today の取得と辞書への変換
-        tasks_today_result = conn.execute(text("""
-            SELECT * FROM task
-            WHERE assigned_for_today = 1 AND is_completed = 0 AND is_deleted = 0
-            ORDER BY due_date
-        """)).mappings().all()
-        tasks_today = [dict(row) for row in tasks_today_result]
-
-
-        tasks_remaining = conn.execute(text("""
-            SELECT * FROM task
-            WHERE assigned_for_today = 0 AND is_completed = 0 AND is_deleted = 0
-            ORDER BY due_date
-        """)).mappings().all()
-        tasks_remaining = [dict(now) for now in tasks_remaining]
-
-
-        # timetable の取得と辞書への変換
-        timetable_result = conn.execute(text("""
-            SELECT * FROM timetable
-            WHERE weekday = :weekday
-            ORDER BY period
-        """), {"weekday": today_weekday}).mappings().all()
-        timetable = [dict(row) for row in timetable_result]
-
-        # 完了タスクの ID を取得（チェックボックス表示用）
-        completed_task_ids = conn.execute(text("""
-            SELECT id FROM task WHERE is_completed = 1
-        """)).mappings().all()
-        completed_tasks = {str(row.id) for row in completed_task_ids}
-
-        # 各タスクの予想時間表示を追加
-        for task in tasks_today:
-            task["predicted_time_display"] = format_time(task["predicted_time"])
-        for task in tasks_remaining:
+        version, timetable_version = fragment_cache.load_versions(conn, user_id)
+        keys = {
+            "today": ("index_today", user_id, today_str, version),
+            "remaining": ("index_remaining", user_id, today_str, after_due, after_id, version),
+            "timetable": ("index_timetable", user_id, today_weekday, timetable_version),
+        }
+        fragments = {name: fragment_cache.get(key) for name, key in keys.items()}
+
+        # キャッシュに無いセクションだけを 1 回のクエリで取る
+        rows = []
+        if None in fragments.values():
+            rows = conn.execute(text(MAIN_VIEW_SQL), {
+                "user_id": user_id,
+                "today": today_str,
+                "weekday": today_weekday,
+                "after_due": after_due,
+                "after_id": after_id,
+                "limit": REMAINING_PAGE_SIZE + 1,
+                "with_today": fragments["today"] is None,
+                "with_remaining": fragments["remaining"] is None,
+                "with_timetable": fragments["timetable"] is None,
+            }).mappings().all()
+
+    tasks_today, tasks_remaining, timetable = [], [], []
+    for row in rows:
+        if row["section"] == 2:
+            timetable.append({"period": row["period"], "subject": row["subject"]})
+            continue
+        task = dict(row)
+        if task["predicted_time"] is None:
+            task["predicted_time_display"] = "予測中…"  # 予測ワーカーがまだ処理していない
+        else:
             task["predicted_time_display"] = format_time(task["predicted_time"])
+        (tasks_today if row["section"] == 0 else tasks_remaining).append(task)
+
+    # 1件多く取っておき、次のページがあるかを判定する
+    next_page = None
+    if len(tasks_remaining) > REMAINING_PAGE_SIZE:
+        tasks_remaining = tasks_remaining[:REMAINING_PAGE_SIZE]
+        last = tasks_remaining[-1]
+        next_page = {"after_due": last["due_order"], "after_id": last["id"]}
+
+    if fragments["today"] is None:
+        fragments["today"] = fragment_cache.put(
+            keys["today"], render_template("fragments/index_today.html", tasks_today=tasks_today))
+    if fragments["remaining"] is None:
+        fragments["remaining"] = fragment_cache.put(
+            keys["remaining"], render_template("fragments/index_remaining.html",
+                                               tasks_remaining=tasks_remaining, next_page=next_page))
+    if fragments["timetable"] is None:
+        fragments["timetable"] = fragment_cache.put(
+            keys["timetable"], render_template("fragments/index_timetable.html", timetable=timetable))
 
     return render_template("index.html",
-                           tasks_today=tasks_today,
-                           tasks_remaining=tasks_remaining,
-                           timetable=timetable,
-                           completed_tasks=completed_tasks)
-
+                           today_html=fragments["today"],
+                           remaining_html=fragments["remaining"],
+                           timetable_html=fragments["timetable"])
+
+
+# ---- JSON API（スマホアプリ・ウィジェット向け） ----
+# ETag は (API の種類, 利用者, データバージョン, 引数) から作る。
+# データバージョンは task / plan / timetable / available_time への書き込みでトリガーが進める（migrations.py）ので、
+# If-None-Match が一致すれば data_version の 1 行を読むだけで 304 を返せる。
+
+API_TASKS_MAX_LIMIT = 200
+
+DATA_VERSION_SQL = text("SELECT version FROM data_version WHERE user_id = :user_id")
+
+API_TODAY_SQL = text(f"""
+    SELECT t.id, t.subject, t.category, t.difficulty, t.predicted_time, t.due_date
+    FROM plan p
+    JOIN task t ON t.id = p.task_id
+    WHERE p.user_id = :user_id AND p.plan_date = :today AND t.is_completed = 0 AND t.is_deleted = 0
+    ORDER BY {DUE_ORDER}, t.id
+""")
+
+API_TIMETABLE_SQL = text("""
+    SELECT period, subject FROM timetable
+    WHERE user_id = :user_id AND weekday = :weekday
+    ORDER BY period
+""")
+
+API_TASKS_SQL = text(f"""
+    SELECT t.id, t.subject, t.category, t.difficulty, t.predicted_time, t.due_date, t.due_day
+    FROM task t
+    WHERE t.user_id = :user_id AND t.is_completed = 0 AND t.is_deleted = 0
+      AND {DUE_ORDER} >= :after_due AND ({DUE_ORDER}, t.id) > (:after_due, :after_id)
+    ORDER BY {DUE_ORDER}, t.id
+    LIMIT :limit
+""")
+
+
+def _conditional_json(kind, build, *key):
+    """
+    データバージョンから ETag を作り、If-None-Match と一致すれば 304、そうでなければ build(conn) の結果を JSON で返す。
+    データバージョンと中身は同じ読み込みトランザクション（同じスナップショット）で読むので、ETag と中身が食い違うことはない。
+    """
+    user_id = current_user_id()
+    with read_transaction(engine) as conn:
+        version = conn.execute(DATA_VERSION_SQL, {"user_id": user_id}).scalar() or 0
+        etag = hashlib.sha1(json.dumps([kind, user_id, version, *key]).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify(build(conn, user_id))
+    response.set_etag(etag)
+    # 利用者ごとに中身が違うので共有キャッシュには置かせず、毎回 ETag で確認させる
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.update((USER_ID_HEADER, "Cookie"))
+    return response
+
+
+@app.route("/api/today")
+def api_today():
+    """今日やることと今日の時間割。"""
+    today_str = date.today().isoformat()
+    today_weekday = date.today().weekday()
+
+    def build(conn, user_id):
+        params = {"user_id": user_id, "today": today_str, "weekday": today_weekday}
+        return {
+            "date": today_str,
+            "tasks": [dict(row) for row in conn.execute(API_TODAY_SQL, params).mappings()],
+            "timetable": [dict(row) for row in conn.execute(API_TIMETABLE_SQL, params).mappings()],
+        }
+
+    return _conditional_json("today", build, today_str)
+
+
+@app.route("/api/tasks")
+def api_tasks():
+    """
+    未完了のタスク一覧。(締切順, id) のキーセットでページングする（次のページは next の値を付けて呼ぶ）。
+    締切日が読めないタスク（due_day が null）は最後に並ぶ。
+    """
+    after_due = request.args.get("after_due", FIRST_PAGE_AFTER_DUE, type=int)
+    after_id = request.args.get("after_id", 0, type=int)
+    limit = min(max(request.args.get("limit", REMAINING_PAGE_SIZE, type=int), 1), API_TASKS_MAX_LIMIT)
+
+    def build(conn, user_id):
+        rows = conn.execute(API_TASKS_SQL, {
+            "user_id": user_id, "after_due": after_due, "after_id": after_id, "limit": limit + 1,
+        }).mappings().all()
+        tasks = [dict(row) for row in rows[:limit]]
+        next_page = None
+        if len(rows) > limit:
+            next_page = {"after_due": temporal.due_order(tasks[-1]["due_day"]), "after_id": tasks[-1]["id"]}
+        return {"tasks": tasks, "next": next_page}
+
+    return _conditional_json("tasks", build, after_due, after_id, limit)
+
+
+@app.route("/api/sessions/heartbeat", methods=["POST"])
+def session_heartbeat():
+    """タイマーの経過秒数を受け取る。DB には書かず、work_sessions.HeartbeatBuffer にまとめておく。"""
+    data = request.get_json(silent=True) or {}
+    try:
+        session_key = str(data["session_id"])
+        task_id = int(data["task_id"])
+        elapsed_seconds = float(data["elapsed_seconds"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "session_id・task_id・elapsed_seconds が必要です"}), 400
+    if not session_key:
+        return jsonify({"error": "session_id が空です"}), 400
 
+    heartbeats.record(current_user_id(), session_key, task_id, elapsed_seconds, bool(data.get("running", True)))
+    return "", 204
 
 
-from sqlalchemy import text
+def _end_session(conn, user_id, task_id, time_spent, status):
+    """フォームに session_id があれば、作業セッションを閉じる。"""
+    session_key = request.form.get("session_id")
+    if not session_key:
+        return
+    heartbeats.discard(user_id, session_key)
+    elapsed_seconds = request.form.get("elapsed_seconds", type=float)
+    work_sessions.end_session(conn, user_id, session_key, task_id,
+                              elapsed_seconds if elapsed_seconds is not None else time_spent * 60, status)
 
-from flask import Flask, render_template, request, redirect, url_for, flash
-from sqlalchemy import create_engine, text
 
 
 @app.route("/settings", methods=["GET", "POST"])
 def settings():
     if request.method == "POST":
         # フォームから available_time の取得
-        available_time_entries = []
+        available_hours = {}
         for i in range(7):  # 月〜日：0〜6
             hours = request.form.get(f"available_{i}", 0)
             try:
-                available_hours = float(hours)
+                available_hours[i] = float(hours)
             except ValueError:
-                available_hours = 0
-            available_time_entries.append({
-                "weekday": i,
-                "available_hours": available_hours
-            })
+                available_hours[i] = 0
 
         # フォームから timetable の取得（1〜5限、月〜土：0〜5）
-        timetable_entries = []
+        timetable = {}
         for day_index in range(6):  # 月〜土
             for period in range(1, 6):  # 1〜5限
-                key = f"timetable_{day_index}_{period}"
-                subject = request.form.get(key, "").strip()
+                subject = request.form.get(f"timetable_{day_index}_{period}", "").strip()
                 if subject:
-                    timetable_entries.append({
-                        "weekday": day_index,
-                        "period": period,
-                        "subject": subject
-                    })
+                    timetable[(day_index, period)] = subject
 
+        # 変わったところだけ保存し、使える時間が変わった曜日以降の日程を作り直す
+        user_id = current_user_id()
         with engine.begin() as conn:
-            # 1. available_time を保存（上書き）
-            conn.execute(text("DELETE FROM available_time"))
-            for entry in available_time_entries:
-                conn.execute(text("""
-                    INSERT INTO available_time (weekday, available_hours)
-                    VALUES (:weekday, :available_hours)
-                """), entry)
-
-            # 2. timetable を保存（上書き）
-            conn.execute(text("DELETE FROM timetable"))
-            for entry in timetable_entries:
-                conn.execute(text("""
-                    INSERT INTO timetable (weekday, period, subject)
-                    VALUES (:weekday, :period, :subject)
-                """), entry)
-
-            # 3. 今日のタスク割当をリセット（assigned_for_todayフラグをクリア）
-            conn.execute(text("""
-                UPDATE task
-                SET assigned_for_today = 0, assigned_date = NULL
-                WHERE assigned_for_today = 1
-            """))
-
-        # 4. 今日のやることリストを再選定（available_timeの60%で）
-        maybe_generate_today_tasks()
+            changed_hours, changed_slots = save_settings(conn, user_id, available_hours, timetable)
+        if changed_hours:
+            invalidate_plan_cache(user_id)
+        if changed_slots:
+            fragment_cache.invalidate(user_id)
 
         return redirect(url_for("index"))
 
@@ -246,7 +439,8 @@ def settings():
 @app.route("/start_task/<int:task_id>")
 def start_task(task_id):
     with engine.begin() as conn:
-        task = conn.execute(text("SELECT id FROM task WHERE id = :id"), {"id": task_id}).fetchone()
+        task = conn.execute(text("SELECT id FROM task WHERE id = :id AND user_id = :user_id"),
+                            {"id": task_id, "user_id": current_user_id()}).fetchone()
         if not task:
             return "タスクが見つかりません", 404
     return render_template("start_task.html", task_id=task_id)
@@ -258,14 +452,29 @@ def finish_task(task_id):
     except (ValueError, KeyError):
         return "Invalid input", 400
 
+    user_id = current_user_id()
     with engine.begin() as conn:
         stmt = text("""
             UPDATE task
             SET time_spent = :time_spent,
-                is_completed = 1
-            WHERE id = :task_id
+                is_completed = 1,
+                completed_at = :completed_at,
+                completed_epoch = :completed_epoch
+            WHERE id = :task_id AND user_id = :user_id
         """)
-        conn.execute(stmt, {"time_spent": time_spent, "task_id": task_id})
+        completed_at = datetime.now()
+        result = conn.execute(stmt, {"time_spent": time_spent, "task_id": task_id, "user_id": user_id,
+                                     "completed_at": completed_at,
+                                     "completed_epoch": temporal.epoch_seconds(completed_at)})
+        if result.rowcount:
+            online.update_from_task(conn, task_id, time_spent)
+            features.materialize(conn, [task_id])
+            # 今日の日程から外し、空いた時間を次の候補で埋める（変わった行だけ書く）
+            planner.remove_from_plan(conn, user_id, task_id)
+            _end_session(conn, user_id, task_id, time_spent, work_sessions.FINISHED)
+    invalidate_plan_cache(user_id)
+    # 別プロセスで差分学習（リクエストは待たない）
+    notify_completion()
 
     return redirect(url_for("index"))
 
@@ -278,44 +487,56 @@ def add_task():
         difficulty = int(request.form["difficulty"])
         due_date = request.form["due_date"]
 
-        predicted_time = predict_single_task(subject, category, difficulty, due_date, datetime.now())
-
+        # 所要時間の予測はワーカーに任せ、ここでは予測時間なしで登録する
+        user_id = current_user_id()
+        created_at = datetime.now()
         with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO task (subject, category, difficulty, due_date, created_at, predicted_time)
-                VALUES (:subject, :category, :difficulty, :due_date, :created_at, :predicted_time)
+            result = conn.execute(text("""
+                INSERT INTO task (user_id, subject, category, difficulty, due_date, created_at, due_day, created_epoch)
+                VALUES (:user_id, :subject, :category, :difficulty, :due_date, :created_at, :due_day, :created_epoch)
             """), {
+                "user_id": user_id,
                 "subject": subject,
                 "category": category,
                 "difficulty": difficulty,
                 "due_date": due_date,
-                "created_at": datetime.now(),
-                "predicted_time": predicted_time
+                "created_at": created_at,
+                "due_day": temporal.day_number(due_date),
+                "created_epoch": temporal.epoch_seconds(created_at),
             })
-        maybe_generate_today_tasks()
+            # 学習・一括予測用の特徴量はここで一度だけ作る
+            features.materialize(conn, [result.lastrowid])
+        invalidate_plan_cache(user_id)
+        # 予測が保存されると _on_tasks_scored() で日程に入る
+        prediction_worker.enqueue([result.lastrowid])
         return redirect(url_for("index"))
 
-    # GET: 時間割表示
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-
-    timetable_grid = [["" for _ in range(6)] for _ in range(5)]  # period (行) × weekday (列)
-
+    # GET: 時間割表示（描画済みの表は時間割バージョンが変わるまで使い回す）
+    user_id = current_user_id()
     with engine.begin() as conn:
-        results = conn.execute(text("""
-            SELECT weekday, period, subject FROM timetable
-            WHERE weekday IN (0, 1, 2, 3, 4, 5)
-            ORDER BY weekday, period
-        """)).mappings().all()
-
-    for row in results:
-        weekday = row["weekday"]
-        period = row["period"]
-        subject = row["subject"]
-
-        if 1 <= period <= 5 and 0 <= weekday <= 5:
-            timetable_grid[period - 1][weekday] = subject
-
-    return render_template("add_task.html", timetable_grid=timetable_grid)
+        _, timetable_version = fragment_cache.load_versions(conn, user_id)
+        key = ("add_task_timetable", user_id, timetable_version)
+        timetable_html = fragment_cache.get(key)
+        if timetable_html is None:
+            results = conn.execute(text("""
+                SELECT weekday, period, subject FROM timetable
+                WHERE user_id = :user_id AND weekday IN (0, 1, 2, 3, 4, 5)
+                ORDER BY weekday, period
+            """), {"user_id": user_id}).mappings().all()
+
+    if timetable_html is None:
+        timetable_grid = [["" for _ in range(6)] for _ in range(5)]  # period (行) × weekday (列)
+        for row in results:
+            weekday = row["weekday"]
+            period = row["period"]
+            subject = row["subject"]
+
+            if 1 <= period <= 5 and 0 <= weekday <= 5:
+                timetable_grid[period - 1][weekday] = subject
+        timetable_html = fragment_cache.put(
+            key, render_template("fragments/timetable_grid.html", timetable_grid=timetable_grid))
+
+    return render_template("add_task.html", timetable_html=timetable_html)
 
 
 @app.route("/start_selected_task", methods=["GET"])
@@ -348,84 +569,60 @@ def setup():
     }
 
     if request.method == "POST":
-        # --- ① 利用可能時間の更新 ---
-        available_times = {}
+        # 利用可能時間と時間割を、変わったところだけ 1 トランザクションで保存する
+        available_hours = {}
         for index, day in enumerate(eng_days):
             value = request.form.get(f"available_{index}", "")
             try:
-                available_times[day] = float(value)
+                available_hours[eng_to_int[day]] = float(value)
             except ValueError:
-                available_times[day] = 0.0
-            print(f"[DEBUG] Available time for {day}: {available_times[day]}")
-        with engine.begin() as conn:
-            conn.execute(text("DELETE FROM available_time"))
-            for day, hours in available_times.items():
-                conn.execute(
-                    text("""
-                        INSERT INTO available_time (weekday, available_hours)
-                        VALUES (:weekday, :hours)
-                    """),
-                    {"weekday": eng_to_int[day], "hours": hours}
-                )
-
-        # --- ② 時間割 (timetable) の更新：全件削除して再作成 ---
+                available_hours[eng_to_int[day]] = 0.0
+
+        timetable = {}
+        for day in eng_days:
+            for period in range(1, 6):
+                subject = request.form.get(f"timetable_{day}_{period}", "").strip()
+                if subject:
+                    timetable[(eng_to_int[day], period)] = subject
+
+        user_id = current_user_id()
         with engine.begin() as conn:
-            conn.execute(text("DELETE FROM timetable"))
-            for day in eng_days:
-                for period in range(1, 6):
-                    field_name = f"timetable_{day}_{period}"
-                    subject = request.form.get(field_name, "").strip()
-                    print(f"[DEBUG] Field '{field_name}': '{subject}'")
-                    if subject:
-                        conn.execute(
-                            text("""
-                                INSERT INTO timetable (weekday, period, subject)
-                                VALUES (:weekday, :period, :subject)
-                            """),
-                            {"weekday": eng_to_int[day], "period": period, "subject": subject}
-                        )
-            rows = conn.execute(text("SELECT weekday, period, subject FROM timetable")).fetchall()
-            if rows:
-                print("[DEBUG] Registered timetable records:")
-                for row in rows:
-                    print(f"  {eng_days[row.weekday]} {row.period} period: {row.subject}")
-            else:
-                print("[DEBUG] Timetable table is empty after INSERTs!")
-
-        # --- ③ タスクリスト生成アルゴリズムの再実行 ---
-        maybe_generate_today_tasks()
-
-        # ★ キャッシュクリアのためにエンジンのコネクションプールをクリア ★
-        engine.dispose()
-        # または、エンジン作成時に expire_on_commit=True を設定する方法も検討してください。
+            changed_hours, changed_slots = save_settings(conn, user_id, available_hours, timetable)
+        if changed_hours:
+            invalidate_plan_cache(user_id)
+        if changed_slots:
+            fragment_cache.invalidate(user_id)
 
         return redirect(url_for("index"))
 
-    # GET 時の処理
+    # GET 時の処理（時間割の表は時間割バージョンが変わるまで使い回す）
+    user_id = current_user_id()
     with engine.begin() as conn:
-        available_times = {}
-        rows = conn.execute(text("SELECT weekday, available_hours FROM available_time")).fetchall()
-        for row in rows:
-            available_times[eng_days[row.weekday]] = row.available_hours
-
-        timetable_entries = {}
-        rows = conn.execute(text("SELECT weekday, period, subject FROM timetable")).fetchall()
-        for row in rows:
-            timetable_entries[(row.weekday, row.period)] = row.subject
-
-    timetable_grid = []
-    for day_idx in range(len(eng_days)):
-        day_row = []
-        for period in range(1, 7):
-            day_row.append(timetable_entries.get((day_idx, period), ""))
-        timetable_grid.append(day_row)
+        available_times = {
+            eng_days[weekday]: hours
+            for weekday, hours in load_available_hours(conn, user_id).items()
+        }
+        _, timetable_version = fragment_cache.load_versions(conn, user_id)
+        key = ("setup_timetable", user_id, timetable_version)
+        timetable_html = fragment_cache.get(key)
+        if timetable_html is None:
+            timetable_entries = load_timetable(conn, user_id)
+
+    if timetable_html is None:
+        timetable_grid = []
+        for day_idx in range(len(eng_days)):
+            day_row = []
+            for period in range(1, 7):
+                day_row.append(timetable_entries.get((day_idx, period), ""))
+            timetable_grid.append(day_row)
+        timetable_html = fragment_cache.put(
+            key, render_template("fragments/setup_timetable.html", timetable_grid=timetable_grid))
 
     return render_template("setup.html",
                            available_times=available_times,
-                           timetable_grid=timetable_grid,
+                           timetable_html=timetable_html,
                            eng_days=eng_days)
 
-from flask import request, jsonify
 # app.py
 @app.route("/delete_task", methods=["POST"])
 def delete_task():
@@ -435,11 +632,16 @@ def delete_task():
 
     task_id = data["id"]
 
+    user_id = current_user_id()
     try:
         with engine.begin() as conn:
-            conn.execute(text("""
-                UPDATE task SET is_deleted = 1 WHERE id = :id
-            """), {"id": task_id})
+            result = conn.execute(text("""
+                UPDATE task SET is_deleted = 1, deleted_epoch = :deleted_epoch
+                WHERE id = :id AND user_id = :user_id AND is_deleted = 0
+            """), {"id": task_id, "user_id": user_id, "deleted_epoch": temporal.epoch_seconds(datetime.now())})
+            if result.rowcount:
+                planner.remove_from_plan(conn, user_id, int(task_id))
+        invalidate_plan_cache(user_id)
         return jsonify({"success": True}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -452,38 +654,32 @@ def edit_timetable():
     days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
     
     if request.method == "POST":
-        timetable_entries = []
+        timetable = {}
         # 各曜日の時間割を更新（フォームのフィールド名は "Monday_1", ... "Saturday_5" となる前提）
         for day in days:
             for period in range(1, 6):  # 5限まで
                 subject = request.form.get(f"{day}_{period}")
                 if subject:
-                    timetable_entries.append({
-                        "weekday": weekday_mapping[day],
-                        "period": period,
-                        "subject": subject
-                    })
+                    timetable[(weekday_mapping[day], period)] = subject
+        user_id = current_user_id()
         with engine.begin() as conn:
-            conn.execute(text("DELETE FROM timetable"))
-            for entry in timetable_entries:
-                conn.execute(text("""
-                    INSERT INTO timetable (weekday, period, subject)
-                    VALUES (:weekday, :period, :subject)
-                """), entry)
+            _, changed_slots = save_settings(conn, user_id, timetable=timetable)
+        if changed_slots:
+            fragment_cache.invalidate(user_id)
         return redirect(url_for("edit_timetable"))
 
     with engine.begin() as conn:
-        result = conn.execute(text("SELECT * FROM timetable")).fetchall()
+        timetable_entries = load_timetable(conn, current_user_id())
 
     # timetable_dict のキーを Monday～Saturday、各曜日は5つの期間で初期化
     timetable_dict = {day: [""] * 5 for day in days}
     # 反転マッピング：対象曜日のみ（月～Saturday）を対象とする
     reverse_weekday_mapping = {v: k for k, v in weekday_mapping.items() if k in days}
-    for row in result:
-        # row.weekday は整数（例: 0 = Monday, ..., 5 = Saturday）と想定
-        day_name = reverse_weekday_mapping.get(row.weekday, "Unknown")
-        if day_name != "Unknown" and 1 <= row.period <= 5:
-            timetable_dict[day_name][row.period - 1] = row.subject
+    for (weekday, period), subject in timetable_entries.items():
+        # weekday は整数（例: 0 = Monday, ..., 5 = Saturday）と想定
+        day_name = reverse_weekday_mapping.get(weekday, "Unknown")
+        if day_name != "Unknown" and 1 <= period <= 5:
+            timetable_dict[day_name][period - 1] = subject
 
     return render_template("edit_timetable.html", timetable=timetable_dict, days=days)
 
@@ -497,8 +693,10 @@ def partial_finish_task(task_id):
     except (ValueError, KeyError, AssertionError):
         return "Invalid input", 400
 
+    user_id = current_user_id()
     with engine.begin() as conn:
-        task = conn.execute(text("SELECT predicted_time FROM task WHERE id = :id"), {"id": task_id}).fetchone()
+        task = conn.execute(text("SELECT predicted_time FROM task WHERE id = :id AND user_id = :user_id"),
+                            {"id": task_id, "user_id": user_id}).fetchone()
         if not task:
             return "Task not found", 404
 
@@ -514,15 +712,28 @@ def partial_finish_task(task_id):
                 SET predicted_time = :remaining_time
                 WHERE id = :id
             """), {"remaining_time": remaining_time, "id": task_id})
+            planner.resize_in_plan(conn, user_id, task_id, remaining_time)
         else:
             # 完了時は time_spent 更新＆完了フラグも立てる
+            completed_at = datetime.now()
             conn.execute(text("""
                 UPDATE task
                 SET predicted_time = :remaining_time,
                     time_spent = :time_spent,
-                    is_completed = 1
+                    is_completed = 1,
+                    completed_at = :completed_at,
+                    completed_epoch = :completed_epoch
                 WHERE id = :id
-            """), {"remaining_time": remaining_time, "time_spent": time_spent, "id": task_id})
+            """), {"remaining_time": remaining_time, "time_spent": time_spent, "id": task_id,
+                  "completed_at": completed_at, "completed_epoch": temporal.epoch_seconds(completed_at)})
+            online.update_from_task(conn, task_id, time_spent)
+            features.materialize(conn, [task_id])
+            planner.remove_from_plan(conn, user_id, task_id)
+        _end_session(conn, user_id, task_id, time_spent,
+                     work_sessions.FINISHED if progress_percent >= 100 else work_sessions.STOPPED)
+    invalidate_plan_cache(user_id)
+    if progress_percent >= 100:
+        notify_completion()
 
     return redirect(url_for("index"))
 
@@ -531,6 +742,4 @@ def partial_finish_task(task_id):
 
 
 if __name__ == "__main__":
-    # 重複しないよう、必要に応じてバッチ処理を呼び出してください
-    batch_predict_missing_tasks()
     app.run(debug=True)
@@ -0,0 +1,110 @@
+"""
+完了・削除済みで保持期間を過ぎたタスクを task から task_archive に移す（ホット／コールドの分離）。
+
+一覧・日程づくりのクエリが読む task を小さく保つためのもの。seed_data.py などが入れた学習用の削除済みタスクもここで移る。
+ARCHIVE_BATCH_SIZE 件ずつ別トランザクションで移すので、Web アプリを止めずに実行できる（書き込みのロックは短い）。
+学習は特徴量ストア（model/features.py）を読む。移す前に特徴量の行を作っておくので、移したタスクも学習に使われる。
+最後に ANALYZE・PRAGMA optimize で統計を更新し、incremental vacuum で空いたページをファイルから返す。
+
+使い方: python archive_tasks.py [保持日数]   （cron などで 1 日 1 回）
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import temporal
+from db import get_engine
+from log_config import setup_logging
+from migrations import run_migrations
+from model import features
+
+# 完了・削除からこの日数が経ったタスクを移す
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("ARCHIVE_RETENTION_DAYS", 30))
+
+# 1 トランザクションで移す件数
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 1000))
+
+# task_archive に写す列（migrations.create_task_archive・add_task_temporal_columns・add_task_completed_epoch・add_task_deleted_epoch の列）
+ARCHIVED_COLUMNS = (
+    "id", "user_id", "subject", "category", "difficulty", "due_date", "created_at",
+    "predicted_time", "time_spent", "assigned_for_today", "assigned_date",
+    "is_completed", "is_deleted", "completed_at", "due_day", "created_epoch", "completed_epoch", "deleted_epoch",
+)
+
+
+def archive_batch(conn, cutoff, after_id, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    after_id より後の移せるタスクを batch_size 件まで移し、移した ID のリストを返す。
+    cutoff は epoch 秒（temporal.epoch_seconds()）。完了日時（無ければ削除日時、それも無ければ登録日時）がそれより前のものを移す。
+    """
+    ids = conn.execute(text("""
+        SELECT id FROM task
+        WHERE (is_completed = 1 OR is_deleted = 1) AND id > :after_id
+          AND COALESCE(completed_epoch, deleted_epoch, created_epoch) < :cutoff
+        ORDER BY id
+        LIMIT :limit
+    """), {"after_id": after_id, "cutoff": cutoff, "limit": batch_size}).scalars().all()
+    if not ids:
+        return []
+
+    features.materialize(conn, ids, refresh=False)
+    params = {"ids": json.dumps(ids), "archived_at": datetime.now()}
+    columns = ", ".join(ARCHIVED_COLUMNS)
+    conn.execute(text(f"""
+        INSERT INTO task_archive ({columns}, archived_at)
+        SELECT {columns}, :archived_at FROM task WHERE id IN (SELECT value FROM json_each(:ids))
+    """), params)
+    conn.execute(text("DELETE FROM plan WHERE task_id IN (SELECT value FROM json_each(:ids))"), params)
+    conn.execute(text("DELETE FROM task WHERE id IN (SELECT value FROM json_each(:ids))"), params)
+    return ids
+
+
+def archive_tasks(engine, retention_days=ARCHIVE_RETENTION_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """保持期間を過ぎた完了・削除済みタスクをすべて移し、移した件数を返す。"""
+    cutoff = temporal.epoch_seconds(datetime.now() - timedelta(days=retention_days))
+    moved, after_id = 0, 0
+    while True:
+        with engine.begin() as conn:
+            ids = archive_batch(conn, cutoff, after_id, batch_size)
+        if not ids:
+            return moved
+        moved += len(ids)
+        after_id = ids[-1]
+
+
+def optimize(engine):
+    """統計を更新し、空いたページをファイルから返す（トランザクションの外で実行する）。"""
+    raw = engine.raw_connection()
+    try:
+        sqlite = raw.driver_connection
+        sqlite.commit()
+        if sqlite.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # 既存の DB は一度だけ VACUUM して incremental に切り替える（新しい DB は db.py で最初から incremental）
+            print("🟡 auto_vacuum を INCREMENTAL に切り替えます（初回だけ VACUUM します）")
+            sqlite.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            sqlite.execute("VACUUM")
+        freed = sqlite.execute("PRAGMA freelist_count").fetchone()[0]
+        # executescript は文を最後まで実行する（execute だと incremental_vacuum が 1 ページしか返さない）
+        sqlite.executescript("ANALYZE; PRAGMA optimize; PRAGMA incremental_vacuum;")
+        return freed
+    finally:
+        raw.close()
+
+
+def main():
+    setup_logging()
+    retention_days = int(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_RETENTION_DAYS
+    engine = get_engine()
+    run_migrations(engine)
+
+    moved = archive_tasks(engine, retention_days)
+    print(f"✅ {moved} 件のタスクを task_archive に移しました（保持期間 {retention_days} 日）")
+    freed = optimize(engine)
+    print(f"✅ ANALYZE・PRAGMA optimize を実行し、空きページ {freed} ページを返しました")
+
+
+if __name__ == "__main__":
+    main()
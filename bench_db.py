@@ -0,0 +1,125 @@
+"""
+SQLite の同時読み書きのベンチマーク（db.py の設定の前後比較）。
+
+一時ファイルの DB にタスクを入れ、gunicorn のワーカーに見立てた複数プロセスで
+読み込み（index() の「残りのやることリスト」と同じ形のクエリ）と書き込み（タスク追加・完了）を同時に流し、
+1 秒あたりの処理数とロック待ちによるエラー数を比べる。
+- before: 以前と同じ素の create_engine()（ロールバックジャーナル、PRAGMA なし）
+- after: db.make_engine()（WAL、synchronous=NORMAL、busy_timeout、mmap、キャッシュ）
+
+使い方: python bench_db.py [読み込みプロセス数] [書き込みプロセス数] [秒数] [タスク数]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+
+from db import make_engine
+from migrations import run_migrations
+
+READ_SQL = text("""
+    SELECT id, subject, category, predicted_time, due_date
+    FROM task
+    WHERE is_completed = 0 AND is_deleted = 0
+    ORDER BY due_date, id
+    LIMIT 51
+""")
+
+
+def _engine(mode, uri):
+    if mode == "before":
+        return create_engine(uri)
+    return make_engine(uri, echo=False)
+
+
+def seed(mode, path, n):
+    engine = _engine(mode, f"sqlite:///{path}")
+    run_migrations(engine)
+    now = datetime.now()
+    rows = [
+        {
+            "subject": f"科目{i % 8}",
+            "category": "課題",
+            "difficulty": i % 5 + 1,
+            "due_date": (now + timedelta(days=i % 30)).strftime("%Y-%m-%d"),
+            "created_at": now,
+            "predicted_time": 30.0,
+        }
+        for i in range(n)
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO task (subject, category, difficulty, due_date, created_at, predicted_time, is_completed, is_deleted)
+            VALUES (:subject, :category, :difficulty, :due_date, :created_at, :predicted_time, 0, 0)
+        """), rows)
+    engine.dispose()
+
+
+def worker(mode, path, role, seconds, n, seed_value):
+    """seconds 秒間 role（read / write）の処理を繰り返し、(処理数, エラー数) を返す。"""
+    engine = _engine(mode, f"sqlite:///{path}")
+    rng = random.Random(seed_value)
+    ops = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            if role == "read":
+                with engine.connect() as conn:
+                    conn.execute(READ_SQL).fetchall()
+            else:
+                with engine.begin() as conn:
+                    conn.execute(text("""
+                        INSERT INTO task (subject, category, difficulty, due_date, created_at, is_completed, is_deleted)
+                        VALUES ('科目0', '課題', 3, :due, :now, 0, 0)
+                    """), {"due": datetime.now().strftime("%Y-%m-%d"), "now": datetime.now()})
+                    conn.execute(text("""
+                        UPDATE task SET time_spent = 30, is_completed = 1 WHERE id = :id
+                    """), {"id": rng.randint(1, n)})
+            ops += 1
+        except Exception:
+            errors += 1
+    engine.dispose()
+    return role, ops, errors
+
+
+def run(mode, readers, writers, seconds, n):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_db_")
+    path = os.path.join(tmp_dir, "bench.db")
+    try:
+        seed(mode, path, n)
+        roles = ["read"] * readers + ["write"] * writers
+        with ProcessPoolExecutor(max_workers=len(roles)) as pool:
+            results = list(pool.map(worker, [mode] * len(roles), [path] * len(roles), roles,
+                                    [seconds] * len(roles), [n] * len(roles), range(len(roles))))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    totals = {"read": [0, 0], "write": [0, 0]}
+    for role, ops, errors in results:
+        totals[role][0] += ops
+        totals[role][1] += errors
+    return {role: (ops / seconds, errors) for role, (ops, errors) in totals.items()}
+
+
+def main():
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    n = int(sys.argv[4]) if len(sys.argv) > 4 else 50_000
+
+    print(f"読み込み {readers} プロセス / 書き込み {writers} プロセス / {seconds} 秒 / タスク数={n}")
+    for mode in ("before", "after"):
+        result = run(mode, readers, writers, seconds, n)
+        (reads, read_errors), (writes, write_errors) = result["read"], result["write"]
+        print(f"  {mode:>6}: 読み込み {reads:8.1f} 回/秒（エラー {read_errors}）"
+              f"  書き込み {writes:7.1f} 回/秒（エラー {write_errors}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+predict_single_task() のマイクロベンチマーク。
+
+以前の pandas 版（1 行の DataFrame + pd.to_datetime + encoder.transform + pd.concat）と、
+NumPy で特徴量を組み立てる現在の版を、同じ入力で比べる。
+どちらもフォレストの予測をオンライン推定（model/online.py）と混ぜた値を比べる。
+使い方: python bench_predict.py [呼び出し回数]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from migrations import run_migrations
+from model import online
+from model.predict import engine, get_predictor, predict_single_task
+
+
+def legacy_predict_single_task(subject, category, difficulty, due_date, created_at):
+    """変更前の predict_single_task（比較用。オンライン推定との混ぜ方は今と同じ）。"""
+    due_date_parsed = pd.to_datetime(due_date, errors='coerce')
+    created_at_parsed = pd.to_datetime(created_at, errors='coerce')
+    days_until_due = (due_date_parsed - created_at_parsed).days
+    weekday = created_at_parsed.weekday()
+
+    X_raw = pd.DataFrame([{
+        'subject': subject,
+        'category': category,
+        'difficulty': difficulty,
+        'days_until_due': days_until_due,
+        'weekday': weekday
+    }])
+    predictor = get_predictor()
+    X_cat = predictor.encoder.transform(X_raw[['subject', 'category']])
+    X_cat_df = pd.DataFrame(X_cat, columns=predictor.encoder.get_feature_names_out(['subject', 'category']))
+    X_final = pd.concat(
+        [X_raw.drop(columns=['subject', 'category']).reset_index(drop=True), X_cat_df],
+        axis=1
+    )
+    forest = float(predictor.model.predict(X_final)[0])
+    known = subject in predictor.layout.subject_pos and category in predictor.layout.category_pos
+    blended = online.get_stats(engine).blend(forest, subject, category, difficulty, known=known)
+    return round(max(blended, 1.0), 1)
+
+
+def make_inputs(n, seed=0):
+    rng = random.Random(seed)
+    encoder = get_predictor().encoder
+    subjects = list(encoder.categories_[0])
+    categories = list(encoder.categories_[1])
+    now = datetime.now().replace(microsecond=0)
+    inputs = []
+    for _ in range(n):
+        created_at = now - timedelta(days=rng.randint(0, 3))
+        due_date = (created_at + timedelta(days=rng.randint(1, 14))).strftime("%Y-%m-%d")
+        inputs.append((rng.choice(subjects), rng.choice(categories), rng.randint(1, 5), due_date, created_at))
+    return inputs
+
+
+def bench(func, inputs):
+    start = time.perf_counter()
+    results = [func(*args) for args in inputs]
+    elapsed = time.perf_counter() - start
+    return elapsed / len(inputs) * 1e6, results
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    run_migrations(engine)
+    inputs = make_inputs(n)
+
+    legacy_us, expected = bench(legacy_predict_single_task, inputs)
+
+    predictor = get_predictor()
+    predictor.predict_features.cache_clear()
+    cold_us, cold = bench(predict_single_task, inputs)
+    warm_us, warm = bench(predict_single_task, inputs)
+
+    mismatches = sum(1 for a, b in zip(expected, cold) if abs(a - b) > 0.05)
+    info = predictor.predict_features.cache_info()
+
+    print(f"呼び出し回数={n}")
+    print(f"  pandas 版             : {legacy_us:9.1f} µs/回")
+    print(f"  NumPy 版（キャッシュ無）: {cold_us:9.1f} µs/回  ({legacy_us / cold_us:5.1f}x)")
+    print(f"  NumPy 版（キャッシュ有）: {warm_us:9.1f} µs/回  ({legacy_us / warm_us:5.1f}x)")
+    print(f"  キャッシュ: {info}")
+    print(f"{'✅' if mismatches == 0 and warm == cold else '❌'} 予測値の不一致: {mismatches} 件")
+
+
+if __name__ == "__main__":
+    main()
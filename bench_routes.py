@@ -0,0 +1,265 @@
+"""
+Web アプリの負荷テスト。
+
+使い捨ての DB（一時ディレクトリ）にタスクと時間割を入れ、
+/、/add_task、/finish_task/<id>、/partial_finish_task/<id>、/delete_task を複数スレッドから同時に叩いて、
+エンドポイントごとのスループットと p50 / p95 / p99 のレイテンシを出す。
+既定では Flask のテストクライアントを使い、--gunicorn N を付けるとワーカー N 個の gunicorn をローカルで起動して HTTP で叩く。
+
+使い方: python bench_routes.py [タスク数] [--threads 8] [--requests 2000] [--gunicorn 4] [--output bench_routes.json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# (エンドポイント, 重み)。トップページの表示が一番多い想定
+MIX = [("index", 50), ("add_task", 20), ("finish_task", 10), ("partial_finish_task", 10), ("delete_task", 10)]
+
+
+def seed(uri, n):
+    """タスク n 件（未完了）と時間割・使える時間を入れる。未完了タスクの ID を返す。"""
+    from sqlalchemy import text
+
+    from db import make_engine
+    from generate_and_train import generate_task_data
+    from migrations import run_migrations
+
+    engine = make_engine(uri)
+    run_migrations(engine)
+
+    df = generate_task_data(n, seed=0)
+    now = datetime.now()
+    df["due_date"] = [(now + timedelta(days=int(d))).strftime("%Y-%m-%d") for d in np.random.default_rng(0).integers(0, 30, n)]
+    df["predicted_time"] = df.pop("time_spent")
+    df["is_completed"] = 0
+    df["is_deleted"] = 0
+    with engine.begin() as conn:
+        df.to_sql("task", con=conn, if_exists="append", index=False)
+        conn.execute(text("""
+            INSERT INTO available_time (weekday, available_hours) VALUES (:weekday, 4)
+            ON CONFLICT (user_id, weekday) DO UPDATE SET available_hours = excluded.available_hours
+        """), [{"weekday": weekday} for weekday in range(7)])
+        conn.execute(text("""
+            INSERT INTO timetable (weekday, period, subject) VALUES (:weekday, :period, :subject)
+            ON CONFLICT (user_id, weekday, period) DO UPDATE SET subject = excluded.subject
+        """), [{"weekday": weekday, "period": period, "subject": f"科目{period}"}
+               for weekday in range(6) for period in range(1, 6)])
+        task_ids = conn.execute(text("SELECT id FROM task WHERE is_completed = 0")).scalars().all()
+    engine.dispose()
+    return list(task_ids)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """gunicorn を HTTP で叩く（リダイレクトはたどらずにステータスだけ見る）。"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def request(self, method, path, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class TestClient:
+    """Flask のテストクライアントで叩く（同じプロセス内）。"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        return self.client.open(path, method=method, data=form, json=json_body).status_code
+
+
+def run_load(make_client, task_ids, threads, total_requests, seed_value=0):
+    """MIX の割合でリクエストを投げ、エンドポイントごとの [(秒, ステータス), ...] と全体の経過秒を返す。"""
+    ids = list(task_ids)
+    random.Random(seed_value).shuffle(ids)
+    ids_lock = threading.Lock()
+    results = {name: [] for name, _ in MIX}
+    results_lock = threading.Lock()
+    per_thread = total_requests // threads
+    names = [name for name, _ in MIX]
+    weights = [weight for _, weight in MIX]
+
+    def take_id():
+        with ids_lock:
+            return ids.pop() if ids else 1
+
+    def one(client, name, rng):
+        if name == "index":
+            return client.request("GET", "/")
+        if name == "add_task":
+            due = (datetime.now() + timedelta(days=rng.randint(0, 30))).strftime("%Y-%m-%d")
+            return client.request("POST", "/add_task", form={
+                "subject": "微分積分学第一", "category": "課題", "difficulty": str(rng.randint(1, 5)), "due_date": due,
+            })
+        if name == "finish_task":
+            return client.request("POST", f"/finish_task/{take_id()}", form={"time_spent": "45"})
+        if name == "partial_finish_task":
+            return client.request("POST", f"/partial_finish_task/{take_id()}",
+                                  form={"progress": str(rng.choice([30, 50, 100])), "time_spent": "20"})
+        return client.request("POST", "/delete_task", json_body={"id": take_id()})
+
+    def worker(index):
+        client = make_client()
+        rng = random.Random(seed_value + index)
+        local = []
+        for _ in range(per_thread):
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            status = one(client, name, rng)
+            local.append((name, time.perf_counter() - start, status))
+        with results_lock:
+            for name, seconds, status in local:
+                results[name].append((seconds, status))
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    report = {"elapsed_s": round(elapsed, 3), "endpoints": {}}
+    everything = []
+    for name, samples in results.items():
+        if not samples:
+            continue
+        seconds = np.array([s for s, _ in samples]) * 1000
+        everything.append(seconds)
+        errors = sum(1 for _, status in samples if status >= 400)
+        report["endpoints"][name] = {
+            "requests": len(samples),
+            "errors": errors,
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(float(np.percentile(seconds, 50)), 2),
+            "p95_ms": round(float(np.percentile(seconds, 95)), 2),
+            "p99_ms": round(float(np.percentile(seconds, 99)), 2),
+        }
+    seconds = np.concatenate(everything)
+    report["total"] = {
+        "requests": int(len(seconds)),
+        "throughput_rps": round(len(seconds) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(seconds, 50)), 2),
+        "p95_ms": round(float(np.percentile(seconds, 95)), 2),
+        "p99_ms": round(float(np.percentile(seconds, 99)), 2),
+    }
+    return report
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, env):
+    if shutil.which("gunicorn") is None:
+        sys.exit("❌ gunicorn が見つかりません（pip install gunicorn）")
+    port = _free_port()
+    process = subprocess.Popen(
+        ["gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/metrics", timeout=1).read()
+            return process, base_url
+        except OSError:
+            if process.poll() is not None:
+                sys.exit("❌ gunicorn の起動に失敗しました")
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit("❌ gunicorn が 60 秒以内に起動しませんでした")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("tasks", nargs="?", type=int, default=10_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--gunicorn", type=int, default=0, help="gunicorn のワーカー数（0 ならテストクライアント）")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_routes_")
+    uri = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    # app / db / config を読み込む前に、使い捨ての DB と計測ファイルの置き場所を指定する
+    env = dict(os.environ, DATABASE_URI=uri, METRICS_DIR=os.path.join(tmp_dir, "metrics"), INCREMENTAL_TRAINING="0")
+    os.environ.update(env)
+
+    process = None
+    try:
+        task_ids = seed(uri, args.tasks)
+        print(f"タスク数={args.tasks}, スレッド数={args.threads}, リクエスト数={args.requests}"
+              f"（{'gunicorn ワーカー ' + str(args.gunicorn) if args.gunicorn else 'テストクライアント'}）")
+
+        if args.gunicorn:
+            process, base_url = start_gunicorn(args.gunicorn, env)
+            make_client = lambda: HttpClient(base_url)
+        else:
+            import app as app_module
+            make_client = lambda: TestClient(app_module.app)
+
+        results, elapsed = run_load(make_client, task_ids, args.threads, args.requests)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = summarize(results, elapsed)
+    for name, row in report["endpoints"].items():
+        print(f"  {name:>20}: {row['requests']:5d} 件 {row['throughput_rps']:7.1f} 件/秒"
+              f"  p50 {row['p50_ms']:7.2f} ms  p95 {row['p95_ms']:7.2f} ms  p99 {row['p99_ms']:7.2f} ms"
+              f"  エラー {row['errors']}")
+    total = report["total"]
+    print(f"✅ 合計 {total['requests']} 件 {total['throughput_rps']:.1f} 件/秒"
+          f"  p50 {total['p50_ms']:.2f} ms  p95 {total['p95_ms']:.2f} ms  p99 {total['p99_ms']:.2f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ {args.output} に結果を書き出しました")
+
+
+if __name__ == "__main__":
+    main()
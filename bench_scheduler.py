@@ -0,0 +1,51 @@
+"""
+スケジューラのベンチマーク。
+
+未完了タスク 100k 件を想定したランダムな候補に対して、各戦略の選択にかかる時間を測る。
+使い方: python bench_scheduler.py [タスク数] [繰り返し回数]
+"""
+import sys
+import time
+
+import numpy as np
+
+import scheduler
+
+# 1 回の選択にかけてよい時間（ミリ秒）。リクエスト中に走るので数ミリ秒に収めたい
+BUDGET_MS = 10.0
+
+
+def make_candidates(n, seed=0):
+    rng = np.random.default_rng(seed)
+    minutes = rng.uniform(5, 180, size=n).round(1)  # 分単位
+    days_left = rng.integers(-3, 30, size=n).astype(float)
+    return minutes, days_left
+
+
+def bench(strategy, minutes, days_left, capacity, repeat):
+    timings = []
+    chosen = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chosen = scheduler.select_tasks(minutes, days_left, capacity, strategy)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings)), chosen
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    minutes, days_left = make_candidates(n)
+    capacity = int(6 * 60 * scheduler.CAPACITY_RATIO)  # 6時間使える日
+
+    print(f"タスク数={n}, 容量={capacity}分, 繰り返し={repeat}")
+    for name in scheduler.STRATEGIES:
+        median_ms, chosen = bench(name, minutes, days_left, capacity, repeat)
+        used = float(minutes[chosen].sum())
+        mark = "✅" if median_ms <= BUDGET_MS else "❌"
+        print(f"{mark} {name:>8}: {median_ms:7.3f} ms  選択数={len(chosen):3d}  使用={used:6.1f}/{capacity}分")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+利用者数を増やしてもトップページの表示時間が変わらないかを確かめるベンチマーク。
+
+利用者数 T ごとに使い捨ての DB を作り、各利用者にタスク（予測時間あり）・時間割・使える時間を入れてから、
+ランダムに選んだ利用者として X-User-Id ヘッダー付きで / を叩く。
+- cold: その利用者の最初の表示（今日の日程づくりを含む）
+- warm: 2 回目以降の表示
+利用者ごとの複合インデックスで引いているので、T が増えても p50 / p95 はほぼ同じになるはず。
+app は読み込み時に DB の場所を決めるので、T ごとに別プロセス（spawn）で測る。
+
+使い方: python bench_tenants.py [--tenants 1,10,100,1000,10000] [--tasks 20] [--samples 200] [--output bench_tenants.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+def seed(uri, tenants, tasks_per_tenant):
+    """利用者 1..tenants にタスク tasks_per_tenant 件ずつと時間割・使える時間を入れる。"""
+    from sqlalchemy import text
+
+    from db import make_engine
+    from migrations import run_migrations
+
+    engine = make_engine(uri)
+    run_migrations(engine)
+
+    rng = np.random.default_rng(0)
+    n = tenants * tasks_per_tenant
+    now = datetime.now()
+    user_ids = np.repeat(np.arange(1, tenants + 1), tasks_per_tenant)
+    days = rng.integers(0, 30, n)
+    minutes = rng.integers(10, 120, n)
+    difficulty = rng.integers(1, 6, n)
+    tasks = [
+        {
+            "user_id": int(user_ids[i]),
+            "subject": f"科目{i % 8}",
+            "category": "課題",
+            "difficulty": int(difficulty[i]),
+            "due_date": (now + timedelta(days=int(days[i]))).strftime("%Y-%m-%d"),
+            "created_at": now,
+            "predicted_time": float(minutes[i]),
+        }
+        for i in range(n)
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO task (user_id, subject, category, difficulty, due_date, created_at, predicted_time,
+                              is_completed, is_deleted)
+            VALUES (:user_id, :subject, :category, :difficulty, :due_date, :created_at, :predicted_time, 0, 0)
+        """), tasks)
+        conn.execute(text("""
+            INSERT INTO available_time (user_id, weekday, available_hours) VALUES (:user_id, :weekday, 3)
+        """), [{"user_id": user_id, "weekday": weekday}
+               for user_id in range(1, tenants + 1) for weekday in range(7)])
+        conn.execute(text("""
+            INSERT INTO timetable (user_id, weekday, period, subject) VALUES (:user_id, :weekday, :period, :subject)
+        """), [{"user_id": user_id, "weekday": weekday, "period": period, "subject": f"科目{period}"}
+               for user_id in range(1, tenants + 1) for weekday in range(5) for period in range(1, 6)])
+    engine.dispose()
+
+
+def measure(tenants, tasks_per_tenant, samples):
+    """別プロセスで実行する。利用者数 tenants の DB で cold / warm の表示時間（ミリ秒）を測る。"""
+    tmp_dir = tempfile.mkdtemp(prefix="bench_tenants_")
+    uri = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    # app / db / config を読み込む前に、使い捨ての DB と計測ファイルの置き場所を指定する
+    os.environ.update(DATABASE_URI=uri, METRICS_DIR=os.path.join(tmp_dir, "metrics"),
+                      INCREMENTAL_TRAINING="0", PREDICTION_WORKER="0", LOG_LEVEL="WARNING")
+    try:
+        start = time.perf_counter()
+        seed(uri, tenants, tasks_per_tenant)
+        seed_s = time.perf_counter() - start
+
+        import app as app_module
+        client = app_module.app.test_client()
+        client.get("/")  # モデルの読み込みなど、最初の 1 回だけの処理を済ませておく
+
+        chosen = random.Random(tenants).sample(range(1, tenants + 1), min(samples, tenants))
+        cold, warm = [], []
+        for user_id in chosen:
+            headers = {"X-User-Id": str(user_id)}
+            for timings in (cold, warm, warm):
+                start = time.perf_counter()
+                status = client.get("/", headers=headers).status_code
+                timings.append((time.perf_counter() - start) * 1000)
+                assert status == 200, status
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def summary(values):
+        values = np.array(values)
+        return {"p50_ms": round(float(np.percentile(values, 50)), 2),
+                "p95_ms": round(float(np.percentile(values, 95)), 2)}
+
+    return {"tenants": tenants, "tasks": tenants * tasks_per_tenant, "seed_s": round(seed_s, 1),
+            "cold": summary(cold), "warm": summary(warm)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tenants", default="1,10,100,1000,10000")
+    parser.add_argument("--tasks", type=int, default=20, help="利用者 1 人あたりのタスク数")
+    parser.add_argument("--samples", type=int, default=200, help="測る利用者の数")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    reports = []
+    context = multiprocessing.get_context("spawn")
+    for tenants in (int(value) for value in args.tenants.split(",")):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            report = pool.submit(measure, tenants, args.tasks, args.samples).result()
+        reports.append(report)
+        print(f"  利用者 {report['tenants']:6d}（タスク {report['tasks']:7d}）"
+              f"  cold p50 {report['cold']['p50_ms']:6.2f} ms / p95 {report['cold']['p95_ms']:6.2f} ms"
+              f"  warm p50 {report['warm']['p50_ms']:6.2f} ms / p95 {report['warm']['p95_ms']:6.2f} ms")
+
+    first, last = reports[0]["warm"]["p50_ms"], reports[-1]["warm"]["p50_ms"]
+    print(f"✅ warm p50: 利用者 {reports[0]['tenants']} 人 {first:.2f} ms → {reports[-1]['tenants']} 人 {last:.2f} ms"
+          f"（{last / first:.2f} 倍）")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"✅ {args.output} に結果を書き出しました")
+
+
+if __name__ == "__main__":
+    main()
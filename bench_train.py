@@ -0,0 +1,161 @@
+"""
+学習モデルのベンチマーク（モデル選定用）。
+
+generate_and_train.generate_task_data() で作ったダミータスク（10k〜1M 件）に対して、
+候補のモデルごとに 学習時間・1 件あたりの予測時間・保存サイズ・平均絶対誤差（MAE）を測り、JSON に書き出す。
+精度が最良から tolerance 以内のモデルのうち、予測が最も速いもの（同じならサイズが小さいもの）を推奨として記録する。
+
+使い方: python bench_train.py [タスク数 ...] [--models rf_100,hgb] [--output bench_train_report.json]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import joblib
+import numpy as np
+from sklearn.dummy import DummyRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_absolute_error
+from sklearn.model_selection import train_test_split
+
+import temporal
+from generate_and_train import generate_task_data
+from model import features
+from train_model import TRAIN_N_JOBS, fit_encoder
+
+DEFAULT_SIZES = [10_000, 100_000]
+
+# 1 件ずつの予測時間を測る回数
+SINGLE_PREDICT_REPEAT = 200
+
+# 候補のモデル（名前 → 作る関数）
+CANDIDATES = {
+    "rf_100": lambda: RandomForestRegressor(n_estimators=100, n_jobs=TRAIN_N_JOBS, random_state=0),
+    "rf_100_d12": lambda: RandomForestRegressor(n_estimators=100, max_depth=12, n_jobs=TRAIN_N_JOBS, random_state=0),
+    "rf_50_d12": lambda: RandomForestRegressor(n_estimators=50, max_depth=12, n_jobs=TRAIN_N_JOBS, random_state=0),
+    "rf_50_d8": lambda: RandomForestRegressor(n_estimators=50, max_depth=8, n_jobs=TRAIN_N_JOBS, random_state=0),
+    "rf_20_leaf20": lambda: RandomForestRegressor(
+        n_estimators=20, min_samples_leaf=20, n_jobs=TRAIN_N_JOBS, random_state=0),
+    "hgb": lambda: HistGradientBoostingRegressor(max_iter=200, random_state=0),
+    "ridge": lambda: Ridge(),
+    "mean": lambda: DummyRegressor(),
+}
+
+
+def feature_arrays(df):
+    """
+    生成したタスクを特徴量ストア（model/features.py）の行と同じ形にする（DB には書かない）。
+    日付は temporal.py の整数で計算し、教科・カテゴリには feature_vocab と同じく出てきた順にコードを振る。
+    """
+    vocab = {}
+    rows = []
+    for i, task in enumerate(df.itertuples(index=False)):
+        due_day = temporal.day_number(task.due_date)
+        created_epoch = temporal.epoch_seconds(task.created_at)
+        if due_day is None or created_epoch is None:
+            continue
+        codes = [vocab.setdefault((kind, value), len(vocab) + 1)
+                 for kind, value in (("subject", task.subject), ("category", task.category))]
+        rows.append((i, 0, *codes, task.difficulty, temporal.days_until(due_day, created_epoch),
+                     temporal.weekday(created_epoch), task.time_spent))
+    return features.FeatureArrays(rows), vocab
+
+
+def make_dataset(n, seed=0):
+    """train_model.retrain_model() と同じ特徴量（特徴量ストアの計算）で学習用とテスト用に分ける。"""
+    arrays, vocab = feature_arrays(generate_task_data(n, seed=seed, structured=True))
+    encoder = fit_encoder(arrays, vocab)
+    X, _ = features.design_matrix(arrays, *features.code_positions(encoder, vocab))
+    return train_test_split(X, arrays.time_spent, test_size=0.2, random_state=42)
+
+
+def artifact_size(model):
+    fd, path = tempfile.mkstemp(suffix=".joblib")
+    os.close(fd)
+    try:
+        joblib.dump(model, path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def bench_model(name, X_train, X_test, y_train, y_test):
+    model = CANDIDATES[name]()
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_s = time.perf_counter() - start
+    # train_model.py と同じく、予測はスレッドを立てずに行う
+    if "n_jobs" in model.get_params():
+        model.set_params(n_jobs=1)
+
+    start = time.perf_counter()
+    predicted = model.predict(X_test)
+    batch_s = time.perf_counter() - start
+
+    timings = []
+    for i in range(min(SINGLE_PREDICT_REPEAT, len(X_test))):
+        start = time.perf_counter()
+        model.predict(X_test[i:i + 1])
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "model": name,
+        "train_rows": len(X_train),
+        "fit_s": round(fit_s, 3),
+        "predict_single_ms": round(float(np.median(timings)), 3),
+        "predict_batch_us_per_row": round(batch_s / len(X_test) * 1e6, 3),
+        "artifact_bytes": artifact_size(model),
+        "mae": round(float(mean_absolute_error(y_test, predicted)), 3),
+    }
+
+
+def recommend(results, tolerance):
+    """MAE が最良から tolerance（割合）以内のうち、予測が最も速く小さいモデル名を返す。"""
+    best_mae = min(r["mae"] for r in results)
+    acceptable = [r for r in results if r["mae"] <= best_mae * (1 + tolerance)]
+    return min(acceptable, key=lambda r: (r["predict_single_ms"], r["artifact_bytes"]))["model"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--models", default=",".join(CANDIDATES))
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    parser.add_argument("--output", default="bench_train_report.json")
+    args = parser.parse_args()
+
+    names = [name for name in args.models.split(",") if name]
+    unknown = [name for name in names if name not in CANDIDATES]
+    if unknown:
+        parser.error(f"未知のモデル: {', '.join(unknown)}（候補: {', '.join(CANDIDATES)}）")
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "tolerance": args.tolerance,
+        "sizes": {},
+    }
+    for n in args.sizes:
+        X_train, X_test, y_train, y_test = make_dataset(n)
+        print(f"タスク数={n}（学習 {len(X_train)} 件 / テスト {len(X_test)} 件）")
+        results = []
+        for name in names:
+            result = bench_model(name, X_train, X_test, y_train, y_test)
+            results.append(result)
+            print(f"  {name:>12}: 学習 {result['fit_s']:8.3f} s  予測 {result['predict_single_ms']:7.3f} ms/件"
+                  f"  {result['artifact_bytes'] / 1e6:8.2f} MB  MAE {result['mae']:6.2f} 分")
+        best = recommend(results, args.tolerance)
+        print(f"✅ 推奨: {best}")
+        report["sizes"][str(n)] = {"results": results, "recommended": best}
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ {args.output} に結果を書き出しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+よく使うクエリが migrations.py で作ったインデックスを使っているかを EXPLAIN QUERY PLAN で確認する。
+使い方: python check_indexes.py  （どれかがインデックスを使っていなければ終了コード 1）
+"""
+import os
+import sys
+
+# app を読み込む前に、予測・学習をバックグラウンドで動かさないようにしておく（マイグレーションは app が実行する）
+os.environ.setdefault("PREDICTION_WORKER", "0")
+os.environ.setdefault("INCREMENTAL_TRAINING", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import text
+
+import temporal
+from app import (API_TASKS_SQL, API_TIMETABLE_SQL, API_TODAY_SQL, FIRST_PAGE_AFTER_DUE, MAIN_VIEW_SQL,
+                 engine)
+
+TODAY = "2025-06-17"
+USER_ID = 1
+PAGE = {"after_due": FIRST_PAGE_AFTER_DUE, "after_id": 0, "limit": 51}
+
+# (説明, クエリ, パラメータ, 使われるべきインデックス（すべて）)
+# トップページと API のクエリは app.py の定数をそのまま使う
+CHECKS = [
+    (
+        "index(): 今日やること・残りのやることリスト（キーセットページング）・今日の時間割",
+        MAIN_VIEW_SQL,
+        {"today": TODAY, "user_id": USER_ID, "weekday": 0, **PAGE,
+         "with_today": True, "with_remaining": True, "with_timetable": True},
+        ("idx_plan_user_date", "idx_task_user_open_due (user_id=? AND <expr>>?)", "ux_timetable_user_slot"),
+    ),
+    (
+        "/api/today: 今日やること",
+        API_TODAY_SQL,
+        {"today": TODAY, "user_id": USER_ID},
+        ("idx_plan_user_date",),
+    ),
+    (
+        "/api/today: 今日の時間割",
+        API_TIMETABLE_SQL,
+        {"weekday": 0, "user_id": USER_ID},
+        ("ux_timetable_user_slot",),
+    ),
+    (
+        "/api/tasks: 未完了のタスク（キーセットページング）",
+        API_TASKS_SQL,
+        {"user_id": USER_ID, **PAGE},
+        ("idx_task_user_open_due (user_id=? AND <expr>>?)",),
+    ),
+    (
+        "scheduler.load_candidates()",
+        """
+        SELECT id, predicted_time,
+               due_day - :today_day AS days_left
+        FROM task
+        WHERE user_id = :user_id
+          AND time_spent IS NULL AND predicted_time IS NOT NULL AND is_deleted = 0
+        """,
+        {"today_day": temporal.day_number(TODAY), "user_id": USER_ID},
+        ("idx_task_user_candidates",),
+    ),
+    (
+        "batch_predict_missing_tasks()",
+        """
+        SELECT f.task_id, f.user_id, f.subject_code, f.category_code, f.difficulty, f.days_until_due, f.weekday
+        FROM task t JOIN task_features f ON f.task_id = t.id
+        WHERE t.id > 0 AND t.time_spent IS NULL AND t.predicted_time IS NULL
+        ORDER BY t.id
+        """,
+        {},
+        ("idx_task_unscored",),
+    ),
+    (
+        "train_model.update_model()",
+        """
+        SELECT task_id FROM task_features
+        WHERE time_spent IS NOT NULL AND completed_epoch > :since
+        """,
+        {"since": temporal.epoch_seconds("2025-01-01")},
+        ("idx_task_features_completed",),
+    ),
+]
+
+
+def check(engine):
+    ok = True
+    with engine.connect() as conn:
+        for label, sql, params, indexes in CHECKS:
+            # app.py の定数は text() のものと文字列のものがある
+            sql = getattr(sql, "text", sql)
+            rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+            detail = [row[-1] for row in rows]
+            used = all(any(index in line for line in detail) for index in indexes)
+            ok = ok and used
+            print(f"{'✅' if used else '❌'} {label}（{', '.join(indexes)}）")
+            for line in detail:
+                print(f"    {line}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check(engine) else 1)
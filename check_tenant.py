@@ -0,0 +1,51 @@
+"""
+利用者の決め方（tenant.resolve_user_id）が、クライアントが書き換えられる値を使わないことを確認する。
+使い方: python check_tenant.py  （どれかが期待どおりでなければ終了コード 1）
+"""
+import sys
+
+from flask import Flask, request
+from flask.sessions import SecureCookieSessionInterface
+
+from tenant import DEFAULT_USER_ID, SESSION_USER_ID_KEY, USER_ID_HEADER, resolve_user_id
+
+SECRET_KEY = "check-tenant-secret"
+
+
+def _session_cookie(secret_key, user_id):
+    """secret_key で署名したセッションのクッキーの値。"""
+    app = Flask(__name__)
+    app.secret_key = secret_key
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    return serializer.dumps({SESSION_USER_ID_KEY: user_id})
+
+
+def _resolve(app, headers):
+    with app.test_request_context("/", headers=headers):
+        return resolve_user_id(request)
+
+
+def check():
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    cookie = app.config["SESSION_COOKIE_NAME"]
+    # (説明, リクエストヘッダ, 期待する利用者 ID)
+    cases = [
+        ("ヘッダ（前段のプロキシが付ける）", {USER_ID_HEADER: "7"}, 7),
+        ("ただのクッキー user_id は使わない", {"Cookie": "user_id=7"}, DEFAULT_USER_ID),
+        ("署名付きセッション", {"Cookie": f"{cookie}={_session_cookie(SECRET_KEY, 7)}"}, 7),
+        ("別の鍵で署名したセッションは使わない",
+         {"Cookie": f"{cookie}={_session_cookie('forged', 7)}"}, DEFAULT_USER_ID),
+        ("不正な値", {USER_ID_HEADER: "-3"}, DEFAULT_USER_ID),
+    ]
+    ok = True
+    for label, headers, expected in cases:
+        user_id = _resolve(app, headers)
+        passed = user_id == expected
+        ok = ok and passed
+        print(f"{'✅' if passed else '❌'} {label}（利用者 {user_id}、期待 {expected}）")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check() else 1)
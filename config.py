@@ -1,4 +1,5 @@
 import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
+# 環境変数 DATABASE_URI があればそちらを使う（エンジンは db.get_engine() で作る）
+DATABASE_URI = os.environ.get("DATABASE_URI", f"sqlite:///{DB_PATH}")
@@ -1,12 +1,8 @@
-import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-# 絶対パスを利用して database.db を指定する
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
+from db import get_engine
 
-engine = create_engine(DATABASE_URI, echo=True)
+engine = get_engine()
 
 def create_tables():
     with engine.begin() as conn:
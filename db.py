@@ -0,0 +1,116 @@
+"""
+データベースエンジンの作成（Web アプリ・予測・学習・各スクリプトで共通）。
+
+get_engine() はプロセスごとに 1 つのエンジンを返す。接続 URI は config.DATABASE_URI（環境変数 DATABASE_URI で上書きできる）。
+SQLite のときは接続ごとに PRAGMA を設定する:
+- journal_mode=WAL: 読み込みが書き込みを待たない（gunicorn の複数ワーカーで同時に読み書きするため）
+- synchronous=NORMAL: WAL ではコミットごとの fsync を省いても壊れない
+- busy_timeout: ロック中はすぐにエラーにせず待つ
+- mmap_size / cache_size: 読み込みをメモリマップとページキャッシュで済ませる
+- auto_vacuum=INCREMENTAL: 新しく作る DB で、archive_tasks.py の incremental vacuum が使えるようにする
+  （既存の DB では何も変わらない。切り替えは archive_tasks.optimize() が一度だけ VACUUM して行う）
+SQL_TIMING_SAMPLE_RATE を 0 より大きくすると、その割合の SQL だけ実行時間をログに出す（echo の代わり）。
+複数の SELECT を同じスナップショットで読むときは read_transaction() を使う。
+"""
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+
+from config import DATABASE_URI
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# 負の値は KiB 単位（-65536 = 64MB）
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", -65536))
+
+# 1 ワーカー（プロセス）あたりの接続数。リクエスト処理のスレッドと予測ワーカーの分があれば足りる
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 4))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 4))
+
+# 実行時間をログに出す SQL の割合（0〜1）。0 ならイベントをつけないので本番では何もしない
+SQL_TIMING_SAMPLE_RATE = float(os.environ.get("SQL_TIMING_SAMPLE_RATE", 0))
+
+sql_logger = logging.getLogger("db.sql")
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # テーブルを作る前に設定する必要があるので最初に実行する
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+def _start_timing(conn, cursor, statement, parameters, context, executemany):
+    if random.random() < SQL_TIMING_SAMPLE_RATE:
+        context._timing_start = time.perf_counter()
+
+
+def _log_timing(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_timing_start", None)
+    if start is not None:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sql_logger.info("%.2f ms%s: %s", elapsed_ms, "（executemany）" if executemany else "",
+                        " ".join(statement.split())[:200])
+
+
+def make_engine(uri=None, echo=False):
+    """新しいエンジンを作る（通常は get_engine() を使う。ベンチマークなどで別の DB を開くとき用）。"""
+    uri = uri or DATABASE_URI
+    if uri.startswith("sqlite") and ":memory:" in uri or uri == "sqlite://":
+        engine = create_engine(uri, echo=echo)
+    elif uri.startswith("sqlite:///"):
+        engine = create_engine(
+            uri,
+            echo=echo,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        )
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    else:
+        engine = create_engine(uri, echo=echo, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+    if SQL_TIMING_SAMPLE_RATE > 0:
+        event.listen(engine, "before_cursor_execute", _start_timing)
+        event.listen(engine, "after_cursor_execute", _log_timing)
+    return engine
+
+
+_engine = None
+
+
+def get_engine():
+    """このプロセスで共有するエンジンを返す（最初の呼び出しで作る）。"""
+    global _engine
+    if _engine is None:
+        _engine = make_engine()
+    return _engine
+
+
+@contextmanager
+def read_transaction(engine):
+    """
+    中の SELECT をすべて同じスナップショットで読む読み込み用のトランザクション。
+    pysqlite は SELECT の前に BEGIN を出さず 1 文ずつ自動コミットで読むので、自動コミットにして BEGIN / COMMIT を自分で出す
+    （WAL では最初の SELECT の時点のスナップショットを COMMIT まで読み続け、書き込みは待たせない）。
+    """
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            yield conn
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN")
+        try:
+            yield conn
+        finally:
+            if conn.connection.driver_connection.in_transaction:
+                conn.exec_driver_sql("COMMIT")
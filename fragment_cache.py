@@ -0,0 +1,60 @@
+"""
+描画済みのテンプレート断片（時間割の表・タスクの一覧）のキャッシュ。
+
+キーは (ブロック名, 利用者, 曜日や日付などの引数..., バージョン)。
+バージョンには data_version テーブルの値を使う（時間割のブロックは timetable_version、タスクの一覧は version）。
+どのワーカーで書き込まれてもバージョンが進むのでキーが変わり、古い断片は使われなくなる。
+設定を保存したワーカーでは invalidate() でその利用者の断片をすぐに捨てる。
+件数は FRAGMENT_CACHE_SIZE まで（古いものから捨てる）で、ワーカープロセスごとに持つ。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+from sqlalchemy import text
+
+import metrics
+
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 4096))
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def load_versions(conn, user_id):
+    """利用者の (データバージョン, 時間割バージョン) を返す（まだ書き込みが無ければ (0, 0)）。"""
+    row = conn.execute(text("""
+        SELECT version, timetable_version FROM data_version WHERE user_id = :user_id
+    """), {"user_id": user_id}).fetchone()
+    return (row.version, row.timetable_version) if row else (0, 0)
+
+
+def get(key):
+    """キャッシュ済みの断片（Markup）を返す。無ければ None。"""
+    with _lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+    metrics.inc("fragment_cache_lookups_total", block=key[0], result="miss" if html is None else "hit")
+    return html
+
+
+def put(key, html):
+    html = Markup(html)
+    with _lock:
+        _cache[key] = html
+        _cache.move_to_end(key)
+        while len(_cache) > FRAGMENT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return html
+
+
+def invalidate(user_id=None):
+    """利用者 user_id（None なら全員）の断片を捨てる。"""
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+            return
+        for key in [key for key in _cache if key[1] == user_id]:
+            del _cache[key]
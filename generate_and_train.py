@@ -1,70 +1,71 @@
-import os
+import numpy as np
 import pandas as pd
-import random
-from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from train_model import retrain_model  # train_model.py に retrain_model がある前提
+from datetime import datetime
+from db import get_engine
+from migrations import run_migrations
 
-# DBの接続設定
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
-engine = create_engine(DATABASE_URI)
+# 教科・カテゴリの候補
+subjects = ["キャリア教育基礎", "選択独語第一", "微分積分学第一", "Academic Spoken English"]
+categories = ["小テスト", "レポート", "復習", "予習", "課題", "グループワーク"]
+difficulty_range = [1, 2, 3, 4, 5]
+
+
+# データ生成
+def generate_task_data(n, minutes_range=(30, 180), subject_list=None, seed=None, structured=False, now=None):
+    """
+    学習用のダミータスクを n 件生成して DataFrame で返す（教科は subject_list から均等に選ぶ）。
+    structured=False なら所要時間は minutes_range の一様乱数（これまでと同じ）。
+    structured=True なら難易度とカテゴリに応じて長くなる（ベンチマークでモデルの精度を比べる用）。
+    """
+    rng = np.random.default_rng(seed)
+    now = now or datetime.now()
+    subject_list = subject_list or subjects
+    low, high = minutes_range
+
+    subject_idx = rng.integers(0, len(subject_list), size=n)
+    category_idx = rng.integers(0, len(categories), size=n)
+    difficulty = rng.choice(difficulty_range, size=n)
+    created_at = np.datetime64(now.replace(microsecond=0)) - rng.integers(5, 21, size=n).astype("timedelta64[D]")
+    due_date = created_at + rng.integers(1, 15, size=n).astype("timedelta64[D]")
+
+    if structured:
+        category_weight = np.linspace(0.0, 1.0, len(categories))[category_idx]
+        ratio = 0.6 * (difficulty - 1) / 4 + 0.3 * category_weight + rng.normal(0, 0.1, size=n)
+        time_spent = low + np.clip(ratio, 0, 1) * (high - low)
+    else:
+        time_spent = rng.uniform(low, high, size=n)
+
+    return pd.DataFrame({
+        "subject": np.asarray(subject_list, dtype=object)[subject_idx],
+        "category": np.asarray(categories, dtype=object)[category_idx],
+        "difficulty": difficulty,
+        "due_date": pd.to_datetime(due_date).strftime("%Y-%m-%d %H:%M:%S"),
+        "created_at": pd.to_datetime(created_at).strftime("%Y-%m-%d %H:%M:%S"),
+        "time_spent": time_spent.round(1),  # 分単位
+    })
 
-from sqlalchemy import text
-from sqlalchemy import create_engine, text, inspect
 
-engine = create_engine("sqlite:///database.db")
-inspector = inspect(engine)
+def main():
+    from train_model import retrain_model
 
-# is_deleted カラムが無いときだけ追加
-if 'is_deleted' not in [col['name'] for col in inspector.get_columns('task')]:
+    engine = get_engine()
+
+    # is_deleted などの列が無ければ追加する
+    run_migrations(engine)
+
+    # すべての教科のデータを生成
+    df = generate_task_data(60 * len(subjects))
+    df["is_deleted"] = 1  # 学習用なので表示対象外にする
+
+    # DBに追加
     with engine.begin() as conn:
-        conn.execute(text("ALTER TABLE task ADD COLUMN is_deleted INTEGER DEFAULT 0"))
-        print("✅ is_deleted カラムを追加しました")
-else:
-    print("ℹ️ is_deleted カラムはすでに存在しています。")
+        df.to_sql("task", con=conn, if_exists="append", index=False)
 
+    print(f"✅ {len(df)} 件のデータを task テーブルに追加しました")
 
-# 教科・カテゴリの候補
-subjects = ["キャリア教育基礎", "選択独語第一", "微分積分学第一", "Academic Spoken English"]
-categories = ["小テスト", "レポート", "復習", "予習", "課題", "グループワーク"]
-difficulty_range = [1, 2, 3, 4, 5]
+    # モデルを再学習
+    retrain_model()
 
-# データ生成
-def generate_task_data(subject, n=30):
-    now = datetime.now()
-    rows = []
-    for _ in range(n):
-        category = random.choice(categories)
-        difficulty = random.choice(difficulty_range)
-        created_at = now - timedelta(days=random.randint(5, 20))
-        due_date = created_at + timedelta(days=random.randint(1, 14))
-        time_spent = round(random.uniform(30, 180), 1)  # 分単位
-        rows.append({
-            "subject": subject,
-            "category": category,
-            "difficulty": difficulty,
-            "due_date": due_date.strftime("%Y-%m-%d %H:%M:%S"),
-            "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
-            "time_spent": time_spent
-        })
-    return rows
-
-# すべての教科のデータを生成して DataFrame 化
-all_tasks = []
-for subject in subjects:
-    all_tasks.extend(generate_task_data(subject, n=60))
-
-df = pd.DataFrame(all_tasks)
-df["is_deleted"] = 1  # 学習用なので表示対象外にする
-
-
-# DBに追加
-with engine.begin() as conn:
-    df.to_sql("task", con=conn, if_exists="append", index=False)
-
-print(f"✅ {len(df)} 件のデータを task テーブルに追加しました")
-
-# モデルを再学習
-retrain_model()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+gunicorn の設定（Procfile: gunicorn -c gunicorn.conf.py app:app）。
+
+/metrics の値（metrics.py）は METRICS_DIR にワーカーごとのファイルで集める。
+METRICS_DIR が指定されていなければ、起動ごとに一時ディレクトリを作り、終了時に消す。
+指定されていれば、起動時にその中のメトリクスのファイル（*.json）だけを消して使い、ディレクトリは消さない
+（前回の起動やテストの値を足さない）。
+ワーカーが終了したら、そのワーカーのファイルを archived.json に足し込んで消す。
+
+共通のモデルは master が when_ready で読み込んでおく。ワーカーは fork 後に app を読み込むが、
+model.registry はすでに読み込まれたモデルごと引き継ぐので、木の配列のページをワーカー同士で共有する
+（preload_app は使わない。app はスレッドや DB の接続を作るので、ワーカーごとに読み込む）。
+"""
+import os
+import tempfile
+
+# この設定が METRICS_DIR を作ったときに、作った master の PID を入れておく環境変数
+# （設定の読み直しや USR2 で起動した新しい master は、指定されたディレクトリとして扱う）
+METRICS_DIR_OWNER = "TASK_APP_METRICS_DIR_OWNER"
+
+# ワーカーは master の環境変数を引き継ぐので、app を読み込む前に決めておく
+if "METRICS_DIR" not in os.environ:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="task_app_metrics-")
+    os.environ[METRICS_DIR_OWNER] = str(os.getpid())
+
+
+def _owns_metrics_dir():
+    return os.environ.get(METRICS_DIR_OWNER) == str(os.getpid())
+
+
+def on_starting(server):
+    import metrics
+    metrics.reset_dir(os.environ["METRICS_DIR"])
+
+
+def when_ready(server):
+    from model import registry
+    try:
+        registry.get()
+    except Exception as e:
+        # 読み込めなければ、各ワーカーが最初の予測のときに読み込む
+        server.log.warning("共通のモデルを先に読み込めませんでした: %s", e)
+
+
+def worker_exit(server, worker):
+    # 最後の書き出しから終了までの分も残す
+    import metrics
+    metrics.flush(force=True)
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.archive_process(worker.pid, os.environ["METRICS_DIR"])
+
+
+def on_exit(server):
+    # 指定されたディレクトリは消さない（中身も次の起動の on_starting で片付ける）
+    if _owns_metrics_dir():
+        import shutil
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
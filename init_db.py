@@ -1,49 +1,16 @@
-import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from datetime import datetime
+from db import get_engine
+from log_config import setup_logging
+from migrations import run_migrations
 
-# 絶対パスを使用して database.db を指定
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
-
-engine = create_engine(DATABASE_URI, echo=True)
+engine = get_engine()
 
 def init_db():
+    # === テーブル作成 ===（migrations.py に集約）
+    run_migrations(engine)
+
     with engine.begin() as conn:
-        # === テーブル作成 ===
-        # 課題テーブル
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS task (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                subject TEXT NOT NULL,
-                category TEXT NOT NULL,
-                difficulty INTEGER NOT NULL,
-                due_date DATE NOT NULL,
-                created_at DATETIME NOT NULL,
-                predicted_time REAL,
-                time_spent REAL,
-                assigned_for_today INTEGER DEFAULT 0,
-                assigned_date DATE
-            );
-        """))
-        # 曜日ごとの使える時間テーブル
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS available_time (
-                weekday INTEGER PRIMARY KEY,
-                available_hours REAL
-            );
-        """))
-        # 時間割テーブル
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS timetable (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                weekday INTEGER NOT NULL,
-                period INTEGER NOT NULL,
-                subject TEXT NOT NULL
-            );
-        """))
-        
         # === 初期データ挿入 ===
         # available_timeテーブル：大学生向けの曜日ごとの使える時間（available_hours を「時間」で設定）
         conn.execute(text("DELETE FROM available_time"))
@@ -100,4 +67,6 @@ def init_db():
     print("✅ 大学生向け初期データの挿入が完了しました。")
 
 if __name__ == "__main__":
+    # 適用したマイグレーションはログに出る
+    setup_logging()
     init_db()
@@ -0,0 +1,37 @@
+"""
+ログの設定。
+
+setup_logging() でルートロガーに QueueHandler をつけ、実際の出力は QueueListener のスレッドで行う。
+リクエストを処理するスレッドはキューに積むだけなので、出力先が遅くても待たされない。
+レベルは環境変数 LOG_LEVEL（既定は INFO）で変える。各モジュールは logging.getLogger(__name__) を使う。
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+_listener = None
+
+
+def setup_logging(level=None):
+    """ルートロガーをキュー経由の出力にする（2 回目以降の呼び出しはレベルの変更だけ）。"""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
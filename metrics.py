@@ -0,0 +1,271 @@
+"""
+リクエスト・SQL・モデル推論の計測と、/metrics 用の Prometheus テキスト形式への書き出し。
+
+値は各ワーカープロセスのメモリ上で集計し、METRICS_FLUSH_INTERVAL 秒おきに METRICS_DIR/<pid>.json へ書き出す。
+/metrics を受けたワーカーは、自分の最新の値と他のワーカーのファイルを足し合わせて返す
+（gunicorn のどのワーカーが受けても全体の値になる）。
+
+METRICS_DIR は起動（デプロイ）ごとに別のディレクトリにする。gunicorn.conf.py が master の起動時に作るか、
+指定されたディレクトリの *.json を消してから使う（指定されたディレクトリ自体や他のファイルは消さない）。
+ワーカーが終了したら master がそのワーカーのファイルを archived.json に足し込んで消す
+（ワーカーが入れ替わっても、PID が使い回されても、カウンタは減らない）。
+METRICS_DIR が無ければプロセスごとの一時ディレクトリを使う（flask run やテストクライアント用。終了時に消す）。
+"""
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+# ヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INFERENCE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+HELP = {
+    "http_requests_total": ("counter", "処理したリクエスト数"),
+    "http_request_duration_seconds": ("histogram", "エンドポイントごとの処理時間"),
+    "sql_statements_total": ("counter", "実行した SQL 文の数"),
+    "sql_duration_seconds_total": ("counter", "SQL の実行にかかった時間の合計"),
+    "model_inference_seconds": ("histogram", "モデルの予測（predict）にかかった時間"),
+    "model_inference_rows_total": ("counter", "予測した行数"),
+    "fragment_cache_lookups_total": ("counter", "テンプレート断片キャッシュの参照数（hit / miss）"),
+    "heartbeats_total": ("counter", "受け取った作業セッションのハートビート数"),
+    "heartbeat_flush_rows_total": ("counter", "ハートビートをまとめて work_session に書き込んだ行数"),
+}
+
+_lock = threading.Lock()
+_counters = {}     # (名前, ラベル) -> 値
+_histograms = {}   # (名前, ラベル) -> [バケットごとの件数..., 合計, 件数]
+_buckets = {"http_request_duration_seconds": LATENCY_BUCKETS, "model_inference_seconds": INFERENCE_BUCKETS}
+_flushed_at = 0.0
+
+# 終了したワーカーの値を足し込んでおくファイル
+ARCHIVE_FILE = "archived.json"
+
+# SQL をどのエンドポイントの処理で実行したか（リクエスト以外のスレッドは "background"）
+_current = threading.local()
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1.0, **labels):
+    key = (name, _labels(**labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(name, seconds, **labels):
+    buckets = _buckets[name]
+    key = (name, _labels(**labels))
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * len(buckets) + [0.0, 0]
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+
+def observe_inference(kind, seconds, rows=1):
+    """モデルの predict 1 回分を記録する（kind は "single" か "batch"）。"""
+    observe("model_inference_seconds", seconds, kind=kind)
+    inc("model_inference_rows_total", rows, kind=kind)
+
+
+def _snapshot():
+    with _lock:
+        return {
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [[name, dict(labels), list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+
+def _metrics_dir():
+    """書き出し先のディレクトリ（METRICS_DIR が無ければ、このプロセス専用の一時ディレクトリを作る）。"""
+    global METRICS_DIR
+    if METRICS_DIR is None:
+        METRICS_DIR = tempfile.mkdtemp(prefix="task_app_metrics-")
+        atexit.register(shutil.rmtree, METRICS_DIR, ignore_errors=True)
+    return METRICS_DIR
+
+
+def reset_dir(path=None):
+    """
+    ディレクトリのメトリクスのファイル（*.json と書きかけの .tmp-*）を消す（gunicorn の master がワーカーを起動する前に呼ぶ）。
+    ディレクトリは利用者が指定したものかもしれないので、それ以外のファイルやディレクトリ自体は消さない。
+    """
+    path = path or _metrics_dir()
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".json") or name.startswith(".tmp-"):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+
+def _write(path, snapshot):
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def archive_process(pid, path=None):
+    """
+    終了したプロセス pid のファイルを archived.json に足し込んで消す
+    （gunicorn の master が child_exit で呼ぶ。master は 1 スレッドなので読み書きは競合しない）。
+    """
+    path = path or _metrics_dir()
+    worker_file = os.path.join(path, f"{pid}.json")
+    snapshot = _read(worker_file)
+    if snapshot is None:
+        return
+    archive_file = os.path.join(path, ARCHIVE_FILE)
+    counters, histograms = _merge([s for s in (_read(archive_file), snapshot) if s is not None])
+    _write(archive_file, {
+        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+    })
+    os.remove(worker_file)
+
+
+def flush(force=False):
+    """今の値を METRICS_DIR/<pid>.json に書き出す（前回から METRICS_FLUSH_INTERVAL 秒以内なら何もしない）。"""
+    global _flushed_at
+    now = time.monotonic()
+    if not force and now - _flushed_at < METRICS_FLUSH_INTERVAL:
+        return
+    _flushed_at = now
+    path = _metrics_dir()
+    os.makedirs(path, exist_ok=True)
+    _write(os.path.join(path, f"{os.getpid()}.json"), _snapshot())
+
+
+def _collect():
+    """全ワーカーと終了したワーカーの値を足し合わせる（自分のプロセスはファイルではなくメモリ上の値を使う）。"""
+    snapshots = [_snapshot()]
+    own_file = f"{os.getpid()}.json"
+    path = _metrics_dir()
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            if not name.endswith(".json") or name == own_file:
+                continue
+            snapshot = _read(os.path.join(path, name))
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return _merge(snapshots)
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, _labels(**labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, values in snapshot["histograms"]:
+            key = (name, _labels(**labels))
+            merged = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                merged[i] += value
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render():
+    """Prometheus のテキスト形式で返す。"""
+    counters, histograms = _collect()
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind == "counter":
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        else:
+            buckets = _buckets[metric]
+            for (name, labels), values in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for bound, count in zip(buckets, values):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    endpoint = getattr(_current, "endpoint", None) or "background"
+    inc("sql_statements_total", endpoint=endpoint)
+    inc("sql_duration_seconds_total", time.perf_counter() - start, endpoint=endpoint)
+
+
+def init_app(app, engine):
+    """
+    リクエストの前後と SQL の実行前後に計測用のフックをつけ、/metrics を追加する。
+    ほかの before_request より前に呼ぶこと（日程の作り直しなども処理時間に含めるため）。
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_start = time.perf_counter()
+        _current.endpoint = request.endpoint or "not_found"
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "not_found"
+            observe("http_request_duration_seconds", time.perf_counter() - start,
+                    endpoint=endpoint, method=request.method)
+            inc("http_requests_total", endpoint=endpoint, method=request.method, status=str(response.status_code))
+        flush()
+        return response
+
+    @app.teardown_request
+    def _clear_endpoint(exc):
+        _current.endpoint = None
+
+    @app.route("/metrics")
+    def metrics():
+        return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
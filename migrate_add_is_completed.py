@@ -1,29 +1,21 @@
 # migrate_add_is_completed.py
 
-import os
-from sqlalchemy import create_engine, text
-
-# 現在のスクリプトのディレクトリからDBファイルの絶対パスを生成
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
+from db import get_engine
+from log_config import setup_logging
+from migrations import run_migrations
 
 # エンジンを作成
-engine = create_engine(DATABASE_URI)
+engine = get_engine()
+
 
 def add_column_if_not_exists():
-    with engine.begin() as conn:
-        # 既存のカラム名一覧を取得
-        result = conn.execute(text("PRAGMA table_info(task)"))
-        columns = [row[1] for row in result.fetchall()]
-        
-        # すでにカラムが存在していれば何もしない
-        if "is_completed" in columns:
-            print("✅ 'is_completed' カラムはすでに存在します。")
-        else:
-            # カラムを追加
-            conn.execute(text("ALTER TABLE task ADD COLUMN is_completed BOOLEAN DEFAULT 0"))
-            print("✅ 'is_completed' カラムを追加しました。")
+    # is_completed 列の追加は migrations.py の add_task_flags に移した
+    applied = run_migrations(engine)
+    if not applied:
+        print("✅ スキーマは最新です。")
+
 
 if __name__ == "__main__":
+    # 適用したマイグレーションはログに出る
+    setup_logging()
     add_column_if_not_exists()
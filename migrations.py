@@ -0,0 +1,633 @@
+"""
+スキーマのマイグレーション。
+
+MIGRATIONS に (バージョン, 名前, 処理) を順番に並べておき、run_migrations() で未適用のものだけを実行する。
+適用済みのバージョンは schema_migrations テーブルに記録する。
+各マイグレーションは何度実行しても同じ結果になるように書く（gunicorn の複数ワーカーが同時に起動しても安全なように）。
+SQLite では 1 件ずつ BEGIN IMMEDIATE で書き込みロックを取ってから schema_migrations を読み直すので、
+同時に起動したプロセスが同じマイグレーションを重ねて実行することはない。
+"""
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import text
+
+import temporal
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def _add_column(conn, table, column, ddl):
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def create_base_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS task (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject TEXT NOT NULL,
+            category TEXT NOT NULL,
+            difficulty INTEGER NOT NULL,
+            due_date DATE NOT NULL,
+            created_at DATETIME NOT NULL,
+            predicted_time REAL,
+            time_spent REAL,
+            assigned_for_today INTEGER DEFAULT 0,
+            assigned_date DATE
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS available_time (
+            weekday INTEGER PRIMARY KEY,
+            available_hours REAL
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS timetable (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            weekday INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            subject TEXT NOT NULL
+        )
+    """))
+
+
+def add_task_flags(conn):
+    # 以前は update_schema.py / migrate_add_is_completed.py / seed_data.py で個別に追加していた列
+    _add_column(conn, "task", "assigned_for_today", "INTEGER DEFAULT 0")
+    _add_column(conn, "task", "assigned_date", "DATE")
+    _add_column(conn, "task", "is_completed", "BOOLEAN DEFAULT 0")
+    _add_column(conn, "task", "is_deleted", "INTEGER DEFAULT 0")
+
+
+def create_plan_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS plan (
+            plan_date DATE NOT NULL,
+            task_id INTEGER NOT NULL,
+            minutes REAL NOT NULL,
+            PRIMARY KEY (plan_date, task_id)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS plan_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            built_on DATE NOT NULL,
+            horizon_days INTEGER NOT NULL
+        )
+    """))
+
+
+def create_task_indexes(conn):
+    # index() の「残りのやることリスト」: 未完了・未削除を締切順に
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_open_due
+        ON task (due_date, id)
+        WHERE is_completed = 0 AND is_deleted = 0
+    """))
+    # scheduler.load_candidates(): 予測時間ありの未着手タスク（必要な列をすべて含める）
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_candidates
+        ON task (id, predicted_time, due_date)
+        WHERE time_spent IS NULL AND predicted_time IS NOT NULL AND is_deleted = 0
+    """))
+    # batch_predict_missing_tasks(): まだ予測していないタスク
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_unscored
+        ON task (id)
+        WHERE time_spent IS NULL AND predicted_time IS NULL
+    """))
+    # タスク単位で plan を引く・消すとき用（plan_date 側は主キーで引ける）
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_plan_task ON plan (task_id)"))
+    # index() の「今日の時間割」
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_timetable_weekday_period
+        ON timetable (weekday, period)
+    """))
+
+
+def add_task_completed_at(conn):
+    # 差分学習（train_model.update_model）の起点に使う完了日時
+    _add_column(conn, "task", "completed_at", "DATETIME")
+
+
+def create_duration_stats(conn):
+    # model/online.py のオンライン推定。既存の実績の平均で初期化しておく
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS duration_stats (
+            subject TEXT NOT NULL,
+            category TEXT NOT NULL,
+            difficulty INTEGER NOT NULL,
+            mean_minutes REAL NOT NULL,
+            n INTEGER NOT NULL,
+            updated_at DATETIME NOT NULL,
+            PRIMARY KEY (subject, category, difficulty)
+        )
+    """))
+    conn.execute(text("""
+        INSERT OR IGNORE INTO duration_stats (subject, category, difficulty, mean_minutes, n, updated_at)
+        SELECT subject, category, difficulty, AVG(time_spent), COUNT(*), :now
+        FROM task
+        WHERE time_spent IS NOT NULL
+        GROUP BY subject, category, difficulty
+    """), {"now": datetime.now()})
+
+
+def add_timetable_unique_slot(conn):
+    # 同じコマの重複は最後に登録したものだけ残し、(曜日, 時限) を一意にする（settings_service の upsert 用）
+    conn.execute(text("""
+        DELETE FROM timetable
+        WHERE id NOT IN (SELECT MAX(id) FROM timetable GROUP BY weekday, period)
+    """))
+    conn.execute(text("DROP INDEX IF EXISTS idx_timetable_weekday_period"))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_timetable_weekday_period
+        ON timetable (weekday, period)
+    """))
+
+
+def add_user_id(conn):
+    # 1 つの DB で複数の利用者を扱う。既存のデータはすべて user_id = 1 のもの
+    _add_column(conn, "task", "user_id", "INTEGER NOT NULL DEFAULT 1")
+    _add_column(conn, "timetable", "user_id", "INTEGER NOT NULL DEFAULT 1")
+    _add_column(conn, "plan", "user_id", "INTEGER NOT NULL DEFAULT 1")
+
+    # available_time は weekday が主キーなので、(user_id, weekday) を主キーにして作り直す
+    if "user_id" not in _columns(conn, "available_time"):
+        # 以前の途中で止まった実行が残した表があれば作り直す
+        conn.execute(text("DROP TABLE IF EXISTS available_time_new"))
+        conn.execute(text("""
+            CREATE TABLE available_time_new (
+                user_id INTEGER NOT NULL DEFAULT 1,
+                weekday INTEGER NOT NULL,
+                available_hours REAL,
+                PRIMARY KEY (user_id, weekday)
+            )
+        """))
+        conn.execute(text("""
+            INSERT INTO available_time_new (user_id, weekday, available_hours)
+            SELECT 1, weekday, available_hours FROM available_time
+        """))
+        conn.execute(text("DROP TABLE available_time"))
+        conn.execute(text("ALTER TABLE available_time_new RENAME TO available_time"))
+
+    # plan_state は利用者ごとに持つ（中身は次のアクセスで作り直されるので捨ててよい）
+    if "user_id" not in _columns(conn, "plan_state"):
+        conn.execute(text("DROP TABLE plan_state"))
+        conn.execute(text("""
+            CREATE TABLE plan_state (
+                user_id INTEGER PRIMARY KEY,
+                built_on DATE NOT NULL,
+                horizon_days INTEGER NOT NULL
+            )
+        """))
+
+    # 利用者ごとに引けるよう、先頭に user_id を足した索引に置き換える
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_open_due"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_user_open_due
+        ON task (user_id, due_date, id)
+        WHERE is_completed = 0 AND is_deleted = 0
+    """))
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_candidates"))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_user_candidates
+        ON task (user_id, id, predicted_time, due_date)
+        WHERE time_spent IS NULL AND predicted_time IS NOT NULL AND is_deleted = 0
+    """))
+    conn.execute(text("DROP INDEX IF EXISTS ux_timetable_weekday_period"))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_timetable_user_slot
+        ON timetable (user_id, weekday, period)
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_plan_user_date ON plan (user_id, plan_date)"))
+
+
+# 書き込みがあると data_version を進めるテーブル（/api/* の ETag に使う）
+DATA_VERSION_TABLES = ("task", "plan", "timetable", "available_time")
+
+
+def create_data_version(conn):
+    """利用者ごとのデータバージョン。トリガーで、対象テーブルへの書き込み 1 行ごとに 1 進める。"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+    for table in DATA_VERSION_TABLES:
+        for action, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{action.lower()}_data_version
+                AFTER {action} ON {table}
+                BEGIN
+                    INSERT INTO data_version (user_id, version) VALUES ({row}.user_id, 1)
+                    ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+                END
+            """))
+
+
+def add_timetable_version(conn):
+    """時間割だけが変わったことが分かるよう、data_version に timetable_version を足し、時間割のトリガーで両方進める。"""
+    _add_column(conn, "data_version", "timetable_version", "INTEGER NOT NULL DEFAULT 0")
+    for action, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        name = f"trg_timetable_{action.lower()}_data_version"
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(f"""
+            CREATE TRIGGER {name}
+            AFTER {action} ON timetable
+            BEGIN
+                INSERT INTO data_version (user_id, version, timetable_version) VALUES ({row}.user_id, 1, 1)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    version = version + 1,
+                    timetable_version = timetable_version + 1;
+            END
+        """))
+
+
+def add_plan_revision(conn):
+    """今日の日程を書き換えた回数（planner.TodayPlan が、ほかのワーカーの書き換えに気づくため）。"""
+    _add_column(conn, "plan_state", "revision", "INTEGER NOT NULL DEFAULT 0")
+
+
+def create_work_session(conn):
+    """タイマー画面の作業セッション（work_sessions.py がハートビートをまとめて書き込む）。"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS work_session (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_key TEXT NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            started_at DATETIME NOT NULL,
+            last_seen_at DATETIME NOT NULL,
+            active_seconds REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            ended_at DATETIME
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_work_session_task ON work_session (task_id)"))
+    # 放置セッションの掃除用（開いているセッションだけ）
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_work_session_open
+        ON work_session (last_seen_at)
+        WHERE status IN ('active', 'paused')
+    """))
+
+
+def create_task_archive(conn):
+    """完了・削除済みの古いタスクの置き場所（archive_tasks.py が task から移す）。列は task と同じ＋archived_at。"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS task_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL DEFAULT 1,
+            subject TEXT NOT NULL,
+            category TEXT NOT NULL,
+            difficulty INTEGER NOT NULL,
+            due_date DATE NOT NULL,
+            created_at DATETIME NOT NULL,
+            predicted_time REAL,
+            time_spent REAL,
+            assigned_for_today INTEGER DEFAULT 0,
+            assigned_date DATE,
+            is_completed BOOLEAN DEFAULT 0,
+            is_deleted INTEGER DEFAULT 0,
+            completed_at DATETIME,
+            archived_at DATETIME NOT NULL
+        )
+    """))
+    # 差分学習（completed_at より後に完了したもの）用
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_archive_completed
+        ON task_archive (completed_at)
+        WHERE time_spent IS NOT NULL
+    """))
+    # archive_tasks.py が移せるタスクを ID 順に探す用
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_archivable
+        ON task (id)
+        WHERE is_completed = 1 OR is_deleted = 1
+    """))
+
+
+def create_task_features(conn):
+    """学習・一括予測用の特徴量ストア（model/features.py）。既存のタスクとアーカイブの分も作っておく。"""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS feature_vocab (
+            code INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            UNIQUE (kind, value)
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS task_features (
+            task_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            subject_code INTEGER NOT NULL,
+            category_code INTEGER NOT NULL,
+            difficulty INTEGER NOT NULL,
+            days_until_due INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            time_spent REAL,
+            completed_at DATETIME
+        )
+    """))
+    # 差分学習（completed_at より後に完了したもの）と利用者ごとの学習用
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_features_completed
+        ON task_features (completed_at)
+        WHERE time_spent IS NOT NULL
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_task_features_user
+        ON task_features (user_id)
+        WHERE time_spent IS NOT NULL
+    """))
+    _materialize_features_v14(conn, "task_archive")
+    _materialize_features_v14(conn, "task")
+
+
+# マイグレーションで特徴量ストアの行を作るときの式。features.materialize() が後で変わっても、
+# 同じマイグレーションは同じ結果になるように、そのときの式をここに固定しておく
+_FEATURES_V14 = {
+    "days_until_due": "CAST(julianday(t.due_date) - julianday(t.created_at) + 100000 AS INTEGER) - 100000",
+    "weekday": "(CAST(strftime('%w', t.created_at) AS INTEGER) + 6) % 7",
+    "dated": "julianday(t.due_date) IS NOT NULL AND julianday(t.created_at) IS NOT NULL",
+}
+_FEATURES_V15 = {
+    "days_until_due": "t.due_day - t.created_epoch / 86400 - (t.created_epoch % 86400 > 0)",
+    "weekday": "(t.created_epoch / 86400 + 3) % 7",
+    "dated": "t.due_day IS NOT NULL AND t.created_epoch IS NOT NULL",
+}
+
+
+def _materialize_features_v14(conn, table):
+    """create_task_features を作ったときの features.materialize()（まだ特徴量の行が無いタスクの分）。"""
+    _materialize_missing_features(conn, table, _FEATURES_V14)
+
+
+def _materialize_missing_features(conn, table, expressions):
+    """table のタスクのうち、まだ特徴量の行が無いものの行を expressions の式で作る。"""
+    missing = "NOT EXISTS (SELECT 1 FROM task_features f WHERE f.task_id = id)"
+    conn.execute(text(f"""
+        INSERT OR IGNORE INTO feature_vocab (kind, value)
+        SELECT 'subject', subject FROM {table} WHERE {missing}
+        UNION
+        SELECT 'category', category FROM {table} WHERE {missing}
+    """))
+    conn.execute(text(f"""
+        INSERT OR REPLACE INTO task_features (task_id, user_id, subject_code, category_code, difficulty,
+                                              days_until_due, weekday, time_spent, completed_at)
+        SELECT t.id, t.user_id, s.code, c.code, t.difficulty,
+               {expressions["days_until_due"]},
+               {expressions["weekday"]},
+               t.time_spent, t.completed_at
+        FROM {table} t
+        JOIN feature_vocab s ON s.kind = 'subject' AND s.value = t.subject
+        JOIN feature_vocab c ON c.kind = 'category' AND c.value = t.category
+        WHERE {missing}
+          AND {expressions["dated"]}
+    """))
+
+
+def _backfill(conn, table, assignments):
+    """
+    table の既存の行に SET assignments を実行する。
+    マイグレーションの BEGIN IMMEDIATE のトランザクションの中で 1 文で更新する（途中で止まれば全部戻り、半端な状態を残さない）。
+    行数に比例する時間だけ書き込みロックを持つので、大きな DB では利用の少ない時間に適用すること。
+    """
+    conn.execute(text(f"UPDATE {table} SET {assignments}"))
+
+
+def _backfill_temporal(conn, table):
+    """table の due_day / created_epoch を埋める。"""
+    _backfill(conn, table, f"due_day = {temporal.DUE_DAY_SQL.format(column='due_date')}, "
+                                 f"created_epoch = {temporal.EPOCH_SQL.format(column='created_at')}")
+
+
+def add_task_temporal_columns(conn):
+    """
+    締切日・登録日時の整数の列（temporal.py）。日付の文字列は形式がまちまちなので、比較・計算はこちらで行う。
+    アプリ以外（seed_data.py や pandas の to_sql など）が書いた行も、トリガーで書き込みに合わせる。
+    """
+    for table in ("task", "task_archive"):
+        _add_column(conn, table, "due_day", "INTEGER")
+        _add_column(conn, table, "created_epoch", "INTEGER")
+        _backfill_temporal(conn, table)
+
+    values = (f"due_day = {temporal.DUE_DAY_SQL.format(column='NEW.due_date')}, "
+              f"created_epoch = {temporal.EPOCH_SQL.format(column='NEW.created_at')}")
+    # アプリは INSERT で値を渡すので、渡されなかったときだけ埋める
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_task_insert_temporal
+        AFTER INSERT ON task
+        WHEN NEW.due_day IS NULL OR NEW.created_epoch IS NULL
+        BEGIN
+            UPDATE task SET {values} WHERE id = NEW.id;
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_task_update_temporal
+        AFTER UPDATE OF due_date, created_at ON task
+        BEGIN
+            UPDATE task SET {values} WHERE id = NEW.id;
+        END
+    """))
+
+    # 締切順の一覧・日程づくりの索引を、文字列の due_date から due_day に置き換える
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_user_open_due"))
+    conn.execute(text("""
+        CREATE INDEX idx_task_user_open_due
+        ON task (user_id, due_day, id)
+        WHERE is_completed = 0 AND is_deleted = 0
+    """))
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_user_candidates"))
+    conn.execute(text("""
+        CREATE INDEX idx_task_user_candidates
+        ON task (user_id, id, predicted_time, due_day)
+        WHERE time_spent IS NULL AND predicted_time IS NOT NULL AND is_deleted = 0
+    """))
+
+    # 特徴量ストアの行を整数の列から作り直す（締切日は日付として扱う）
+    conn.execute(text("DELETE FROM task_features"))
+    _materialize_missing_features(conn, "task_archive", _FEATURES_V15)
+    _materialize_missing_features(conn, "task", _FEATURES_V15)
+
+
+def sort_undated_tasks_last(conn):
+    """
+    締切日が読めないタスク（due_day が NULL）を締切順の一覧の最後に並べる。
+    一覧は temporal.DUE_ORDER_SQL の式で並べてページングするので、索引も同じ式にする。
+    """
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_user_open_due"))
+    conn.execute(text(f"""
+        CREATE INDEX idx_task_user_open_due
+        ON task (user_id, {temporal.DUE_ORDER_SQL.format(column="due_day")}, id)
+        WHERE is_completed = 0 AND is_deleted = 0
+    """))
+    undated = conn.execute(text("""
+        SELECT COUNT(*) FROM task WHERE due_day IS NULL AND is_completed = 0 AND is_deleted = 0
+    """)).scalar()
+    if undated:
+        logger.warning("🟡 締切日が読めない未完了のタスクが %d 件あります（一覧の最後に並びます）", undated)
+
+
+def add_task_completed_epoch(conn):
+    """
+    完了日時の整数の列 completed_epoch（temporal.epoch_seconds() と同じ秒数）。
+    保持期間の判定（archive_tasks.py）を文字列ではなく整数で比べるためのもの。
+    アプリは完了時に値を渡す。渡さなかった書き込みはトリガーで completed_at に合わせる。
+    """
+    value = temporal.EPOCH_SQL.format(column="NEW.completed_at")
+    for table in ("task", "task_archive"):
+        _add_column(conn, table, "completed_epoch", "INTEGER")
+        _backfill(conn, table, f"completed_epoch = {temporal.EPOCH_SQL.format(column='completed_at')}")
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_task_insert_completed_epoch
+        AFTER INSERT ON task
+        WHEN NEW.completed_at IS NOT NULL AND NEW.completed_epoch IS NULL
+        BEGIN
+            UPDATE task SET completed_epoch = {value} WHERE id = NEW.id;
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_task_update_completed_epoch
+        AFTER UPDATE OF completed_at ON task
+        WHEN NEW.completed_epoch IS OLD.completed_epoch
+        BEGIN
+            UPDATE task SET completed_epoch = {value} WHERE id = NEW.id;
+        END
+    """))
+
+
+def add_feature_completed_epoch(conn):
+    """
+    特徴量ストアにも完了日時の epoch 秒を持たせ、差分学習の起点（watermark）を整数で比べる
+    （completed_at の文字列は書いたプログラムによって形式がまちまちなので、文字列の大小は時刻の前後と一致しない）。
+    """
+    _add_column(conn, "task_features", "completed_epoch", "INTEGER")
+    _backfill(conn, "task_features", f"completed_epoch = {temporal.EPOCH_SQL.format(column='completed_at')}")
+    conn.execute(text("DROP INDEX IF EXISTS idx_task_features_completed"))
+    conn.execute(text("""
+        CREATE INDEX idx_task_features_completed
+        ON task_features (completed_epoch)
+        WHERE time_spent IS NOT NULL
+    """))
+
+
+def create_plan_log(conn):
+    """
+    今日の日程の revision ごとに、状態が変わりうるタスク（planner._persist が書く）。
+    ほかのワーカーが書き換えた分だけを読み直して、手元の TodayPlan を差分で追いつかせるためのもの。
+    """
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS plan_log (
+            user_id INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, revision, task_id)
+        ) WITHOUT ROWID
+    """))
+
+
+# (バージョン, 名前, 処理)。追加するときは末尾に足すこと
+def add_task_deleted_epoch(conn):
+    """
+    削除日時の整数の列 deleted_epoch（temporal.epoch_seconds() と同じ秒数）。アプリは削除時に値を渡す。
+    保持期間（archive_tasks.py）を完了していない削除済みタスクでは削除した時から数えるためのもの。
+    削除日時は今まで残していないので、既存の行は NULL のまま（登録日時から数える）。
+    """
+    for table in ("task", "task_archive"):
+        _add_column(conn, table, "deleted_epoch", "INTEGER")
+
+
+MIGRATIONS = [
+    (1, "create_base_tables", create_base_tables),
+    (2, "add_task_flags", add_task_flags),
+    (3, "create_plan_tables", create_plan_tables),
+    (4, "create_task_indexes", create_task_indexes),
+    (5, "add_task_completed_at", add_task_completed_at),
+    (6, "create_duration_stats", create_duration_stats),
+    (7, "add_timetable_unique_slot", add_timetable_unique_slot),
+    (8, "add_user_id", add_user_id),
+    (9, "create_data_version", create_data_version),
+    (10, "add_timetable_version", add_timetable_version),
+    (11, "add_plan_revision", add_plan_revision),
+    (12, "create_work_session", create_work_session),
+    (13, "create_task_archive", create_task_archive),
+    (14, "create_task_features", create_task_features),
+    (15, "add_task_temporal_columns", add_task_temporal_columns),
+    (16, "sort_undated_tasks_last", sort_undated_tasks_last),
+    (17, "add_task_completed_epoch", add_task_completed_epoch),
+    (18, "add_feature_completed_epoch", add_feature_completed_epoch),
+    (19, "create_plan_log", create_plan_log),
+    (20, "add_task_deleted_epoch", add_task_deleted_epoch),
+]
+
+
+def applied_versions(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+    """))
+    return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+
+
+@contextmanager
+def _write_transaction(engine):
+    """
+    最初から書き込みロックを持つトランザクション（SQLite の BEGIN IMMEDIATE）。
+    pysqlite は DDL の前に BEGIN を出さないので、自動コミットにして BEGIN / COMMIT を自分で出す。
+    """
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as conn:
+            yield conn
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            if conn.connection.driver_connection.in_transaction:
+                conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+
+
+def run_migrations(engine):
+    """未適用のマイグレーションを 1 件ずつ別トランザクションで実行する。適用したバージョンを返す。"""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with _write_transaction(engine) as conn:
+            # ロックを取る前に別のプロセスが適用していれば何もしない
+            if conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = :version"),
+                            {"version": version}).first():
+                continue
+            migrate(conn)
+            conn.execute(text("""
+                INSERT OR IGNORE INTO schema_migrations (version, name, applied_at)
+                VALUES (:version, :name, :applied_at)
+            """), {"version": version, "name": name, "applied_at": datetime.now()})
+        applied.append(version)
+        logger.info("✅ マイグレーション %03d_%s を適用しました", version, name)
+    return applied
+
+
+if __name__ == "__main__":
+    from db import get_engine
+
+    run_migrations(get_engine())
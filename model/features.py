@@ -0,0 +1,166 @@
+"""
+特徴量ストア（task_features テーブル）。
+
+タスクを登録したとき・完了したときに materialize() で、説明変数と実績を数値だけの 1 行にして保存しておく。
+- 教科・カテゴリは feature_vocab の整数コード（一度振ったコードは変えない）
+- days_until_due・weekday は task の整数の日付列（temporal.py）から求める（締切日 0 時 − 登録日時の日数を切り捨て、月曜 = 0）
+学習（train_model）と一括予測（model/predict.py）はここから NumPy 配列を読むだけで、日付の解析や計算をやり直さない。
+task_archive に移したタスクの行もここに残るので、学習はこの表だけを読めばよい。
+アプリを通らずに入ったタスク（seed_data.py など）の行は、学習・一括予測の前に materialize() でまとめて作る。
+"""
+import json
+
+import numpy as np
+from sqlalchemy import text
+
+# 数値の説明変数（学習時の列順。この後ろに教科・カテゴリの one-hot が続く）
+NUMERIC_FEATURES = ("difficulty", "days_until_due", "weekday")
+
+# 特徴量を作るタスクの条件（ids を渡したときと、まだ行が無いものすべてのとき）
+_BY_IDS = "id IN (SELECT value FROM json_each(:ids))"
+_MISSING = "NOT EXISTS (SELECT 1 FROM task_features f WHERE f.task_id = id)"
+
+
+def materialize(conn, task_ids=None, table="task", refresh=True):
+    """
+    table のタスク task_ids の特徴量を作り直す（登録・完了のトランザクションの中で呼ぶ）。
+    task_ids を省略すると、まだ特徴量の行が無いタスクすべての行を作る。
+    refresh=False なら task_ids のうち行が無いものだけを作る。作った行数を返す。
+    日付が読めないタスクは作らない（学習・予測でも使わない）。
+    """
+    conditions = []
+    if task_ids is not None:
+        conditions.append(_BY_IDS)
+    if task_ids is None or not refresh:
+        conditions.append(_MISSING)
+    condition = " AND ".join(conditions)
+    params = {"ids": json.dumps([int(i) for i in task_ids or []])}
+    conn.execute(text(f"""
+        INSERT OR IGNORE INTO feature_vocab (kind, value)
+        SELECT 'subject', subject FROM {table} WHERE {condition}
+        UNION
+        SELECT 'category', category FROM {table} WHERE {condition}
+    """), params)
+    # 日付は整数の列（temporal.py）から計算する。日数・曜日は temporal.days_until() / weekday() と同じ式
+    return conn.execute(text(f"""
+        INSERT OR REPLACE INTO task_features (task_id, user_id, subject_code, category_code, difficulty,
+                                              days_until_due, weekday, time_spent, completed_at, completed_epoch)
+        SELECT t.id, t.user_id, s.code, c.code, t.difficulty,
+               t.due_day - t.created_epoch / 86400 - (t.created_epoch % 86400 > 0),
+               (t.created_epoch / 86400 + 3) % 7,
+               t.time_spent, t.completed_at, t.completed_epoch
+        FROM {table} t
+        JOIN feature_vocab s ON s.kind = 'subject' AND s.value = t.subject
+        JOIN feature_vocab c ON c.kind = 'category' AND c.value = t.category
+        WHERE {condition}
+          AND t.due_day IS NOT NULL AND t.created_epoch IS NOT NULL
+    """), params).rowcount
+
+
+def load_vocab(conn):
+    """{(種類, 値): コード} を返す（種類は 'subject' / 'category'）。"""
+    rows = conn.execute(text("SELECT kind, value, code FROM feature_vocab"))
+    return {(kind, value): code for kind, value, code in rows}
+
+
+class FeatureArrays:
+    """task_features から読んだ行を列ごとの NumPy 配列にしたもの。"""
+
+    def __init__(self, rows):
+        columns = list(zip(*rows)) or [()] * 8
+        self.task_id = np.array(columns[0], dtype=np.int64)
+        self.user_id = np.array(columns[1], dtype=np.int64)
+        self.subject_code = np.array(columns[2], dtype=np.intp)
+        self.category_code = np.array(columns[3], dtype=np.intp)
+        self.numeric = np.column_stack([np.array(c, dtype=float) for c in columns[4:7]]).reshape(-1, 3)
+        self.time_spent = np.array([np.nan if v is None else v for v in columns[7]], dtype=float)
+        self.completed_epoch = columns[8] if len(columns) > 8 else ()
+
+    def __len__(self):
+        return len(self.task_id)
+
+    def take(self, mask):
+        """mask の行だけを持つ FeatureArrays を返す。"""
+        part = object.__new__(FeatureArrays)
+        for name in ("task_id", "user_id", "subject_code", "category_code", "numeric", "time_spent"):
+            setattr(part, name, getattr(self, name)[mask])
+        part.completed_epoch = ()
+        return part
+
+    def watermark(self):
+        """最も新しい完了日時の epoch 秒（次の差分学習の起点）。完了日時のある行が無ければ None。"""
+        completed = [value for value in self.completed_epoch if value is not None]
+        return max(completed) if completed else None
+
+
+_COLUMNS = "f.task_id, f.user_id, f.subject_code, f.category_code, f.difficulty, f.days_until_due, f.weekday, f.time_spent"
+
+
+def load_training_arrays(conn, since=None, user_id=None):
+    """
+    学習データ（実績のある行）を読む。since（epoch 秒）を渡すとその時刻より後に完了した行だけ、
+    user_id を渡すとその利用者の行だけを読む。
+    """
+    conditions = "f.time_spent IS NOT NULL"
+    params = {}
+    if since is not None:
+        conditions += " AND f.completed_epoch > :since"
+        params["since"] = since
+    if user_id is not None:
+        conditions += " AND f.user_id = :user_id"
+        params["user_id"] = user_id
+    rows = conn.execute(text(f"""
+        SELECT {_COLUMNS}, f.completed_epoch FROM task_features f WHERE {conditions}
+    """), params).fetchall()
+    return FeatureArrays(rows)
+
+
+def load_unscored_arrays(conn, task_ids=None, after_id=0, limit=-1):
+    """
+    まだ予測していないタスクの特徴量を ID 順に読む。
+    task_ids を渡すとそのタスクだけ、省略すると after_id より後のものを limit 件まで読む。
+    """
+    condition = "t.id IN (SELECT value FROM json_each(:ids))" if task_ids is not None else "t.id > :after_id"
+    rows = conn.execute(text(f"""
+        SELECT {_COLUMNS} FROM task t JOIN task_features f ON f.task_id = t.id
+        WHERE {condition} AND t.time_spent IS NULL AND t.predicted_time IS NULL
+        ORDER BY t.id
+        LIMIT :limit
+    """), {"ids": json.dumps([int(i) for i in task_ids or []]), "after_id": after_id, "limit": limit}).fetchall()
+    return FeatureArrays(rows)
+
+
+def code_positions(encoder, vocab):
+    """
+    feature_vocab のコード -> 特徴量行列の列位置の配列と、特徴量の列数を返す。
+    列順は [difficulty, days_until_due, weekday, subject_*, category_*]（エンコーダの並び）。
+    エンコーダが知らないコードの位置は -1（handle_unknown='ignore' と同じく全列 0 になる）。
+    """
+    positions = np.full(max(vocab.values(), default=0) + 1, -1, dtype=np.intp)
+    offset = len(NUMERIC_FEATURES)
+    for kind, values in zip(("subject", "category"), encoder.categories_):
+        for value in values:
+            code = vocab.get((kind, value))
+            if code is not None:
+                positions[code] = offset
+            offset += 1
+    return positions, offset
+
+
+def _lookup(positions, codes):
+    inside = codes < len(positions)
+    return np.where(inside, positions[np.where(inside, codes, 0)], -1)
+
+
+def design_matrix(arrays, positions, width):
+    """特徴量行列と、教科・カテゴリの両方をエンコーダが知っている行の真偽値を返す。"""
+    X = np.zeros((len(arrays), width))
+    X[:, :len(NUMERIC_FEATURES)] = arrays.numeric
+    rows = np.arange(len(arrays))
+    known = np.ones(len(arrays), dtype=bool)
+    for codes in (arrays.subject_code, arrays.category_code):
+        pos = _lookup(positions, codes)
+        hit = pos >= 0
+        X[rows[hit], pos[hit]] = 1.0
+        known &= hit
+    return X, known
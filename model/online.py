@@ -0,0 +1,117 @@
+"""
+(教科, カテゴリ, 難易度) ごとの所要時間のオンライン推定（指数移動平均）。
+
+タスクが完了するたびに update_from_task() で 1 行だけ更新する（再学習は不要）。
+予測側では get_stats() でプロセスごとに 1 つ持っている表を使い、
+- エンコーダが知らない教科・カテゴリのとき、モデルの予測に失敗したときはこちらの値をそのまま使い、
+- それ以外はランダムフォレストの予測と件数に応じた重みで混ぜる。
+表は ONLINE_STATS_CHECK_INTERVAL 秒おきに (行数, 最終更新日時) を確かめ、変わっていたときだけ読み直す。
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+# 指数移動平均の係数（大きいほど最近の実績を重く見る）
+ONLINE_EWMA_ALPHA = float(os.environ.get("ONLINE_EWMA_ALPHA", 0.2))
+
+# フォレストの予測と混ぜるときのオンライン推定の最大の重みと、重みが半分になる件数
+ONLINE_MAX_WEIGHT = float(os.environ.get("ONLINE_MAX_WEIGHT", 0.5))
+ONLINE_PRIOR_N = 5
+
+# duration_stats が更新されたかを確かめる間隔（秒）
+ONLINE_STATS_CHECK_INTERVAL = float(os.environ.get("ONLINE_STATS_CHECK_INTERVAL", 5))
+
+_stats = None       # (行数, 最終更新日時) と OnlineStats
+_checked_at = 0.0
+_stats_lock = threading.Lock()
+
+
+def update_from_task(conn, task_id, minutes):
+    """
+    完了したタスクの実績 minutes（分）で、そのタスクの (教科, カテゴリ, 難易度) の推定値を更新する。
+    件数が少ないうちは 1/(n+1) を係数にして単純平均と同じになるようにする。
+    """
+    conn.execute(text("""
+        INSERT INTO duration_stats (subject, category, difficulty, mean_minutes, n, updated_at)
+        SELECT subject, category, difficulty, :minutes, 1, :now
+        FROM task
+        WHERE id = :task_id
+        ON CONFLICT (subject, category, difficulty) DO UPDATE SET
+            mean_minutes = mean_minutes
+                + MAX(:alpha, 1.0 / (n + 1)) * (excluded.mean_minutes - mean_minutes),
+            n = n + 1,
+            updated_at = excluded.updated_at
+    """), {"task_id": task_id, "minutes": minutes, "alpha": ONLINE_EWMA_ALPHA, "now": datetime.now()})
+    # このプロセスでは次の get_stats() ですぐに確かめ直す
+    invalidate()
+
+
+class OnlineStats:
+    """duration_stats の内容。完全一致が無ければ (教科, カテゴリ) → カテゴリ → 全体の順に件数で重み付けした平均を使う。"""
+
+    def __init__(self, rows):
+        self.exact = {}
+        totals = {}
+        for subject, category, difficulty, mean, n in rows:
+            self.exact[(subject, category, int(difficulty))] = (mean, n)
+            for key in ((subject, category), (None, category), (None, None)):
+                weighted, count = totals.get(key, (0.0, 0))
+                totals[key] = (weighted + mean * n, count + n)
+        self.grouped = {key: (weighted / count, count) for key, (weighted, count) in totals.items() if count}
+
+    def estimate(self, subject, category, difficulty):
+        """(推定値, 件数) を返す。まったくデータが無ければ (None, 0)。"""
+        hit = self.exact.get((subject, category, int(difficulty)))
+        if hit is not None:
+            return hit
+        for key in ((subject, category), (None, category), (None, None)):
+            hit = self.grouped.get(key)
+            if hit is not None:
+                return hit
+        return None, 0
+
+    def blend(self, forest_minutes, subject, category, difficulty, known=True):
+        """
+        フォレストの予測と混ぜた値を返す。
+        forest_minutes が None（予測失敗）か known が False（エンコーダが知らない教科・カテゴリ）ならオンライン推定だけを使う。
+        オンライン推定が無ければ forest_minutes をそのまま返す（どちらも無ければ None）。
+        """
+        mean, n = self.estimate(subject, category, difficulty)
+        if mean is None:
+            return forest_minutes
+        if forest_minutes is None or not known:
+            return mean
+        weight = ONLINE_MAX_WEIGHT * n / (n + ONLINE_PRIOR_N)
+        return (1 - weight) * forest_minutes + weight * mean
+
+
+def load_stats(conn):
+    rows = conn.execute(text("""
+        SELECT subject, category, difficulty, mean_minutes, n FROM duration_stats
+    """)).fetchall()
+    return OnlineStats(rows)
+
+
+def invalidate():
+    """次の get_stats() で duration_stats が変わったかを確かめさせる。"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def get_stats(engine):
+    """プロセスで共有する OnlineStats を返す（ONLINE_STATS_CHECK_INTERVAL 秒以内なら DB を読まない）。"""
+    global _stats, _checked_at
+    if _stats is not None and time.monotonic() - _checked_at < ONLINE_STATS_CHECK_INTERVAL:
+        return _stats[1]
+    with _stats_lock:
+        if _stats is not None and time.monotonic() - _checked_at < ONLINE_STATS_CHECK_INTERVAL:
+            return _stats[1]
+        with engine.connect() as conn:
+            stamp = tuple(conn.execute(text("SELECT COUNT(*), MAX(updated_at) FROM duration_stats")).fetchone())
+            if _stats is None or _stats[0] != stamp:
+                _stats = (stamp, load_stats(conn))
+        _checked_at = time.monotonic()
+        return _stats[1]
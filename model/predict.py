@@ -1,122 +1,258 @@
-import pandas as pd
-import pickle
-from datetime import datetime
-from sqlalchemy import create_engine
+import logging
+import numpy as np
+import time
+import warnings
+from functools import lru_cache
+from sqlalchemy import text
 
-# モデルとエンコーダの読み込み
-with open("model/model.pkl", "rb") as f:
-    model = pickle.load(f)
+import metrics
+import temporal
+from db import get_engine
+from model import features, online, registry
 
-with open("model/encoder.pkl", "rb") as f:
-    encoder = pickle.load(f)
+logger = logging.getLogger(__name__)
 
-# DB接続
-engine = create_engine('sqlite:///database.db')
+# DB接続（アプリと共通。以前は実行時のカレントディレクトリの database.db を開いていた）
+engine = get_engine()
 
+# 以前のモデルは DataFrame（列名つき）で学習しているので、NumPy 配列で予測すると毎回警告が出る。
+# 列の並びは _FeatureLayout で学習時と揃えているので、この警告だけ無視する
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
 
-def batch_predict_missing_tasks():
+# predict_single_task() の結果をいくつまで覚えておくか
+PREDICT_CACHE_SIZE = 4096
+
+# batch_predict_missing_tasks() で一度に読み込んで予測する件数
+BATCH_CHUNK_SIZE = 5000
+
+# 数値の説明変数（学習時の列順）
+NUMERIC_FEATURES = features.NUMERIC_FEATURES
+
+
+class _FeatureLayout:
     """
-    DB内の predicted_time が NULL のタスクに対して予測を実行し、データベースを更新する。
-    Flaskアプリ起動時に一度だけ実行される。
+    学習済み OneHotEncoder から、特徴量ベクトルの各列の位置を一度だけ求めておく。
+    列順は train_model.py と同じ [difficulty, days_until_due, weekday, subject_*, category_*]。
+    未知のカテゴリは handle_unknown='ignore' と同じく全列 0 になる。
     """
-    df_new = pd.read_sql("""
-        SELECT id, subject, category, difficulty, due_date, created_at
-        FROM task
-        WHERE time_spent IS NULL AND predicted_time IS NULL
-    """, engine)
 
-    if df_new.empty:
-        print("🟡 新しい予測対象のタスクはありません")
-        return
+    def __init__(self, encoder):
+        subjects, categories = encoder.categories_
+        offset = len(NUMERIC_FEATURES)
+        self.subject_pos = {value: offset + i for i, value in enumerate(subjects)}
+        offset += len(subjects)
+        self.category_pos = {value: offset + i for i, value in enumerate(categories)}
+        self.width = offset + len(categories)
 
-    # 日付の変換と前処理
-    df_new['due_date'] = pd.to_datetime(df_new['due_date'], errors='coerce')
-    df_new['created_at'] = pd.to_datetime(df_new['created_at'], errors='coerce')
-    df_new = df_new.dropna(subset=['due_date', 'created_at'])
+    def row(self, subject, category, difficulty, days_until_due, weekday):
+        x = np.zeros((1, self.width))
+        x[0, 0] = difficulty
+        x[0, 1] = days_until_due
+        x[0, 2] = weekday
+        pos = self.subject_pos.get(subject)
+        if pos is not None:
+            x[0, pos] = 1.0
+        pos = self.category_pos.get(category)
+        if pos is not None:
+            x[0, pos] = 1.0
+        return x
 
-    if df_new.empty:
-        print("❌ 有効な日付データがないため、予測できません")
-        return
 
-    # 特徴量の作成
-    df_new['days_until_due'] = (df_new['due_date'] - df_new['created_at']).dt.days
-    df_new['weekday'] = df_new['created_at'].dt.weekday
+class _Predictor:
+    """読み込んだモデル 1 バージョン分の特徴量レイアウトと予測キャッシュ。"""
 
-    # 説明変数の整備
-    X_raw = df_new[['subject', 'category', 'difficulty', 'days_until_due', 'weekday']]
+    def __init__(self, loaded):
+        self.version = loaded.version
+        self.model = loaded.model
+        self.encoder = loaded.encoder
+        self.layout = _FeatureLayout(loaded.encoder)
+        self._positions = (None, None, None)  # (語彙の件数, コード -> 列位置, 列数)
+        # モデルが差し替わったらキャッシュごと捨てる
+        self.predict_features = lru_cache(maxsize=PREDICT_CACHE_SIZE)(self._predict_features)
 
-    # カテゴリ変数をエンコード
-    try:
-        X_cat = encoder.transform(X_raw[['subject', 'category']])
-        X_cat_df = pd.DataFrame(X_cat, columns=encoder.get_feature_names_out(['subject', 'category']))
-    except Exception as e:
-        print(f"❌ カテゴリ変数のエンコードに失敗しました: {e}")
-        return
+    def _predict_features(self, subject, category, difficulty, days_until_due, weekday):
+        x = self.layout.row(subject, category, difficulty, days_until_due, weekday)
+        start = time.perf_counter()
+        predicted = float(self.model.predict(x)[0])
+        metrics.observe_inference("single", time.perf_counter() - start)
+        return predicted
+
+    def design_matrix(self, arrays, vocab):
+        """特徴量ストアの配列から特徴量行列を作る（コードの列位置は語彙が増えたときだけ求め直す）。"""
+        size, positions, width = self._positions
+        if size != len(vocab):
+            positions, width = features.code_positions(self.encoder, vocab)
+            self._positions = (len(vocab), positions, width)
+        return features.design_matrix(arrays, positions, width)
+
+
+# 共通のモデル（キー None）と利用者ごとのモデル（キー user_id）の _Predictor
+_predictors = {}
 
-    # 数値データと連結
-    X_final = pd.concat([X_raw.drop(columns=['subject', 'category']).reset_index(drop=True), X_cat_df], axis=1)
 
-    # 予測
+def get_predictor(user_id=None):
+    """
+    今のモデルの _Predictor を返す（レジストリのバージョンが変わっていれば作り直す）。
+    user_id を渡すと、その利用者専用のモデルがあればそちらを使う。
+    """
+    loaded = registry.get(user_id)
+    predictor = _predictors.get(loaded.user_id)
+    if predictor is None or predictor.version != loaded.version:
+        if len(_predictors) > registry.TENANT_MODEL_CACHE_SIZE:
+            _predictors.clear()
+        predictor = _predictors[loaded.user_id] = _Predictor(loaded)
+    return predictor
+
+
+def _predict_arrays(arrays, vocab, stats):
+    """特徴量ストアから読んだ 1 チャンク分のタスクを予測して {id, predicted_time} のリストを返す。"""
+    if len(arrays) == 0:
+        return []
+
+    # 利用者ごとに使うモデルを決め、同じモデルを使う行はまとめて 1 回で予測する
+    forest = np.full(len(arrays), np.nan)
+    known = np.zeros(len(arrays), dtype=bool)
+    user_ids = arrays.user_id
+    groups = {}
     try:
-        predicted_times = model.predict(X_final)
+        for user_id in np.unique(user_ids):
+            predictor = get_predictor(int(user_id))
+            groups.setdefault(id(predictor), (predictor, []))[1].append(user_id)
     except Exception as e:
-        print(f"❌ モデル予測に失敗しました: {e}")
-        return
+        logger.warning("❌ モデルを読み込めないので、オンライン推定だけを使います: %s", e)
+        groups = {}
+
+    for predictor, members in groups.values():
+        mask = np.isin(user_ids, members)
+        try:
+            X, part_known = predictor.design_matrix(arrays.take(mask), vocab)
+            start = time.perf_counter()
+            forest[mask] = predictor.model.predict(X)
+            metrics.observe_inference("batch", time.perf_counter() - start, rows=int(mask.sum()))
+            known[mask] = part_known
+        except Exception as e:
+            # モデルが使えなくても、オンライン推定だけで予測を続ける
+            logger.warning("❌ モデル予測に失敗したので、オンライン推定だけを使います: %s", e)
+    forest = [None if np.isnan(p) else float(p) for p in forest]
+    known = known.tolist()
+
+    # オンライン推定は教科・カテゴリの文字列で引く
+    values = {code: value for (_, value), code in vocab.items()}
+    rows = []
+    for task_id, subject_code, category_code, difficulty, p, k in zip(
+            arrays.task_id.tolist(), arrays.subject_code.tolist(), arrays.category_code.tolist(),
+            arrays.numeric[:, 0].tolist(), forest, known):
+        minutes = stats.blend(p, values[subject_code], values[category_code], int(difficulty), known=k)
+        if minutes is not None:
+            rows.append({"predicted_time": float(minutes), "id": task_id})
+    return rows
+
 
-    df_new['predicted_time'] = predicted_times
+def _save_predictions(rows):
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE task SET predicted_time = :predicted_time WHERE id = :id"), rows)
 
-    # DBに保存
+
+def predict_tasks(task_ids):
+    """
+    指定したタスク（まだ予測していないもの）をまとめて予測して保存する。予測できたタスク ID を返す。
+    バックグラウンドの予測ワーカー（model/worker.py）がマイクロバッチごとに呼ぶ。
+    特徴量は登録時に作ってあるので、無いもの（アプリを通らずに入ったタスク）だけここで作る。
+    """
     with engine.begin() as conn:
-        for _, row in df_new.iterrows():
-            conn.execute(
-                text("UPDATE task SET predicted_time = :predicted_time WHERE id = :id"),
-            {"predicted_time": float(row['predicted_time']), "id": int(row['id'])}
-        )
+        features.materialize(conn, task_ids, refresh=False)
+        arrays = features.load_unscored_arrays(conn, task_ids=task_ids)
+        if len(arrays) == 0:
+            return []
+        vocab = features.load_vocab(conn)
 
-    print(f"✅ 起動時に {len(df_new)} 件のタスクの予測が完了し、データベースに保存されました")
+    rows = _predict_arrays(arrays, vocab, online.get_stats(engine))
+    _save_predictions(rows)
+    return [row["id"] for row in rows]
 
 
-def predict_single_task(subject, category, difficulty, due_date, created_at):
+def batch_predict_missing_tasks(chunk_size=BATCH_CHUNK_SIZE):
+    """
+    DB内の predicted_time が NULL のタスクに対して予測を実行し、データベースを更新する。
+    特徴量ストア（model/features.py）から id 順に chunk_size 件ずつ配列で読み込み、
+    チャンクごとに 1 回の predict と 1 回の executemany で書き戻すので、
+    未予測のタスクが何十万件あってもメモリ使用量はチャンク 1 つ分で済む。
+    """
+    with engine.begin() as conn:
+        features.materialize(conn)
+        # 日付が不正で特徴量を作れないタスクは予測できない
+        skipped = conn.execute(text("""
+            SELECT COUNT(*) FROM task t
+            WHERE t.time_spent IS NULL AND t.predicted_time IS NULL
+              AND NOT EXISTS (SELECT 1 FROM task_features f WHERE f.task_id = t.id)
+        """)).scalar()
+
+    last_id = 0
+    updated = 0
+    while True:
+        with engine.connect() as conn:
+            arrays = features.load_unscored_arrays(conn, after_id=last_id, limit=chunk_size)
+            if len(arrays) == 0:
+                break
+            vocab = features.load_vocab(conn)
+        last_id = int(arrays.task_id[-1])
+
+        try:
+            rows = _predict_arrays(arrays, vocab, online.get_stats(engine))
+        except Exception:
+            logger.exception("❌ モデル予測に失敗しました（id <= %d）", last_id)
+            skipped += len(arrays)
+            continue
+
+        skipped += len(arrays) - len(rows)
+        _save_predictions(rows)
+        updated += len(rows)
+
+    if updated == 0 and skipped == 0:
+        logger.debug("🟡 新しい予測対象のタスクはありません")
+        return 0
+    if skipped:
+        logger.warning("❌ %d 件のタスクは日付が不正などの理由で予測できませんでした", skipped)
+    if updated:
+        logger.info("✅ %d 件のタスクの予測が完了し、データベースに保存されました", updated)
+    return updated
+
+
+def predict_single_task(subject, category, difficulty, due_date, created_at, user_id=None):
     """
     単一タスクの所要時間を予測する関数。
     新しいタスクを追加するときに使用。
+    特徴量は NumPy 配列に直接組み立て、同じ特徴量の予測結果は LRU キャッシュから返す。
+    フォレストの予測はオンライン推定（model/online.py）と混ぜる。
     """
     try:
-        due_date_parsed = pd.to_datetime(due_date, errors='coerce')
-        created_at_parsed = pd.to_datetime(created_at, errors='coerce')
+        due_day = temporal.day_number(due_date)
+        created_epoch = temporal.epoch_seconds(created_at)
 
-        if pd.isnull(due_date_parsed) or pd.isnull(created_at_parsed):
-            print("❌ 日付が不正なため、予測できません")
+        if due_day is None or created_epoch is None:
+            logger.warning("❌ 日付が不正なため、予測できません")
             return 0.0
 
-        days_until_due = (due_date_parsed - created_at_parsed).days
-        weekday = created_at_parsed.weekday()
-
-        X_raw = pd.DataFrame([{
-            'subject': subject,
-            'category': category,
-            'difficulty': difficulty,
-            'days_until_due': days_until_due,
-            'weekday': weekday
-        }])
+        # 特徴量ストア（task_features）と同じ整数の計算
+        days_until_due = temporal.days_until(due_day, created_epoch)
+        weekday = temporal.weekday(created_epoch)
 
         try:
-            X_cat = encoder.transform(X_raw[['subject', 'category']])
-            X_cat_df = pd.DataFrame(X_cat, columns=encoder.get_feature_names_out(['subject', 'category']))
+            predictor = get_predictor(user_id)
+            forest = predictor.predict_features(subject, category, int(difficulty), days_until_due, weekday)
+            known = subject in predictor.layout.subject_pos and category in predictor.layout.category_pos
         except Exception as e:
-            print(f"❌ 単一タスクのエンコードに失敗: {e}")
-            return 0.0
-
-        X_final = pd.concat(
-            [X_raw.drop(columns=['subject', 'category']).reset_index(drop=True), X_cat_df],
-            axis=1
-        )
+            logger.warning("❌ モデル予測に失敗したので、オンライン推定だけを使います: %s", e)
+            forest, known = None, False
 
-        predicted_time = model.predict(X_final)[0]
+        predicted_time = online.get_stats(engine).blend(forest, subject, category, difficulty, known=known)
+        if predicted_time is None:
+            return 0.0
 
         # 極端に小さい値（例: 0.0分）は最低1分に丸める（任意）
-        return round(max(float(predicted_time), 1.0), 1)
+        return round(max(predicted_time, 1.0), 1)
 
-    except Exception as e:
-        print(f"❌ 単一タスクの予測中にエラーが発生しました: {e}")
+    except Exception:
+        logger.exception("❌ 単一タスクの予測中にエラーが発生しました")
         return 0.0
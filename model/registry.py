@@ -0,0 +1,207 @@
+"""
+学習済みモデルの置き場所（バージョン付き）。
+
+model/registry/<バージョン>/ に model.joblib と encoder.joblib を置き、
+model/registry/CURRENT に今使うバージョン名を書く。
+publish() は一時ディレクトリに書いてからリネームし、最後に CURRENT を os.replace で差し替えるので、
+読み込み側が書きかけのファイルを見ることはない。
+
+各ワーカーは get() で数秒おきに CURRENT だけを読み、バージョンが変わっていれば再起動なしで新しいモデルに切り替える。
+gunicorn では master が when_ready（gunicorn.conf.py）で共通のモデルを先に読み込んでおくので、
+fork したワーカーはそのバージョンの木の配列をコピーオンライトで共有する（新しいバージョンは各ワーカーが読み込む）。
+
+利用者ごとのモデルは model/registry/tenants/<user_id>/ に同じ形で置く（user_id を渡した publish() / get()）。
+利用者のモデルが無ければ、全員のデータで学習した共通のモデルを使う。
+"""
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.path.join(MODEL_DIR, "registry")
+TENANTS_DIR = os.path.join(REGISTRY_DIR, "tenants")
+
+# レジストリができる前の置き場所（CURRENT が無いときだけ使う）
+LEGACY_MODEL_PATH = os.path.join(MODEL_DIR, "model.pkl")
+LEGACY_ENCODER_PATH = os.path.join(MODEL_DIR, "encoder.pkl")
+LEGACY_VERSION = "legacy"
+
+# CURRENT を見に行く間隔（秒）
+MODEL_CHECK_INTERVAL = float(os.environ.get("MODEL_CHECK_INTERVAL", 5))
+
+# 残しておく古いバージョンの数
+KEEP_VERSIONS = 3
+
+# 利用者ごとのモデルをワーカー内に何人分まで読み込んでおくか
+TENANT_MODEL_CACHE_SIZE = int(os.environ.get("TENANT_MODEL_CACHE_SIZE", 32))
+
+
+class LoadedModel:
+    def __init__(self, version, model, encoder, meta, user_id=None):
+        self.version = version
+        self.model = model
+        self.encoder = encoder
+        self.meta = meta
+        # 利用者ごとのモデルならその user_id、共通のモデルなら None
+        self.user_id = user_id
+
+
+def _root(user_id=None):
+    return REGISTRY_DIR if user_id is None else os.path.join(TENANTS_DIR, str(int(user_id)))
+
+
+def current_version(user_id=None):
+    try:
+        with open(os.path.join(_root(user_id), "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _version_dir(version, user_id=None):
+    return os.path.join(_root(user_id), version)
+
+
+def load_meta(version=None, user_id=None):
+    version = version or current_version(user_id)
+    if version is None:
+        return {}
+    try:
+        with open(os.path.join(_version_dir(version, user_id), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def publish(model, encoder, meta=None, user_id=None):
+    """新しいモデルを書き出して今のバージョンにする（user_id を渡すとその利用者専用のモデル）。バージョン名を返す。"""
+    root = _root(user_id)
+    os.makedirs(root, exist_ok=True)
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    meta = dict(meta or {}, version=version, published_at=datetime.now().isoformat())
+
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=root)
+    try:
+        joblib.dump(model, os.path.join(tmp_dir, "model.joblib"))
+        joblib.dump(encoder, os.path.join(tmp_dir, "encoder.joblib"))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.rename(tmp_dir, _version_dir(version, user_id))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    fd, tmp_current = tempfile.mkstemp(prefix=".CURRENT-", dir=root)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, "CURRENT"))
+
+    _prune(keep=KEEP_VERSIONS, user_id=user_id)
+    return version
+
+
+def _prune(keep, user_id=None):
+    """古いバージョンを消す（モデルは読み込み時にメモリに載せているので、読み込み済みのワーカーはそのまま使える）。"""
+    root = _root(user_id)
+    versions = sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(".") and name != "tenants" and os.path.isdir(os.path.join(root, name))
+    )
+    current = current_version(user_id)
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def load(version=None, user_id=None):
+    """指定したバージョン（省略時は CURRENT、共通のモデルで CURRENT が無ければ旧来の model.pkl）を読み込む。"""
+    version = version or current_version(user_id)
+    if version is None and user_id is None:
+        with open(LEGACY_MODEL_PATH, "rb") as f:
+            model = pickle.load(f)
+        with open(LEGACY_ENCODER_PATH, "rb") as f:
+            encoder = pickle.load(f)
+        return LoadedModel(LEGACY_VERSION, model, encoder, {})
+    if version is None:
+        raise FileNotFoundError(f"利用者 {user_id} のモデルはありません")
+
+    path = _version_dir(version, user_id)
+    model = joblib.load(os.path.join(path, "model.joblib"))
+    encoder = joblib.load(os.path.join(path, "encoder.joblib"))
+    return LoadedModel(version, model, encoder, load_meta(version, user_id), user_id)
+
+
+_loaded = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get(user_id=None):
+    """
+    今のモデルを返す。最初の呼び出しで読み込み、以降は MODEL_CHECK_INTERVAL 秒おきに CURRENT だけを確認する。
+    user_id を渡すと、その利用者専用のモデルがあればそれを、無ければ共通のモデルを返す。
+    """
+    global _loaded, _checked_at
+    if user_id is not None:
+        return _get_tenant(user_id) or get()
+    now = time.monotonic()
+    if _loaded is not None and now - _checked_at < MODEL_CHECK_INTERVAL:
+        return _loaded
+
+    with _lock:
+        if _loaded is not None and now - _checked_at < MODEL_CHECK_INTERVAL:
+            return _loaded
+        version = current_version() or LEGACY_VERSION
+        if _loaded is None or _loaded.version != version:
+            try:
+                _loaded = load(None if version == LEGACY_VERSION else version)
+                logger.info("✅ モデル %s を読み込みました", _loaded.version)
+            except Exception as e:
+                # 読み込めなければ、今までのモデルを使い続ける
+                if _loaded is None:
+                    raise
+                logger.error("❌ モデル %s の読み込みに失敗しました: %s", version, e)
+        _checked_at = now
+        return _loaded
+
+
+# 利用者ごと: user_id -> (LoadedModel または None, 確認した時刻)。None は「専用のモデルが無い」
+_tenants = OrderedDict()
+_tenants_lock = threading.Lock()
+
+
+def _get_tenant(user_id):
+    now = time.monotonic()
+    with _tenants_lock:
+        cached = _tenants.get(user_id)
+        if cached is not None and now - cached[1] < MODEL_CHECK_INTERVAL:
+            _tenants.move_to_end(user_id)
+            return cached[0]
+
+        loaded = cached[0] if cached is not None else None
+        version = current_version(user_id)
+        if version is None:
+            loaded = None
+        elif loaded is None or loaded.version != version:
+            try:
+                loaded = load(version, user_id)
+                logger.info("✅ 利用者 %s のモデル %s を読み込みました", user_id, version)
+            except Exception as e:
+                logger.error("❌ 利用者 %s のモデル %s の読み込みに失敗しました: %s", user_id, version, e)
+
+        _tenants[user_id] = (loaded, now)
+        _tenants.move_to_end(user_id)
+        while len(_tenants) > TENANT_MODEL_CACHE_SIZE:
+            _tenants.popitem(last=False)
+        return loaded
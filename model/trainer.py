@@ -0,0 +1,69 @@
+"""
+タスクの完了をきっかけに、別プロセスでモデルを差分学習させる。
+
+finish_task / partial_finish_task は notify_completion() を呼ぶだけで返り、
+学習（train_model.update_model）はリクエストとは別のプロセスで n_jobs 並列で走る。
+学習中に来た完了は、終わったあとにもう一度だけまとめて学習する。
+新しいモデルは registry.publish() で公開されるので、各ワーカーは次の確認時に切り替わる。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 0 にすると完了時の差分学習を行わない
+INCREMENTAL_TRAINING_ENABLED = os.environ.get("INCREMENTAL_TRAINING", "1") != "0"
+
+_executor = None
+_pending = None
+_again = False
+_lock = threading.Lock()
+
+
+def _run_update():
+    # 学習プロセス側で読み込む（Web ワーカーに sklearn の学習コードを抱えさせない）
+    # spawn したプロセスはログの設定を引き継がないので、ここで設定し直す
+    from log_config import setup_logging
+    setup_logging()
+    import train_model
+    return train_model.update_model()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Web ワーカーはスレッドを持っているので fork ではなく spawn で起動する
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _submit():
+    global _pending
+    _pending = _get_executor().submit(_run_update)
+    _pending.add_done_callback(_on_done)
+
+
+def _on_done(future):
+    global _again
+    error = future.exception()
+    if error is not None:
+        logger.error("❌ モデルの差分学習に失敗しました: %s", error)
+    with _lock:
+        if _again:
+            _again = False
+            _submit()
+
+
+def notify_completion():
+    """タスクが完了したら呼ぶ。学習プロセスが空いていれば差分学習を 1 回走らせる。"""
+    global _again
+    if not INCREMENTAL_TRAINING_ENABLED:
+        return
+    with _lock:
+        if _pending is not None and not _pending.done():
+            _again = True
+            return
+        _submit()
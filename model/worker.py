@@ -0,0 +1,96 @@
+"""
+バックグラウンドの予測ワーカー。
+
+タスクを追加したリクエストは ID をキューに入れるだけで返り、
+ワーカースレッドがキューから ID をマイクロバッチでまとめて取り出して予測・保存する。
+ページ表示の速さが未予測タスクの件数に左右されないようにするためのもの。
+"""
+import logging
+import os
+import queue
+import threading
+
+from model.predict import batch_predict_missing_tasks, predict_tasks
+
+logger = logging.getLogger(__name__)
+
+# 1 回にまとめて予測する最大件数
+PREDICTION_BATCH_SIZE = int(os.environ.get("PREDICTION_BATCH_SIZE", 256))
+
+# 最初の ID が来てから、後続の ID を待ってまとめる最大秒数
+PREDICTION_MAX_WAIT = float(os.environ.get("PREDICTION_MAX_WAIT", 0.05))
+
+# 0 にするとワーカーを起動せず、enqueue() がその場で予測する（スクリプトやベンチマーク用）
+PREDICTION_WORKER_ENABLED = os.environ.get("PREDICTION_WORKER", "1") != "0"
+
+# キューに入れる「未予測タスクを全部予測する」合図
+_SWEEP = object()
+
+
+class PredictionWorker:
+    def __init__(self, on_scored=None, batch_size=PREDICTION_BATCH_SIZE, max_wait=PREDICTION_MAX_WAIT):
+        # on_scored(task_ids): 予測を保存したあとに呼ばれる（日程の作り直しなど）
+        self.on_scored = on_scored
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._thread = threading.Thread(target=self._run, name="prediction-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    def enqueue(self, task_ids):
+        """予測するタスク ID をキューに入れる。ワーカーが動いていなければその場で予測する。"""
+        if not self.running:
+            self._score(list(task_ids))
+            return
+        for task_id in task_ids:
+            self._queue.put(int(task_id))
+
+    def enqueue_sweep(self):
+        """DB 内の未予測タスクをまとめて予測する（起動時用）。"""
+        if not self.running:
+            self._sweep()
+            return
+        self._queue.put(_SWEEP)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.max_wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                if any(item is _SWEEP for item in batch):
+                    # 同じバッチの ID も掃除で一緒に予測される
+                    self._sweep()
+                else:
+                    self._score(batch)
+            except Exception:
+                logger.exception("❌ 予測ワーカーでエラーが発生しました")
+
+    def _score(self, task_ids):
+        if not task_ids:
+            return
+        scored = predict_tasks(task_ids)
+        if scored and self.on_scored:
+            self.on_scored(scored)
+
+    def _sweep(self):
+        if batch_predict_missing_tasks() and self.on_scored:
+            # どのタスクが予測されたかは分からないので、None で「全体」を知らせる
+            self.on_scored(None)
@@ -0,0 +1,546 @@
+"""
+数日先までのやることリスト（plan テーブル）を作る。
+
+plan には「どの日にどのタスクをやるか」を PLAN_HORIZON_DAYS 日分まとめて持つ（テーブルは migrations.py で作る）。
+日付が変わった最初のアクセスで一度だけ全日程を 1 パスで作り直し、
+それ以外はタスク追加や設定変更で影響を受ける日だけを作り直す。
+今日の分は TodayPlan（残り時間と締切順のヒープ）で差分だけを更新する（下の「今日の日程の差分更新」）。
+日程・状態はすべて利用者（user_id）ごとに持ち、ほかの利用者のタスクや設定は読まない。
+"""
+import heapq
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+import scheduler
+import temporal
+
+# 何日先までのプランを持つか
+PLAN_HORIZON_DAYS = int(os.environ.get("PLAN_HORIZON_DAYS", 7))
+
+# 今日の差分更新用の状態を覚えておく利用者数（ワーカープロセスごと、古いものから捨てる）
+TODAY_STATE_MAX_USERS = int(os.environ.get("TODAY_STATE_MAX_USERS", 10000))
+
+# 空き時間を埋めるとき、入らない候補を何件まで飛ばして次を見るか
+FILL_SCAN_LIMIT = 16
+
+# plan_log に残す revision の数（これより遅れたワーカーは DB から読み直す）
+PLAN_LOG_KEEP = int(os.environ.get("PLAN_LOG_KEEP", 256))
+
+
+def load_capacities(conn, user_id):
+    """曜日ごとにタスクへ割り当てられる時間（分）を返す。"""
+    rows = conn.execute(text("""
+        SELECT weekday, available_hours FROM available_time WHERE user_id = :user_id
+    """), {"user_id": user_id}).fetchall()
+    capacities = {wd: 0 for wd in range(7)}
+    for row in rows:
+        capacities[row.weekday] = int((row.available_hours or 0) * 60 * scheduler.CAPACITY_RATIO)
+    return capacities
+
+
+def build_plan(conn, user_id, today, start=None, days=None):
+    """
+    start 以降の日程を作り直す（start より前の日程はそのまま残す）。
+    候補は一度だけ読み込み、日ごとに scheduler で選んだタスクを候補から外しながら 1 パスで埋める。
+    """
+    start = start or today
+    days = PLAN_HORIZON_DAYS - (start - today).days if days is None else days
+    today_str = today.isoformat()
+
+    conn.execute(text("DELETE FROM plan WHERE user_id = :user_id AND plan_date >= :start"),
+                 {"user_id": user_id, "start": start.isoformat()})
+    if start <= today:
+        _bump_revision(conn, user_id)
+    if days <= 0:
+        return 0
+
+    ids, minutes, days_left = scheduler.load_candidates(conn, today_str, user_id)
+
+    # start より前の日に既に割り当て済みのタスクは候補から外す
+    planned = conn.execute(text("""
+        SELECT task_id FROM plan WHERE user_id = :user_id AND plan_date >= :today AND plan_date < :start
+    """), {"user_id": user_id, "today": today_str, "start": start.isoformat()}).scalars().all()
+    available = ~np.isin(ids, np.array(planned, dtype=np.int64))
+
+    capacities = load_capacities(conn, user_id)
+    rows = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        pool = np.flatnonzero(available)
+        if pool.size == 0:
+            break
+
+        # 締切までの日数はその日から数える
+        shift = (day - today).days
+        chosen = pool[scheduler.select_tasks(
+            minutes[pool], days_left[pool] - shift, capacities[day.weekday()]
+        )]
+        available[chosen] = False
+        day_str = day.isoformat()
+        rows.extend(
+            {"user_id": user_id, "plan_date": day_str, "task_id": int(ids[i]), "minutes": float(minutes[i])}
+            for i in chosen
+        )
+
+    if rows:
+        conn.execute(text("""
+            INSERT INTO plan (user_id, plan_date, task_id, minutes)
+            VALUES (:user_id, :plan_date, :task_id, :minutes)
+        """), rows)
+    return len(rows)
+
+
+def rebuild_plan(conn, user_id, today=None):
+    """全日程を作り直す（日付が変わったとき・使える時間を変えたとき）。"""
+    today = today or date.today()
+    conn.execute(text("DELETE FROM plan WHERE user_id = :user_id AND plan_date < :today"),
+                 {"user_id": user_id, "today": today.isoformat()})
+    count = build_plan(conn, user_id, today)
+    conn.execute(text("""
+        INSERT INTO plan_state (user_id, built_on, horizon_days) VALUES (:user_id, :today, :days)
+        ON CONFLICT(user_id) DO UPDATE SET
+            built_on = excluded.built_on,
+            horizon_days = excluded.horizon_days,
+            revision = plan_state.revision + 1
+    """), {"user_id": user_id, "today": today.isoformat(), "days": PLAN_HORIZON_DAYS})
+    return count
+
+
+def ensure_plan(conn, user_id, today=None):
+    """今日の日程がまだ作られていなければ作る。作り直した場合は True を返す。"""
+    today = today or date.today()
+    state = conn.execute(text("""
+        SELECT built_on, horizon_days FROM plan_state WHERE user_id = :user_id
+    """), {"user_id": user_id}).fetchone()
+    if state and state.built_on == today.isoformat() and state.horizon_days == PLAN_HORIZON_DAYS:
+        return False
+    rebuild_plan(conn, user_id, today)
+    return True
+
+
+def expire_all_plans(conn):
+    """全利用者の日程を古いことにする（それぞれ次のアクセスの ensure_plan() で作り直される）。"""
+    # 行は消さずに残す（revision を 0 に戻すと、手元の TodayPlan と食い違っても気づけなくなる）
+    conn.execute(text("UPDATE plan_state SET horizon_days = 0"))
+
+
+def replan_for_tasks(conn, user_id, task_ids, today=None):
+    """
+    利用者 user_id のタスクを追加したとき（予測時間が入ったとき）の日程の更新。作り直した最初の日を返す。
+    今日の分は 1 回の apply_today で 1 件ずつ TodayPlan に差分で入れ、
+    今日に入らなかったタスクがあれば、明日以降の影響を受ける最初の日から作り直す。
+    締切順で詰めているので、そのタスクより締切の遅いタスクが入っている日か、
+    そのタスクが入る空きがある日より前の日程は変わらない。
+    """
+    today = today or date.today()
+    tasks = conn.execute(text("""
+        SELECT id, predicted_time, due_day AS due, due_day - :today_day AS days_left
+        FROM task
+        WHERE user_id = :user_id AND id IN (SELECT value FROM json_each(:ids)) AND predicted_time IS NOT NULL
+        ORDER BY id
+    """), {"user_id": user_id, "ids": json.dumps([int(i) for i in task_ids]),
+           "today_day": temporal.day_number(today)}).fetchall()
+    if not tasks:
+        return None
+
+    def insert_all(plan):
+        for task in tasks:
+            plan.insert(task.id, _due_key(task.days_left), float(task.predicted_time))
+        # 後から入れたタスクに押し出されたものもあるので、全部入れてから今日に入ったかを見る
+        return [task.id in plan.planned for task in tasks]
+
+    placed, evicted = apply_today(conn, user_id, insert_all, today)
+    if evicted:
+        # 今日から押し出されたタスクは明日以降に入れ直す
+        build_plan(conn, user_id, today, start=today + timedelta(days=1))
+        return today
+    rest = [task for task, ok in zip(tasks, placed) if not ok]
+    first = today if len(rest) < len(tasks) else None
+    if not rest:
+        return first
+
+    days = conn.execute(text("""
+        SELECT p.plan_date, SUM(p.minutes) AS used,
+               MAX(COALESCE(t.due_day, :unknown_due)) AS latest_due
+        FROM plan p JOIN task t ON t.id = p.task_id
+        WHERE p.user_id = :user_id AND p.plan_date > :today
+        GROUP BY p.plan_date
+    """), {"user_id": user_id, "today": today.isoformat(), "unknown_due": temporal.DUE_DAY_UNKNOWN}).fetchall()
+    by_day = {row.plan_date: row for row in days}
+
+    capacities = load_capacities(conn, user_id)
+    for offset in range(1, PLAN_HORIZON_DAYS):
+        day = today + timedelta(days=offset)
+        row = by_day.get(day.isoformat())
+        used = row.used if row else 0.0
+        spare = capacities[day.weekday()] - used
+        for task in rest:
+            displaces = row is not None and task.due is not None and task.due <= row.latest_due
+            if task.predicted_time <= spare or displaces:
+                build_plan(conn, user_id, today, start=day)
+                return first or day
+    return first
+
+
+def replan_for_weekdays(conn, user_id, weekdays, today=None):
+    """
+    曜日ごとの使える時間を変えたときに、変わった曜日の最初の日以降だけを作り直す。作り直した最初の日を返す。
+    今日の曜日が変わったときは、今日の分は TodayPlan で空き時間の増減だけを反映する。
+    """
+    today = today or date.today()
+    if ensure_plan(conn, user_id, today):
+        return today
+    first = None
+    if today.weekday() in weekdays:
+        capacity = load_capacities(conn, user_id)[today.weekday()]
+        _, evicted = apply_today(conn, user_id, lambda plan: plan.set_capacity(capacity), today)
+        first = today
+        if evicted:
+            build_plan(conn, user_id, today, start=today + timedelta(days=1))
+            return first
+    for offset in range(1, PLAN_HORIZON_DAYS):
+        day = today + timedelta(days=offset)
+        if day.weekday() in weekdays:
+            build_plan(conn, user_id, today, start=day)
+            return first or day
+    return first
+
+
+def remove_from_plan(conn, user_id, task_id, today=None):
+    """タスクを完了・削除したとき、今日の日程から外して空いた時間を次の候補で埋める。"""
+    apply_today(conn, user_id, lambda plan: plan.remove(task_id), today)
+
+
+def resize_in_plan(conn, user_id, task_id, minutes, today=None):
+    """途中まで進めて残り時間（分）が変わったとき、今日の日程の使用時間を直す。"""
+    apply_today(conn, user_id, lambda plan: plan.resize(task_id, minutes), today)
+
+
+# ---- 今日の日程の差分更新 ----
+# 利用者ごとに「今日の残り時間」「今日に入れたタスク」「締切順の候補ヒープ」をメモリに持ち、
+# 追加・完了・途中終了・削除・使える時間の変更を 1 件ずつ O(log n) で反映して、変わった plan の行だけを書く。
+# 詰め方は scheduler の edf と同じ締切順の first-fit（日付が変わったときの作り直しは scheduler の戦略に従う）。
+# plan_state.revision は今日の日程を書き換えるたびに進め、そのとき状態が変わりうるタスクを plan_log に残す。
+# ほかのワーカーが書き換えていたら、plan_log に残ったタスクだけを DB から読み直して手元の状態に反映する
+# （gunicorn の複数ワーカーでも差分のまま更新できる）。plan_log に無い書き換え（build_plan での作り直しなど）が
+# 挟まっていたときや、PLAN_LOG_KEEP より遅れていたときだけ、今日の日程をまるごと読み直す。
+# 手元の状態は利用者ごとのロックで守るので、ほかの利用者の更新は待たない。
+
+def _due_key(days_left):
+    return math.inf if days_left is None or math.isnan(days_left) else float(days_left)
+
+
+class TodayPlan:
+    """利用者 1 人分の今日の日程。ヒープは遅延削除（辞書の値と一致しないエントリは捨てる）。"""
+
+    def __init__(self, day, capacity, planned, candidates, revision):
+        self.day = day
+        self.capacity = float(capacity)
+        self.revision = revision
+        self.planned = dict(planned)          # task_id -> (締切までの日数, 分)
+        self.candidates = dict(candidates)    # task_id -> (締切までの日数, 分)
+        self.used = sum(minutes for _, minutes in self.planned.values())
+        # 候補は締切が早い順、今日の分は締切が遅い順（押し出す順）に取り出す
+        self._candidate_heap = [(due, minutes, task_id) for task_id, (due, minutes) in self.candidates.items()]
+        self._planned_heap = [(-due, -minutes, task_id) for task_id, (due, minutes) in self.planned.items()]
+        heapq.heapify(self._candidate_heap)
+        heapq.heapify(self._planned_heap)
+        self.added, self.evicted, self.removed, self.resized = set(), set(), set(), set()
+        self.touched = set()   # insert / remove / resize したタスク（候補のまま変わらなかったものも含む）
+
+    @property
+    def free(self):
+        return self.capacity - self.used
+
+    def _push_candidate(self, task_id, due, minutes):
+        self.candidates[task_id] = (due, minutes)
+        heapq.heappush(self._candidate_heap, (due, minutes, task_id))
+
+    def _plan(self, task_id, due, minutes):
+        self.candidates.pop(task_id, None)
+        self.planned[task_id] = (due, minutes)
+        self.used += minutes
+        heapq.heappush(self._planned_heap, (-due, -minutes, task_id))
+        self.added.add(task_id)
+        self.evicted.discard(task_id)
+
+    def _latest_planned(self):
+        while self._planned_heap:
+            due, minutes, task_id = self._planned_heap[0]
+            if self.planned.get(task_id) == (-due, -minutes):
+                return task_id, -due, -minutes
+            heapq.heappop(self._planned_heap)
+        return None
+
+    def _evict_latest(self):
+        task_id, due, minutes = self._latest_planned()
+        heapq.heappop(self._planned_heap)
+        del self.planned[task_id]
+        self.used -= minutes
+        self._push_candidate(task_id, due, minutes)
+        if task_id in self.added:
+            self.added.discard(task_id)
+        else:
+            self.evicted.add(task_id)
+
+    def _fill(self):
+        """締切順に、空き時間に入る候補を入れる（入らない候補は FILL_SCAN_LIMIT 件まで飛ばす）。"""
+        skipped = []
+        while self._candidate_heap and self.free > 0 and len(skipped) < FILL_SCAN_LIMIT:
+            due, minutes, task_id = self._candidate_heap[0]
+            if self.candidates.get(task_id) != (due, minutes):
+                heapq.heappop(self._candidate_heap)
+            elif minutes <= self.free:
+                heapq.heappop(self._candidate_heap)
+                self._plan(task_id, due, minutes)
+            else:
+                skipped.append(heapq.heappop(self._candidate_heap))
+        for entry in skipped:
+            heapq.heappush(self._candidate_heap, entry)
+
+    def _shrink_to_capacity(self):
+        while self.used > self.capacity + 1e-9 and self.planned:
+            self._evict_latest()
+
+    def insert(self, task_id, due, minutes):
+        """
+        候補に加える。空きが足りなくても、締切の遅いタスクを押し出せば入るなら押し出して入れる。
+        今日に入ったら True を返す。
+        """
+        self.touched.add(task_id)
+        if task_id in self.planned:
+            return True
+        self._push_candidate(task_id, due, minutes)
+        if minutes <= self.capacity and minutes > self.free:
+            later = sum(m for d, m in self.planned.values() if d > due)
+            if minutes <= self.free + later:
+                while minutes > self.free:
+                    self._evict_latest()
+                self._plan(task_id, due, minutes)
+        self._fill()
+        return task_id in self.planned
+
+    def remove(self, task_id):
+        self.touched.add(task_id)
+        self.removed.add(task_id)
+        self.candidates.pop(task_id, None)
+        entry = self.planned.pop(task_id, None)
+        if entry is not None:
+            self.used -= entry[1]
+            self.added.discard(task_id)
+            self._fill()
+
+    def resize(self, task_id, minutes):
+        self.touched.add(task_id)
+        if task_id in self.planned:
+            due, old = self.planned[task_id]
+            self.planned[task_id] = (due, minutes)
+            self.used += minutes - old
+            heapq.heappush(self._planned_heap, (-due, -minutes, task_id))
+            self.resized.add(task_id)
+            self._shrink_to_capacity()
+        elif task_id in self.candidates:
+            self._push_candidate(task_id, self.candidates[task_id][0], minutes)
+        self._fill()
+
+    def set_capacity(self, capacity):
+        self.capacity = float(capacity)
+        self._shrink_to_capacity()
+        self._fill()
+
+    def sync(self, capacity, tasks):
+        """
+        ほかのワーカーが書き換えた分を DB の値に合わせる（保存済みの変更なので added などには入れない）。
+        tasks は {task_id: (今日に入っているか, 締切までの日数, 分)}。今日にも候補にも入らないタスクは None。
+        """
+        self.capacity = float(capacity)
+        for task_id, state in tasks.items():
+            entry = self.planned.pop(task_id, None)
+            if entry is not None:
+                self.used -= entry[1]
+            self.candidates.pop(task_id, None)
+            if state is None:
+                continue
+            planned, due, minutes = state
+            if planned:
+                self.planned[task_id] = (due, minutes)
+                self.used += minutes
+                heapq.heappush(self._planned_heap, (-due, -minutes, task_id))
+            else:
+                self._push_candidate(task_id, due, minutes)
+
+    def take_changes(self):
+        """前回からの変更 (今日に入れた, 今日から外した, 消した, 時間が変わった, 触ったタスク) を返して空にする。"""
+        changes = (self.added, self.evicted, self.removed, self.resized - self.added, self.touched)
+        self.added, self.evicted, self.removed, self.resized = set(), set(), set(), set()
+        self.touched = set()
+        return changes
+
+
+_today_plans = OrderedDict()   # user_id -> TodayPlan
+_user_locks = {}               # user_id -> その利用者の TodayPlan を触る間持つロック
+_today_lock = threading.Lock()  # 上の 2 つの辞書を読み書きする間だけ持つ
+
+
+def _user_lock(user_id):
+    with _today_lock:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.Lock()
+        return lock
+
+
+def _remember(user_id, plan):
+    with _today_lock:
+        _today_plans[user_id] = plan
+        _today_plans.move_to_end(user_id)
+        while len(_today_plans) > TODAY_STATE_MAX_USERS:
+            old_user, _ = _today_plans.popitem(last=False)
+            lock = _user_locks.get(old_user)
+            if lock is not None and not lock.locked():
+                del _user_locks[old_user]
+
+
+def _bump_revision(conn, user_id):
+    """今日の日程を書き換えたことを記録し、新しい revision を返す（日程がまだ無ければ None）。"""
+    return conn.execute(text("""
+        UPDATE plan_state SET revision = revision + 1 WHERE user_id = :user_id RETURNING revision
+    """), {"user_id": user_id}).scalar()
+
+
+def load_today_plan(conn, user_id, today, revision):
+    """DB から今日の日程と候補を読み込んで TodayPlan を作る（完了・削除済みで残っている行はここで消す）。"""
+    today_str = today.isoformat()
+    rows = conn.execute(text("""
+        SELECT p.task_id, t.predicted_time, t.is_completed, t.is_deleted,
+               t.due_day - :today_day AS days_left
+        FROM plan p JOIN task t ON t.id = p.task_id
+        WHERE p.user_id = :user_id AND p.plan_date = :today
+    """), {"user_id": user_id, "today": today_str, "today_day": temporal.day_number(today)}).fetchall()
+    planned, stale = {}, []
+    for row in rows:
+        if row.is_completed or row.is_deleted or row.predicted_time is None:
+            stale.append(row.task_id)
+        else:
+            planned[row.task_id] = (_due_key(row.days_left), float(row.predicted_time))
+    if stale:
+        conn.execute(text("""
+            DELETE FROM plan WHERE user_id = :user_id AND plan_date = :today
+              AND task_id IN (SELECT value FROM json_each(:ids))
+        """), {"user_id": user_id, "today": today_str, "ids": json.dumps(stale)})
+
+    ids, minutes, days_left = scheduler.load_candidates(conn, today_str, user_id)
+    candidates = {
+        int(task_id): (_due_key(left), float(m))
+        for task_id, m, left in zip(ids.tolist(), minutes.tolist(), days_left.tolist())
+        if task_id not in planned
+    }
+    capacity = load_capacities(conn, user_id)[today.weekday()]
+    return TodayPlan(today, capacity, planned, candidates, revision)
+
+
+def _persist(conn, user_id, plan):
+    """TodayPlan の変更分だけを plan テーブルに書き、変わりうるタスクを plan_log に残す。"""
+    added, evicted, removed, resized, touched = plan.take_changes()
+    moved = added | evicted | removed
+    today_str = plan.day.isoformat()
+    if moved:
+        # 今日に入れたタスクは明日以降の行を、外した・消したタスクは今日以降の行を消す
+        conn.execute(text("""
+            DELETE FROM plan WHERE user_id = :user_id AND plan_date >= :today
+              AND task_id IN (SELECT value FROM json_each(:ids))
+        """), {"user_id": user_id, "today": today_str, "ids": json.dumps(sorted(moved))})
+    if added:
+        conn.execute(text("""
+            INSERT INTO plan (user_id, plan_date, task_id, minutes) VALUES (:user_id, :today, :task_id, :minutes)
+        """), [{"user_id": user_id, "today": today_str, "task_id": task_id, "minutes": plan.planned[task_id][1]}
+               for task_id in sorted(added)])
+    if resized:
+        conn.execute(text("""
+            UPDATE plan SET minutes = :minutes WHERE user_id = :user_id AND plan_date = :today AND task_id = :task_id
+        """), [{"user_id": user_id, "today": today_str, "task_id": task_id, "minutes": plan.planned[task_id][1]}
+               for task_id in sorted(resized)])
+    _log_changes(conn, user_id, plan.revision, moved | resized | touched)
+    return added, evicted
+
+
+def _log_changes(conn, user_id, revision, task_ids):
+    """revision で変わりうるタスクを plan_log に書く（task_id 0 の行は、タスクが無くても revision を残すため）。"""
+    conn.execute(text("""
+        INSERT OR IGNORE INTO plan_log (user_id, revision, task_id) VALUES (:user_id, :revision, :task_id)
+    """), [{"user_id": user_id, "revision": revision, "task_id": task_id} for task_id in [0, *sorted(task_ids)]])
+    conn.execute(text("""
+        DELETE FROM plan_log WHERE user_id = :user_id AND revision <= :oldest
+    """), {"user_id": user_id, "oldest": revision - PLAN_LOG_KEEP})
+
+
+def _catch_up(conn, user_id, plan, latest):
+    """
+    手元の plan（revision まで反映済み）に、ほかのワーカーが latest までに書き換えた分を反映する。
+    plan_log だけで追いつけないとき（作り直しが挟まった・ログが消えた）は False を返す。
+    """
+    if plan.revision == latest:
+        return True
+    rows = conn.execute(text("""
+        SELECT revision, task_id FROM plan_log
+        WHERE user_id = :user_id AND revision > :since AND revision <= :latest
+    """), {"user_id": user_id, "since": plan.revision, "latest": latest}).fetchall()
+    if len({row.revision for row in rows}) != latest - plan.revision:
+        return False
+
+    ids = sorted({row.task_id for row in rows} - {0})
+    tasks = dict.fromkeys(ids)
+    for row in conn.execute(text("""
+        SELECT t.id, t.predicted_time, t.time_spent, t.is_completed, t.is_deleted,
+               t.due_day - :today_day AS days_left,
+               EXISTS (
+                   SELECT 1 FROM plan p WHERE p.user_id = :user_id AND p.plan_date = :today AND p.task_id = t.id
+               ) AS planned
+        FROM task t
+        WHERE t.user_id = :user_id AND t.id IN (SELECT value FROM json_each(:ids))
+    """), {"user_id": user_id, "today": plan.day.isoformat(), "today_day": temporal.day_number(plan.day),
+           "ids": json.dumps(ids)}):
+        # load_today_plan() の今日の分と scheduler.load_candidates() の候補と同じ条件
+        if row.predicted_time is None or row.is_deleted:
+            continue
+        if row.planned and not row.is_completed:
+            tasks[row.id] = (True, _due_key(row.days_left), float(row.predicted_time))
+        elif not row.planned and row.time_spent is None:
+            tasks[row.id] = (False, _due_key(row.days_left), float(row.predicted_time))
+    plan.sync(load_capacities(conn, user_id)[plan.day.weekday()], tasks)
+    plan.revision = latest
+    return True
+
+
+def apply_today(conn, user_id, change, today=None):
+    """
+    今日の日程に change(TodayPlan) を適用し、変わった行だけを保存する。
+    (change の戻り値, 今日から押し出されたタスク ID の集合) を返す。
+    """
+    today = today or date.today()
+    ensure_plan(conn, user_id, today)
+    revision = _bump_revision(conn, user_id)
+
+    with _user_lock(user_id):
+        plan = _today_plans.get(user_id)
+        if plan is None or plan.day != today or not _catch_up(conn, user_id, plan, revision - 1):
+            plan = load_today_plan(conn, user_id, today, revision)
+        plan.revision = revision
+        _remember(user_id, plan)
+
+        try:
+            result = change(plan)
+            _, evicted = _persist(conn, user_id, plan)
+        except Exception:
+            # 途中で失敗したら手元の状態は信用しない（次は DB から読み直す）
+            with _today_lock:
+                _today_plans.pop(user_id, None)
+            raise
+    return result, evicted
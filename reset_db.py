@@ -1,12 +1,9 @@
 # reset_db.py
-from sqlalchemy import create_engine, text
-import os
+from sqlalchemy import text
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
+from db import get_engine
 
-engine = create_engine(DATABASE_URI, echo=True)
+engine = get_engine()
 
 def reset_data():
     with engine.begin() as conn:
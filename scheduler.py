@@ -0,0 +1,207 @@
+"""
+今日やることリストのスケジューラ。
+
+候補タスク（未完了・予測時間あり）から、その日に使える時間に収まるタスクを選ぶ。
+選び方は STRATEGIES に登録された関数で差し替えられる（環境変数 SCHEDULER_STRATEGY）。
+
+predicted_time / time_spent はどちらも「分」単位で扱う。
+"""
+import os
+
+import numpy as np
+from sqlalchemy import text
+
+import temporal
+
+# 今日使える時間のうち、タスクに割り当てる割合
+CAPACITY_RATIO = 0.85
+
+# ナップサックで厳密に詰める上位候補の数（それ以降は締切順に first-fit で詰める）
+KNAPSACK_TOP_K = 64
+
+# 締切の近さをどれだけ重視するか（大きいほど締切が近いタスクを優先する）
+URGENCY_WEIGHT = 4.0
+
+STRATEGIES = {}
+
+
+def register(name):
+    """スケジューリング戦略を登録するデコレータ。"""
+    def decorator(func):
+        STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+# 締切順に並べるとき、一度にソートする候補数。全件をソートせず、先頭から必要な分だけ並べる
+EDF_WINDOW = 2048
+
+
+def edf_key(minutes, days_left):
+    """締切が近い順、同じ締切なら所要時間が短い順になるソートキー。"""
+    if minutes.size == 0:
+        return minutes
+    return days_left * (minutes.max() + 1.0) + minutes
+
+
+def _split_head(candidates, key, k):
+    """candidates のうちキーが小さい k 件（同順位は含める）をソート済みで、残りを未ソートのまま返す。"""
+    keys = key[candidates]
+    if candidates.size > k:
+        kth = np.partition(keys, k - 1)[k - 1]
+        in_head = keys <= kth
+        head, rest = candidates[in_head], candidates[~in_head]
+        keys = keys[in_head]
+    else:
+        head, rest = candidates, candidates[:0]
+    return head[np.argsort(keys, kind="stable")], rest
+
+
+def _first_fit(candidates, key, minutes, capacity):
+    """
+    締切順に、残り容量に入るタスクをすべて選ぶ（入らないタスクは飛ばして次を見る）。
+    1ラウンドごとに「先頭から入るだけ」を累積和でまとめて取るので、ループ回数はごく少ない。
+    """
+    chosen = []
+    remaining = float(capacity)
+    rest = candidates
+    while rest.size and remaining > 0:
+        pool, rest = _split_head(rest, key, EDF_WINDOW)
+        while pool.size and remaining > 0:
+            csum = np.cumsum(minutes[pool])
+            n = int(np.searchsorted(csum, remaining, side="right"))
+            chosen.append(pool[:n])
+            remaining -= float(csum[n - 1])
+            pool = pool[n:]
+            pool = pool[minutes[pool] <= remaining]
+        rest = rest[minutes[rest] <= remaining]
+
+    if not chosen:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(chosen)
+
+
+def _knapsack(items, minutes, values, capacity):
+    """
+    items の中から、重さ minutes・価値 values（items と同じ並び）の 0/1 ナップサックを解く。
+    容量方向にベクトル化した DP なので、計算量は O(len(items) * capacity) の numpy 演算になる。
+    """
+    cap = int(capacity)
+    if cap <= 0 or items.size == 0:
+        return np.empty(0, dtype=np.intp)
+
+    weights = np.ceil(minutes[items]).astype(np.intp)
+    dp = np.zeros(cap + 1)
+    keep = np.zeros((items.size, cap + 1), dtype=bool)
+
+    for k, (w, v) in enumerate(zip(weights, values)):
+        if w > cap:
+            continue
+        candidate = dp[:cap + 1 - w] + v
+        better = candidate > dp[w:]
+        dp[w:] = np.where(better, candidate, dp[w:])
+        keep[k, w:] = better
+
+    # 復元
+    chosen = []
+    c = cap
+    for k in range(items.size - 1, -1, -1):
+        if keep[k, c]:
+            chosen.append(items[k])
+            c -= weights[k]
+    return np.array(chosen[::-1], dtype=np.intp)
+
+
+@register("greedy")
+def greedy(minutes, days_left, capacity):
+    """旧実装と同じ挙動：締切順に詰めて、入らないタスクが出た時点で打ち切る。"""
+    key = edf_key(minutes, days_left)
+    chosen = []
+    remaining = float(capacity)
+    rest = np.arange(minutes.size)
+    while rest.size:
+        head, rest = _split_head(rest, key, EDF_WINDOW)
+        csum = np.cumsum(minutes[head])
+        n = int(np.searchsorted(csum, remaining, side="right"))
+        chosen.append(head[:n])
+        if n < head.size:
+            break
+        remaining -= float(csum[-1])
+
+    if not chosen:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(chosen)
+
+
+@register("edf")
+def edf(minutes, days_left, capacity):
+    """締切順に first-fit で詰める。入らないタスクは飛ばすので容量を使い切れる。"""
+    key = edf_key(minutes, days_left)
+    return _first_fit(np.flatnonzero(minutes <= capacity), key, minutes, capacity)
+
+
+@register("knapsack")
+def knapsack(minutes, days_left, capacity):
+    """
+    締切順の上位 KNAPSACK_TOP_K 件を「所要時間 × 緊急度」が最大になるよう 0/1 ナップサックで選び、
+    余った時間を残りの候補から締切順の first-fit で埋める。
+    """
+    candidates = np.flatnonzero(minutes <= capacity)
+    if candidates.size == 0:
+        return candidates
+
+    key = edf_key(minutes, days_left)
+    top, _ = _split_head(candidates, key, KNAPSACK_TOP_K)
+
+    urgency = 1.0 + URGENCY_WEIGHT / (1.0 + np.clip(days_left[top], 0, None))
+    chosen = _knapsack(top, minutes, minutes[top] * urgency, capacity)
+    remaining = capacity - float(minutes[chosen].sum())
+
+    # 残り時間に入る候補だけを対象に、締切順で埋める
+    fits = minutes <= remaining
+    fits[top] = False
+    rest = np.flatnonzero(fits)
+    return np.concatenate([chosen, _first_fit(rest, key, minutes, remaining)])
+
+
+DEFAULT_STRATEGY = os.environ.get("SCHEDULER_STRATEGY", "knapsack")
+
+
+def select_tasks(minutes, days_left, capacity, strategy=None):
+    """
+    候補の所要時間（分）と締切までの日数から、capacity（分）に収まるタスクのインデックスを返す。
+    """
+    minutes = np.maximum(np.asarray(minutes, dtype=float), 0)
+    days_left = np.asarray(days_left, dtype=float)
+    # 日付が読めないタスクは一番後回し
+    unknown = np.isnan(days_left)
+    if unknown.any():
+        days_left = np.where(unknown, np.inf, days_left)
+
+    func = STRATEGIES[strategy or DEFAULT_STRATEGY]
+    return func(minutes, days_left, capacity)
+
+
+def load_candidates(conn, today_str, user_id):
+    """
+    利用者 user_id の未完了で予測時間のあるタスクを (id, 所要時間, 締切までの日数) の配列として読み込む。
+    締切日が読めないタスク（due_day が NULL）も候補に含め、日数を NaN にする（select_tasks で一番後回しになる）。
+    """
+    rows = conn.execute(text("""
+        SELECT id, predicted_time,
+               due_day - :today_day AS days_left
+        FROM task
+        WHERE user_id = :user_id
+          AND time_spent IS NULL AND predicted_time IS NOT NULL AND is_deleted = 0
+    """), {"today_day": temporal.day_number(today_str), "user_id": user_id}).fetchall()
+
+    if not rows:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty
+
+    ids, minutes, days_left = zip(*rows)
+    return (
+        np.array(ids, dtype=np.int64),
+        np.array(minutes, dtype=float),
+        np.array([np.nan if d is None else d for d in days_left], dtype=float),
+    )
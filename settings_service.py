@@ -0,0 +1,78 @@
+"""
+使える時間（available_time）と時間割（timetable）の保存。
+
+settings / setup / edit_timetable の各画面から呼ぶ。読み書きはすべて利用者（user_id）ごと。
+今の内容との差分だけを 1 トランザクションで書き込む（変更・追加は executemany の upsert 1 回、消えたコマは DELETE 1 回）。
+使える時間が変わった曜日があれば、その曜日以降の日程だけを作り直す。
+"""
+from sqlalchemy import text
+
+import planner
+
+
+def load_available_hours(conn, user_id):
+    """{曜日: 使える時間} を返す。"""
+    rows = conn.execute(text("""
+        SELECT weekday, available_hours FROM available_time WHERE user_id = :user_id
+    """), {"user_id": user_id}).fetchall()
+    return {row.weekday: row.available_hours for row in rows}
+
+
+def load_timetable(conn, user_id):
+    """{(曜日, 時限): 科目} を返す。"""
+    rows = conn.execute(text("""
+        SELECT weekday, period, subject FROM timetable WHERE user_id = :user_id
+    """), {"user_id": user_id}).fetchall()
+    return {(row.weekday, row.period): row.subject for row in rows}
+
+
+def save_settings(conn, user_id, available_hours=None, timetable=None):
+    """
+    available_hours（{曜日: 時間}）と timetable（{(曜日, 時限): 科目}、空欄は含めない）を保存する。
+    None を渡した方は変更しない。timetable に無いコマは削除する（画面の表が時間割の全体）。
+    変更した (使える時間の曜日数, 時間割のコマ数) を返す。
+    """
+    changed_weekdays = set()
+    if available_hours is not None:
+        current = load_available_hours(conn, user_id)
+        rows = [
+            {"user_id": user_id, "weekday": weekday, "available_hours": hours}
+            for weekday, hours in available_hours.items()
+            if current.get(weekday) != hours
+        ]
+        if rows:
+            conn.execute(text("""
+                INSERT INTO available_time (user_id, weekday, available_hours)
+                VALUES (:user_id, :weekday, :available_hours)
+                ON CONFLICT (user_id, weekday) DO UPDATE SET available_hours = excluded.available_hours
+            """), rows)
+            changed_weekdays = {row["weekday"] for row in rows}
+
+    timetable_changes = 0
+    if timetable is not None:
+        current = load_timetable(conn, user_id)
+        upserts = [
+            {"user_id": user_id, "weekday": weekday, "period": period, "subject": subject}
+            for (weekday, period), subject in timetable.items()
+            if current.get((weekday, period)) != subject
+        ]
+        deletes = [
+            {"user_id": user_id, "weekday": weekday, "period": period}
+            for weekday, period in current
+            if (weekday, period) not in timetable
+        ]
+        if upserts:
+            conn.execute(text("""
+                INSERT INTO timetable (user_id, weekday, period, subject)
+                VALUES (:user_id, :weekday, :period, :subject)
+                ON CONFLICT (user_id, weekday, period) DO UPDATE SET subject = excluded.subject
+            """), upserts)
+        if deletes:
+            conn.execute(text("""
+                DELETE FROM timetable WHERE user_id = :user_id AND weekday = :weekday AND period = :period
+            """), deletes)
+        timetable_changes = len(upserts) + len(deletes)
+
+    if changed_weekdays:
+        planner.replan_for_weekdays(conn, user_id, changed_weekdays)
+    return len(changed_weekdays), timetable_changes
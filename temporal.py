@@ -0,0 +1,76 @@
+"""
+日付・日時の整数表現。
+
+task の due_date / created_at は書いたプログラムによって形式がまちまちな文字列なので、
+比較・計算には整数の列を使う（migrations.add_task_temporal_columns で作り、トリガーで書き込みに合わせる）。
+- due_day: 締切日の 1970-01-01 からの日数
+- created_epoch: 登録日時の 1970-01-01 00:00:00 からの秒数（タイムゾーンの無い値は書かれた時刻のまま）
+SQL 側の式（*_SQL）と Python 側の関数は同じ値を返す。
+"""
+from datetime import date, datetime, timezone
+
+EPOCH_DATE = date(1970, 1, 1)
+EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# 1970-01-01 の曜日（月曜 = 0 で木曜）
+EPOCH_WEEKDAY = 3
+
+# julianday() の 1970-01-01 00:00:00
+_UNIX_JULIAN_DAY = 2440587.5
+
+# 列の値を作る SQL の式（{column} に due_date / created_at などを入れる）。読めない値は NULL
+DUE_DAY_SQL = f"CAST(julianday(date({{column}})) - {_UNIX_JULIAN_DAY} AS INTEGER)"
+EPOCH_SQL = "CAST(strftime('%s', {column}) AS INTEGER)"
+
+# 締切日が読めないタスク（due_day が NULL）の並び順の値。どの due_day よりも大きいので締切順の最後になる
+DUE_DAY_UNKNOWN = 2 ** 31 - 1
+# 締切順に並べる式（{column} に due_day / t.due_day）。索引 idx_task_user_open_due の式と同じにすること
+DUE_ORDER_SQL = f"COALESCE({{column}}, {DUE_DAY_UNKNOWN})"
+
+
+def to_datetime(value):
+    """
+    datetime / date / ISO 形式の文字列を datetime にする。読めなければ None。
+    タイムゾーン付きの値は SQLite の julianday() と同じく UTC の時刻にする。
+    """
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def day_number(value):
+    """日付（または日時の日付部分）の 1970-01-01 からの日数。読めなければ None。"""
+    parsed = to_datetime(value)
+    return None if parsed is None else (parsed.date() - EPOCH_DATE).days
+
+
+def epoch_seconds(value):
+    """日時の 1970-01-01 00:00:00 からの秒数（秒未満は切り捨て）。読めなければ None。"""
+    parsed = to_datetime(value)
+    if parsed is None:
+        return None
+    delta = parsed - EPOCH
+    return delta.days * SECONDS_PER_DAY + delta.seconds
+
+
+def days_until(due_day, created_epoch):
+    """登録日時から締切日の 0 時までの日数（切り捨て。締切日に時刻が付いていても日付として扱う）。"""
+    return due_day - (created_epoch // SECONDS_PER_DAY) - (1 if created_epoch % SECONDS_PER_DAY else 0)
+
+
+def weekday(created_epoch):
+    """登録日時の曜日（月曜 = 0）。"""
+    return (created_epoch // SECONDS_PER_DAY + EPOCH_WEEKDAY) % 7
+
+
+def due_order(due_day):
+    """DUE_ORDER_SQL と同じ並び順の値。"""
+    return DUE_DAY_UNKNOWN if due_day is None else due_day
@@ -0,0 +1,27 @@
+"""
+リクエストがどの利用者（テナント）のものかを決める。
+
+信頼できるところから来た値だけを使い、どれも無い・不正な値なら DEFAULT_USER_ID。
+- ヘッダ X-User-Id: 前段のプロキシや認証の仕組みが付ける（クライアントが送った同じ名前のヘッダはプロキシで消しておくこと）
+- Flask の署名付きセッションの user_id: SECRET_KEY を設定したときだけ（ログイン機能を入れたらここに書く）
+ただのクッキーは誰でも書き換えられるので使わない（user_id=<n> を送るだけで他の利用者になれてしまう）。
+"""
+from flask import g, session
+
+DEFAULT_USER_ID = 1
+USER_ID_HEADER = "X-User-Id"
+SESSION_USER_ID_KEY = "user_id"
+
+
+def resolve_user_id(request):
+    value = request.headers.get(USER_ID_HEADER) or session.get(SESSION_USER_ID_KEY)
+    try:
+        user_id = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_USER_ID
+    return user_id if user_id > 0 else DEFAULT_USER_ID
+
+
+def current_user_id():
+    """今のリクエストの利用者 ID（app.py の before_request で g.user_id に入れておく）。"""
+    return g.get("user_id", DEFAULT_USER_ID)
@@ -1,81 +1,185 @@
+import logging
 import os
+import numpy as np
 import pandas as pd
-import pickle
-from datetime import datetime
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import OneHotEncoder
-from sqlalchemy import create_engine
-
-# 絶対パスを使って database.db を指定
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
-DATABASE_URI = f"sqlite:///{DB_PATH}"
-
-# DBエンジン作成
-engine = create_engine(DATABASE_URI)
-
-def preprocess_dates(df):
-    df['due_date'] = pd.to_datetime(df['due_date'], errors='coerce')
-    df['created_at'] = pd.to_datetime(df['created_at'], errors='coerce')
-    df = df.dropna(subset=['due_date', 'created_at'])
-    df = df.copy()  # スライス警告回避
-
-    df['days_until_due'] = (df['due_date'] - df['created_at']).dt.days
-    df['weekday'] = df['created_at'].dt.weekday
-    return df
-
-def retrain_model():
-    df = pd.read_sql(
-        """
-        SELECT subject, category, difficulty, due_date, created_at, time_spent
-        FROM task
-        WHERE time_spent IS NOT NULL
-        """,
-        engine
-    )
 
-    if df.empty:
-        print("❌ 学習に使えるデータがありません。")
-        return
+import temporal
+from db import get_engine
+from model import features, registry
+
+logger = logging.getLogger(__name__)
+
+# DBエンジン（db.py の共通設定）
+engine = get_engine()
+
+# 学習に使う CPU コア数（-1 なら全コア）
+TRAIN_N_JOBS = int(os.environ.get("TRAIN_N_JOBS", -1))
+
+# ランダムフォレストの設定（bench_train.py の結果を見て決める。0 なら深さ制限なし）
+RF_N_ESTIMATORS = int(os.environ.get("RF_N_ESTIMATORS", 100))
+RF_MAX_DEPTH = int(os.environ.get("RF_MAX_DEPTH", 0)) or None
+RF_MIN_SAMPLES_LEAF = int(os.environ.get("RF_MIN_SAMPLES_LEAF", 1))
+
+# 利用者ごとのモデルを作るのに必要な完了タスク数（少なければ共通のモデルを使い続ける）
+TENANT_MIN_ROWS = int(os.environ.get("TENANT_MIN_ROWS", 200))
+
+# 差分学習を始める最小の新規データ数（数件だけで育てた木は予測を偏らせる）
+MIN_NEW_ROWS = int(os.environ.get("MIN_NEW_ROWS", 30))
+
+# 前回の全件学習からの追加データがこの割合（かつ REFIT_MIN_ROWS 件）を超えたら全件で学習し直す
+REFIT_RATIO = 0.5
+REFIT_MIN_ROWS = 50
+
+# 完了日時付きのデータでまだ学習していないときの起点（どの epoch 秒よりも小さい値）
+NO_WATERMARK = -(2 ** 63)
 
-    df = preprocess_dates(df)
-    if df.empty:
-        print("❌ 有効な日付データがありません。")
-        return
 
-    # 説明変数と目的変数に分割
-    X_raw = df[['subject', 'category', 'difficulty', 'days_until_due', 'weekday']]
-    y = df['time_spent']
+def load_training_arrays(since=None, user_id=None):
+    """
+    学習データを特徴量ストア（model/features.py）から NumPy 配列で読み込む。
+    since を渡すと、その日時より後に完了したタスクだけを読み込む。
+    user_id を渡すとその利用者のタスクだけ、省略すると全員のタスクを読み込む。
+    アプリを通らずに入ったタスクの特徴量は、ここでまとめて作ってから読む。
+    """
+    with engine.begin() as conn:
+        features.materialize(conn)
+        arrays = features.load_training_arrays(conn, since=since, user_id=user_id)
+        vocab = features.load_vocab(conn)
+    return arrays, vocab
 
-    # カテゴリ変数エンコード
-    encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
-    X_cat = encoder.fit_transform(X_raw[['subject', 'category']])
-    X_cat_df = pd.DataFrame(X_cat, columns=encoder.get_feature_names_out(['subject', 'category']))
 
-    # 数値データと連結
-    X_final = pd.concat([X_raw.drop(columns=['subject', 'category']).reset_index(drop=True), X_cat_df], axis=1)
+def fit_encoder(arrays, vocab):
+    """学習データに出てくる教科・カテゴリだけを知っている OneHotEncoder を作る（並びは値の昇順）。"""
+    values = {code: value for (_, value), code in vocab.items()}
+    subjects = sorted({values[code] for code in np.unique(arrays.subject_code)})
+    categories = sorted({values[code] for code in np.unique(arrays.category_code)})
+    encoder = OneHotEncoder(categories=[subjects, categories], sparse_output=False, handle_unknown='ignore')
+    # カテゴリは指定済みなので、fit には列名と型が分かる 1 行だけ渡せばよい
+    return encoder.fit(pd.DataFrame({'subject': subjects[:1], 'category': categories[:1]}))
+
+
+def retrain_model(user_id=None):
+    """
+    全件で学習し直してレジストリに公開する。
+    user_id を渡すと、その利用者のデータだけで学習した専用のモデルを作る（共通のモデルより優先して使われる）。
+    """
+    arrays, vocab = load_training_arrays(user_id=user_id)
+
+    if len(arrays) == 0:
+        logger.warning("❌ 学習に使えるデータがありません。")
+        return
+    if user_id is not None and len(arrays) < TENANT_MIN_ROWS:
+        logger.info("🟡 利用者 %d のデータが %d 件しかないので、共通のモデルを使い続けます", user_id, len(arrays))
+        return
+
+    y = arrays.time_spent
+
+    # カテゴリ変数エンコード（特徴量ストアのコードから列位置を引く）
+    encoder = fit_encoder(arrays, vocab)
+    X_final, _ = features.design_matrix(arrays, *features.code_positions(encoder, vocab))
 
     # 学習・テストデータ分割
     X_train, X_test, y_train, y_test = train_test_split(X_final, y, test_size=0.2, random_state=42)
 
     # モデル学習
-    model = RandomForestRegressor()
+    model = RandomForestRegressor(
+        n_estimators=RF_N_ESTIMATORS,
+        max_depth=RF_MAX_DEPTH,
+        min_samples_leaf=RF_MIN_SAMPLES_LEAF,
+        n_jobs=TRAIN_N_JOBS,
+    )
     model.fit(X_train, y_train)
 
-    # 保存用ディレクトリ作成
-    os.makedirs("model", exist_ok=True)
-
-    # モデル保存
-    with open("model/model.pkl", "wb") as f:
-        pickle.dump(model, f)
+    # テストデータで精度を確認
+    test_mae = float(mean_absolute_error(y_test, model.predict(X_test))) if len(X_test) else None
+    if test_mae is not None:
+        logger.info("📏 テストデータの平均絶対誤差: %.1f 分（%d 件）", test_mae, len(X_test))
+
+    # 予測は 1 件ずつのことが多く、スレッドを立てる方が遅いので並列化しない
+    model.set_params(n_jobs=1)
+
+    # レジストリに新しいバージョンとして保存（動いているワーカーは次の確認時に切り替わる）
+    version = registry.publish(model, encoder, meta={
+        "trained_rows": len(arrays),
+        "full_fit_rows": len(arrays),
+        "rows_since_full_fit": 0,
+        "watermark": arrays.watermark(),
+        "test_mae": test_mae,
+    }, user_id=user_id)
+
+    logger.info("✅ モデル再学習完了（バージョン %s%s）", version, "" if user_id is None else f"、利用者 {user_id}")
+    return version
+
+
+def _since(watermark):
+    """
+    メタデータの watermark を差分学習の起点（epoch 秒）にする。
+    以前のバージョンが保存した日時の文字列も epoch 秒に直す。
+    前回の学習に完了日時付きのデータが無ければ、完了日時のあるデータがすべて新規。
+    """
+    if isinstance(watermark, str):
+        watermark = temporal.epoch_seconds(watermark)
+    return NO_WATERMARK if watermark is None else watermark
+
+
+def update_model():
+    """
+    前回の学習以降に完了したタスクだけでモデルを更新する。
+    今のフォレストに warm_start で木を足し、新しいデータで学習させる。
+    足す木の本数は学習済みの件数に対する新しいデータの割合に合わせる（木はどれも同じ重みで平均されるので、
+    新しいデータが全体に占める割合より多くの票を持たせない）。
+    前回の全件学習からの追加データが REFIT_RATIO を超えたときや、
+    エンコーダが知らない教科・カテゴリが出てきたときは全件で学習し直す。
+    """
+    meta = registry.load_meta()
+    if "full_fit_rows" not in meta:
+        return retrain_model()
+
+    arrays, vocab = load_training_arrays(since=_since(meta.get("watermark")))
+    if len(arrays) < MIN_NEW_ROWS:
+        return None
+
+    rows_since_full_fit = meta.get("rows_since_full_fit", 0) + len(arrays)
+    if rows_since_full_fit >= max(REFIT_MIN_ROWS, REFIT_RATIO * meta["full_fit_rows"]):
+        logger.info("🟡 前回の全件学習から %d 件増えたので、全件で学習し直します", rows_since_full_fit)
+        return retrain_model()
+
+    loaded = registry.load()
+    X, known = features.design_matrix(arrays, *features.code_positions(loaded.encoder, vocab))
+    if not known.all():
+        logger.info("🟡 新しい教科・カテゴリがあるので、全件で学習し直します")
+        return retrain_model()
+
+    model = loaded.model
+    trained_rows = max(meta.get("trained_rows") or meta["full_fit_rows"], 1)
+    new_trees = max(1, round(model.n_estimators * len(arrays) / trained_rows))
+    model.set_params(
+        warm_start=True,
+        n_estimators=model.n_estimators + new_trees,
+        n_jobs=TRAIN_N_JOBS,
+    )
+    model.fit(X, arrays.time_spent)
+    model.set_params(n_jobs=1)
 
-    # エンコーダ保存
-    with open("model/encoder.pkl", "wb") as f:
-        pickle.dump(encoder, f)
+    version = registry.publish(model, loaded.encoder, meta={
+        "trained_rows": meta.get("trained_rows", 0) + len(arrays),
+        "full_fit_rows": meta["full_fit_rows"],
+        "rows_since_full_fit": rows_since_full_fit,
+        "watermark": arrays.watermark() or _since(meta.get("watermark")),
+        "test_mae": meta.get("test_mae"),
+    })
+    logger.info("✅ %d 件の新しいデータで木を %d 本足してモデルを更新しました（バージョン %s）", len(arrays), new_trees, version)
+    return version
 
-    print("✅ モデル再学習完了")
 
-# モジュール単体実行時の動作
+# モジュール単体実行時の動作（python train_model.py [user_id]）
 if __name__ == "__main__":
-    retrain_model()
+    import sys
+    from log_config import setup_logging
+
+    setup_logging()
+    retrain_model(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,139 @@
+"""
+作業セッション（タイマー画面を開いてから終わるまで）の記録。
+
+start_task.html のタイマーは数十秒おきに /api/sessions/heartbeat へ経過秒数を送る。
+ハートビートは HeartbeatBuffer がワーカープロセスのメモリ上でセッションごとに最新の 1 件にまとめ、
+HEARTBEAT_FLUSH_INTERVAL 秒おきに 1 トランザクションで work_session テーブルへまとめて書き込む。
+タイマーが何千個動いていても、書き込みは 1 回の書き出しあたり数文で済む。
+
+「終わり」「いったん終了」のときは、その場で（リクエストのトランザクションの中で）セッションを閉じる。
+SESSION_ABANDON_MINUTES 分ハートビートが来ないセッションは abandoned にする（閉じ忘れたタイマーも記録に残る）。
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# まとめて書き出す間隔（秒）
+HEARTBEAT_FLUSH_INTERVAL = float(os.environ.get("HEARTBEAT_FLUSH_INTERVAL", 5))
+
+# この分数ハートビートが来なければ放置されたとみなす
+SESSION_ABANDON_MINUTES = float(os.environ.get("SESSION_ABANDON_MINUTES", 30))
+
+# 放置セッションを探す間隔（秒）
+SESSION_SWEEP_INTERVAL = 60
+
+# 1 セッションの経過秒数の上限（壊れた値・いたずらよけ）
+MAX_SESSION_SECONDS = 24 * 60 * 60
+
+# 状態。finished / stopped は閉じたセッションで、遅れて届いたハートビートでは開き直さない
+ACTIVE, PAUSED, FINISHED, STOPPED, ABANDONED = "active", "paused", "finished", "stopped", "abandoned"
+
+# タスクが利用者のものであるときだけ書く。経過秒数と最終時刻は大きい方を残す（どのワーカーに届いても順不同でよい）
+UPSERT_SQL = text("""
+    INSERT INTO work_session (session_key, user_id, task_id, started_at, last_seen_at, active_seconds, status, ended_at)
+    SELECT :session_key, :user_id, :task_id, :seen_at, :seen_at, :active_seconds, :status, :ended_at
+    FROM task WHERE id = :task_id AND user_id = :user_id
+    ON CONFLICT (session_key) DO UPDATE SET
+        last_seen_at = MAX(work_session.last_seen_at, excluded.last_seen_at),
+        active_seconds = MAX(work_session.active_seconds, excluded.active_seconds),
+        status = CASE WHEN work_session.status IN ('finished', 'stopped') AND excluded.ended_at IS NULL
+                      THEN work_session.status ELSE excluded.status END,
+        ended_at = COALESCE(excluded.ended_at, work_session.ended_at)
+    WHERE work_session.user_id = excluded.user_id AND work_session.task_id = excluded.task_id
+""")
+
+
+def _row(user_id, session_key, task_id, elapsed_seconds, status, seen_at, ended_at=None):
+    return {
+        "session_key": str(session_key)[:64],
+        "user_id": int(user_id),
+        "task_id": int(task_id),
+        "active_seconds": min(max(float(elapsed_seconds), 0.0), MAX_SESSION_SECONDS),
+        "status": status,
+        "seen_at": seen_at,
+        "ended_at": ended_at,
+    }
+
+
+def end_session(conn, user_id, session_key, task_id, elapsed_seconds, status):
+    """セッションを閉じる（finish_task / partial_finish_task のトランザクションの中で呼ぶ）。"""
+    now = datetime.now()
+    conn.execute(UPSERT_SQL, _row(user_id, session_key, task_id, elapsed_seconds, status, now, now))
+
+
+class HeartbeatBuffer:
+    def __init__(self, engine, interval=HEARTBEAT_FLUSH_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._pending = {}  # (user_id, session_key) -> 書き込む行
+        self._lock = threading.Lock()
+        self._thread = None
+        self._swept_at = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.running:
+            self._thread = threading.Thread(target=self._run, name="heartbeat-flusher", daemon=True)
+            self._thread.start()
+        return self
+
+    def record(self, user_id, session_key, task_id, elapsed_seconds, running):
+        """ハートビートを 1 件受け取る。同じセッションの未書き出し分は上書きする（DB には触らない）。"""
+        row = _row(user_id, session_key, task_id, elapsed_seconds, ACTIVE if running else PAUSED, datetime.now())
+        with self._lock:
+            self._pending[(row["user_id"], row["session_key"])] = row
+        metrics.inc("heartbeats_total")
+        if not self.running:
+            self.flush()
+
+    def discard(self, user_id, session_key):
+        """閉じたセッションの未書き出し分を捨てる（閉じたあとに古い値で上書きしないように）。"""
+        with self._lock:
+            self._pending.pop((int(user_id), str(session_key)[:64]), None)
+
+    def flush(self):
+        """溜まっているハートビートを 1 トランザクションで書き、放置セッションを閉じる。書いた件数を返す。"""
+        with self._lock:
+            rows, self._pending = list(self._pending.values()), {}
+        sweep = time.monotonic() - self._swept_at >= SESSION_SWEEP_INTERVAL
+        if not rows and not sweep:
+            return 0
+        try:
+            with self.engine.begin() as conn:
+                if rows:
+                    conn.execute(UPSERT_SQL, rows)
+                if sweep:
+                    cutoff = datetime.now() - timedelta(minutes=SESSION_ABANDON_MINUTES)
+                    conn.execute(text("""
+                        UPDATE work_session SET status = 'abandoned', ended_at = last_seen_at
+                        WHERE status IN ('active', 'paused') AND last_seen_at < :cutoff
+                    """), {"cutoff": cutoff})
+        except Exception:
+            # 書けなかった分は、そのあとに届いた新しい値が無ければ次回に回す
+            with self._lock:
+                for row in rows:
+                    self._pending.setdefault((row["user_id"], row["session_key"]), row)
+            raise
+        if sweep:
+            self._swept_at = time.monotonic()
+        metrics.inc("heartbeat_flush_rows_total", len(rows))
+        return len(rows)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("❌ ハートビートの書き込みに失敗しました: %s", e)